@@ -0,0 +1,759 @@
+"""This script times the faster code paths of the pipeline against the code paths they replace
+and checks that both produce the same output.
+
+Usage: python benchmark.py <benchmark> <args>
+- scanner <pgn_file>: games/sec of chess.pgn.read_game vs. pgn_scanner in both analyzers
+- board-replay <pgn_file>: calculate_gi with the side to move from node.board() and Cp(cp).wdl() vs. from ply
+  parity and the expected value table
+- expected-value: Cp(cp).wdl() + calculate_expected_value vs. the expected_value_table lookup
+- kernel <pgn_file>: per-game calculate_acpl + gi_and_gpl vs. the NumPy calculate_batch_stats kernel
+- json-to-csv <json_file or game count>: json_normalize + pd.concat per game vs. the column lists
+  of json_to_csv_converter; with a number, a JSON file with that many synthetic games is generated
+- split <pgn_file>: decoding each 10 MB chunk and re.split vs. the bytes splitter of evaluated_games_extractor
+- sketch <game_table or game count>: exact per-player medians and percentiles vs. quantile sketches of
+  several compressions (rank error and memory); with a number, a synthetic game table is generated
+- player-stats <game_table or game count>: the per-column groupbys and outer merges previously in
+  csv_to_player_stats*.py vs. the single groupby of player_stats_engine, with and without adjusted gi
+- combine <game_table or game count> [file count]: pd.concat in a loop vs. the streaming combine_csv_files
+  of game_table on that many monthly CSV files (100 by default), serial and with 4 threads
+- load <game_table>: load time and memory of read_game_table with inferred and with compact dtypes,
+  for all columns and for the columns of csv_to_player_stats.py
+- recompute <pgn_file>: analyzing the PGN file (with --fast-scan) vs. recomputing the game data from an eval store,
+  in pgn_evaluation_analyzer (per game) and pgn_evaluation_fast_analyzer (with NumPy)
+- schemes <pgn_file>: one run of the analyzers (with --fast-scan) per built-in scoring scheme vs. one run that
+  calculates all of them in one pass, checking the column groups against the separate runs
+- metrics <pgn_file>: one traversal of each game per metric of game_metrics vs. all the metrics in one traversal,
+  for both built-in scoring schemes, and the time spent in each metric with --metric-timing
+"""
+
+import glob
+import json
+import re
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import chess.pgn
+import evaluated_games_extractor
+from chess.engine import Cp
+import expected_value_table
+import json_to_csv_converter
+import pgn_evaluation_analyzer
+import pgn_evaluation_fast_analyzer
+import player_accumulators
+import player_stats_engine
+import csv_to_player_stats
+from game_table import combine_csv_files, read_game_table
+from eval_store import close_eval_store, create_eval_store, load_eval_store
+from scoring_schemes import SCORING_SCHEMES, scheme_prefix
+from game_metrics import METRICS, build_metric_set, print_metric_timing, run_metrics
+from pgn_scanner import parse_clock, scan_games
+
+# Function to time a function and return its result together with the elapsed seconds
+def timed(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+def print_comparison(name, current_seconds, new_seconds, count, unit, identical):
+    print(f"{name}:")
+    print(f"  current path: {count / current_seconds:,.1f} {unit}/sec ({current_seconds:.2f} s)")
+    print(f"  new path:     {count / new_seconds:,.1f} {unit}/sec ({new_seconds:.2f} s)")
+    print(f"  speedup: {current_seconds / new_seconds:.1f}x, identical output: {identical}")
+
+# Benchmark reading games with chess.pgn.read_game vs. pgn_scanner
+def benchmark_scanner(pgn_file_path):
+    def fast_analyzer(fast_scan):
+        with open(pgn_file_path) as pgn:
+            return [(dict(headers), pawns_list) for headers, pawns_list in
+                    pgn_evaluation_fast_analyzer.read_pawn_evals(pgn, fast_scan)]
+
+    def analyzer(fast_scan):
+        with open(pgn_file_path) as pgn:
+            return list(pgn_evaluation_analyzer.analyze_games(pgn, 'Standard', fast_scan))
+
+    current, current_seconds = timed(fast_analyzer, False)
+    new, new_seconds = timed(fast_analyzer, True)
+    print_comparison("pgn_evaluation_fast_analyzer.read_pawn_evals", current_seconds, new_seconds,
+                     len(current), "games", current == new)
+
+    current, current_seconds = timed(analyzer, False)
+    new, new_seconds = timed(analyzer, True)
+    print_comparison("pgn_evaluation_analyzer.analyze_games", current_seconds, new_seconds,
+                     len(current), "games", current == new)
+
+# Reference implementation of the blunder, mistake and inaccuracy counts, previously in pgn_evaluation_analyzer.py
+def blunder_mistake_inaccuracy(exp_point_loss, is_white, counts, scoring_system):
+    if scoring_system == "NorwayChess":
+        blunder_threshold, mistake_threshold = 1.25, 0.625
+    else:  # Standard
+        blunder_threshold, mistake_threshold = 0.4, 0.2
+
+    if exp_point_loss >= blunder_threshold:
+        key = 'white_blunder' if is_white else 'black_blunder'
+    elif exp_point_loss >= mistake_threshold:
+        key = 'white_mistake' if is_white else 'black_mistake'
+    else:
+        key = 'white_inaccuracy' if is_white else 'black_inaccuracy'
+    counts[key] += 1
+
+    return counts
+
+# Reference implementation of calculate_gi, previously in pgn_evaluation_analyzer.py: the side to move from
+# node.board() and the expected values from Cp(cp).wdl(). It differs from the original in three ways:
+# the counts are those of the side that moved (see README.md), the GI is calculated once after the loop, and a
+# game without an evaluated move has an expectation of 0, so that such games give a result instead of raising
+def calculate_gi_by_replay(game, scoring_system):
+    node = game
+    white_gpl = black_gpl = white_tcpl = black_tcpl = 0
+    white_move_number = black_move_number = 0
+    postmove_exp_white = postmove_exp_black = 0
+    counts = {
+        "white_blunder": 0, "black_blunder": 0,
+        "white_mistake": 0, "black_mistake": 0,
+        "white_inaccuracy": 0, "black_inaccuracy": 0
+    }
+    while not node.is_end():
+        premove_eval = pgn_evaluation_analyzer.extract_eval_from_node(node)
+        first_move = False
+        if premove_eval is None:
+            # Evaluation of the initial position
+            premove_eval = Cp(30)
+            first_move = True
+        else:
+            premove_eval = Cp(int(100*premove_eval))
+        win_draw_loss = premove_eval.wdl()
+        win_prob, draw_prob, loss_prob = win_draw_loss.wins / 1000, win_draw_loss.draws / 1000, win_draw_loss.losses / 1000
+        turn = "White" if node.board().turn == chess.WHITE else "Black"
+        premove_exp_white, premove_exp_black = calculate_expected_value(
+            win_prob, draw_prob, loss_prob, turn, scoring_system)
+        node = node.variation(0)
+        postmove_eval = pgn_evaluation_analyzer.extract_eval_from_node(node)
+        if postmove_eval is not None:
+            postmove_eval = Cp(int(100*postmove_eval))
+            win_draw_loss = postmove_eval.wdl()
+            win_prob, draw_prob, loss_prob = win_draw_loss.wins / 1000, win_draw_loss.draws / 1000, win_draw_loss.losses / 1000
+            turn = "White" if node.board().turn == chess.WHITE else "Black"
+            postmove_exp_white, postmove_exp_black = calculate_expected_value(win_prob, draw_prob, loss_prob, turn, scoring_system)
+            if node.board().turn == chess.BLACK:
+                # Assuming that first move's loss is 0
+                if first_move is True:
+                    exp_white_point_loss = 0
+                    white_cp_loss = 0
+                else:
+                    exp_white_point_loss = premove_exp_white - postmove_exp_white
+                    white_cp_loss = int(str(premove_eval))+int(str(postmove_eval))
+                white_gpl += exp_white_point_loss
+                white_tcpl += white_cp_loss
+                counts = blunder_mistake_inaccuracy(exp_white_point_loss, True, counts, scoring_system)
+                white_move_number += 1
+            else:
+                exp_black_point_loss = premove_exp_black - postmove_exp_black
+                black_cp_loss = int(str(premove_eval))+int(str(postmove_eval))
+                black_gpl += exp_black_point_loss
+                black_tcpl += black_cp_loss
+                counts = blunder_mistake_inaccuracy(exp_black_point_loss, False, counts, scoring_system)
+                black_move_number += 1
+
+    win_points, draw_points = (3, 1.25) if scoring_system == "NorwayChess" else (1, 0.5)
+    result = game.headers.get('Result')
+    if result == '1-0':
+        white_gi, black_gi = win_points - white_gpl, -black_gpl
+    elif result == '0-1':
+        white_gi, black_gi = -white_gpl, win_points - black_gpl
+    elif result == '1/2-1/2':
+        white_gi, black_gi = draw_points - white_gpl, draw_points - black_gpl
+    else:
+        white_gi, black_gi = postmove_exp_white - white_gpl, postmove_exp_black - black_gpl
+
+    white_avg_gpl = white_gpl / white_move_number if white_move_number != 0 else 0
+    black_avg_gpl = black_gpl / black_move_number if black_move_number != 0 else 0
+    white_acpl = white_tcpl / white_move_number if white_move_number != 0 else 0
+    black_acpl = black_tcpl / black_move_number if black_move_number != 0 else 0
+
+    if result == '1-0':
+        whiteResult, blackResult = 1, 0
+    elif result == '0-1':
+        whiteResult, blackResult = 0, 1
+    elif result == '1/2-1/2':
+        whiteResult, blackResult = 0.5, 0.5
+    else:
+        whiteResult, blackResult = '...', '...'
+    dates = None
+    if "UTCDate" in game.headers:
+        dates = game.headers["UTCDate"]
+    elif "Date" in game.headers:
+        dates = game.headers["Date"]
+
+    return {
+        "white_gi": round(white_gi, 4), "black_gi": round(black_gi, 4),
+        "white_gpl": round(white_gpl, 4), "black_gpl": round(black_gpl, 4),
+        "white_acpl": round(white_acpl, 4), "black_acpl": round(black_acpl, 4),
+        "white_avg_gpl": round(white_avg_gpl, 4), "black_avg_gpl": round(black_avg_gpl, 4),
+        "white_tcpl": white_tcpl, "black_tcpl": black_tcpl,
+        "white_move_number": white_move_number, "black_move_number": black_move_number,
+        "White": game.headers.get("White", None),
+        "Black": game.headers.get("Black", None),
+        "Event": game.headers.get("Event", None),
+        "Site": game.headers.get("Site", None),
+        "Round": game.headers.get("Round", None),
+        "WhiteElo": game.headers.get("WhiteElo", None),
+        "BlackElo": game.headers.get("BlackElo", None),
+        "WhiteResult": whiteResult,
+        "BlackResult": blackResult,
+        "Date": dates,
+        "counts": counts,
+    }
+
+# Benchmark calculate_gi with node.board() replay and Cp(cp).wdl() (calculate_gi_by_replay) vs. ply parity and
+# the expected value table, checking that every GI/GPL/ACPL value and blunder count is identical
+def benchmark_board_replay(pgn_file_path):
+    games = []
+    with open(pgn_file_path) as pgn:
+        while True:
+            game = chess.pgn.read_game(pgn)
+            if game is None:
+                break
+            games.append(game)
+
+    metric_set = build_metric_set('Standard')
+
+    def analyze(calculate_gi, scoring):
+        return [calculate_gi(game, scoring) for game in games]
+
+    current, current_seconds = timed(analyze, calculate_gi_by_replay, 'Standard')
+    new, new_seconds = timed(analyze, pgn_evaluation_analyzer.calculate_gi, metric_set)
+    print_comparison("pgn_evaluation_analyzer.calculate_gi", current_seconds, new_seconds,
+                     len(games), "games", current == new)
+
+# Reference implementation of the expected value of a position, previously in pgn_evaluation_analyzer.py
+def calculate_expected_value(win_prob, draw_prob, loss_prob, turn, scoring_system):
+    if scoring_system == "Standard":
+        if turn == "White":
+            expected_value_white = win_prob * 1 + draw_prob * 0.5
+            expected_value_black = loss_prob * 1 + draw_prob * 0.5
+        else:
+            expected_value_white = loss_prob * 1 + draw_prob * 0.5
+            expected_value_black = win_prob * 1 + draw_prob * 0.5
+    else:  # NorwayChess
+        if turn == "White":
+            expected_value_white = win_prob * 3 + draw_prob * 1.25
+            expected_value_black = loss_prob * 3 + draw_prob * 1.25
+        else:
+            expected_value_white = loss_prob * 3 + draw_prob * 1.25
+            expected_value_black = win_prob * 3 + draw_prob * 1.25
+    return expected_value_white, expected_value_black
+
+# Benchmark the expected value lookup table, checking it against Cp(cp).wdl() for every
+# centipawn value in [-20000, 20000], both scoring systems and both sides to move
+def benchmark_expected_value():
+    cps = range(-20000, 20001)
+    for scoring_system in expected_value_table.SCORING_SYSTEMS:
+        def compute():
+            values = []
+            for cp in cps:
+                win_draw_loss = Cp(cp).wdl()
+                win_prob, draw_prob, loss_prob = win_draw_loss.wins / 1000, win_draw_loss.draws / 1000, win_draw_loss.losses / 1000
+                for turn in ("White", "Black"):
+                    values.append(calculate_expected_value(win_prob, draw_prob, loss_prob, turn, scoring_system))
+            return values
+
+        def lookup():
+            return [expected_value_table.lookup_expected_value(cp, turn, scoring_system)
+                    for cp in cps for turn in ("White", "Black")]
+
+        current, current_seconds = timed(compute)
+        new, new_seconds = timed(lookup)
+        print_comparison(f"expected value ({scoring_system})", current_seconds, new_seconds,
+                         len(current), "lookups", current == new)
+
+# Reference implementations of the per-game ACPL, GPL and GI of the fast analyzer, replaced by its batched
+# NumPy kernel calculate_batch_stats. Function to calculate the ACPL for both players
+def calculate_acpl(pawns_list):
+    white_losses, black_losses = [], []
+    for i in range(1, len(pawns_list)):
+        centipawn_loss = 100*(pawns_list[i] - pawns_list[i - 1])
+        if i % 2 == 1:  # White's turn
+            white_losses.append(-centipawn_loss)
+        else:  # Black's turn
+            black_losses.append(centipawn_loss)
+    white_acpl = sum(white_losses) / len(white_losses) if white_losses else 0
+    black_acpl = sum(black_losses) / len(black_losses) if black_losses else 0
+    return white_acpl, black_acpl
+
+def calculate_gi_by_result(white_gpl, black_gpl, game_result, postmove_exp_white, postmove_exp_black):
+    # Calculate GI based on game result
+    if game_result == '1/2-1/2':
+        white_gi = 0.5 - white_gpl
+        black_gi = 0.5 - black_gpl
+    elif game_result == '1-0':
+        white_gi = 1 - white_gpl
+        black_gi = -black_gpl
+    elif game_result == '0-1':
+        black_gi = 1 - black_gpl
+        white_gi = -white_gpl
+    else:
+        white_gi = postmove_exp_white - white_gpl
+        black_gi = postmove_exp_black - black_gpl
+
+    return white_gi, black_gi
+
+# Function to calculate GI and GPL in the usual way
+def gi_and_gpl(pawns_list, game_result, WhiteElo, BlackElo):
+    white_gpl, black_gpl = 0, 0
+    white_gi, black_gi = 0, 0
+    white_move_number, black_move_number = 0, 0
+
+    for i, cp in enumerate(pawns_list):
+        # Determine whose turn it is
+        turn = "White" if i % 2 == 0 else "Black"
+        
+        # Convert pawn value to centipawns
+        # handle the initial case
+        premove_cp = int(100 * pawns_list[i-1] if i > 0 else 100 * pawns_list[1])
+        postmove_cp = int(100 * cp)
+
+        # Look up expected values before and after the move (same as Cp(cp).wdl()
+        # followed by calculate_expected_value)
+        premove_exp_white, premove_exp_black = expected_value_table.lookup_expected_value(premove_cp, turn)
+        postmove_exp_white, postmove_exp_black = expected_value_table.lookup_expected_value(postmove_cp, turn)
+
+        # Calculate GPL and update move number
+        if turn == "Black":
+            exp_white_point_loss = postmove_exp_white - premove_exp_white
+            white_gpl += exp_white_point_loss
+            white_move_number += 1
+        else:
+            exp_black_point_loss = premove_exp_black - postmove_exp_black
+            black_gpl += exp_black_point_loss
+            black_move_number += 1
+    # Calculate GI based on game result
+    white_gi, black_gi = calculate_gi_by_result(white_gpl, black_gpl, game_result, postmove_exp_white, postmove_exp_black)
+    # Adjust the GI scores with respect to the opponent's rating (if applicable)
+    if WhiteElo is not None and BlackElo is not None:
+        white_gi = calculate_adjusted_gi(white_gi, BlackElo, 2800)
+        black_gi = calculate_adjusted_gi(black_gi, WhiteElo, 2800)
+    # Record raw GIs
+    white_gi_raw, black_gi_raw = white_gi, black_gi
+    # Normalize GI
+    white_gi = pgn_evaluation_fast_analyzer.calculate_normalized_gi(white_gi)
+    black_gi = pgn_evaluation_fast_analyzer.calculate_normalized_gi(black_gi)
+    return white_gi, black_gi, white_gpl, black_gpl, white_gi_raw, black_gi_raw, white_move_number, black_move_number-1
+
+# Adjust the GI score with respect to the opponent's rating
+def calculate_adjusted_gi(gi, opponent_elo, reference_elo):
+    return gi - (1 - 2 * pgn_evaluation_fast_analyzer.expected_score(opponent_elo, reference_elo)) * abs(gi)
+
+# Benchmark the per-game GI/GPL/ACPL loops of the fast analyzer against the batched NumPy kernel
+def benchmark_kernel(pgn_file_path):
+    games = []
+    with open(pgn_file_path) as pgn:
+        for headers, pawns_list in pgn_evaluation_fast_analyzer.read_pawn_evals(pgn, fast_scan=True):
+            if len(pawns_list) >= 2:
+                white_elo = int(headers["WhiteElo"]) if headers.get("WhiteElo") else None
+                black_elo = int(headers["BlackElo"]) if headers.get("BlackElo") else None
+                games.append((pawns_list, headers.get("Result"), white_elo, black_elo))
+
+    def per_game():
+        rows = []
+        for pawns_list, game_result, white_elo, black_elo in games:
+            white_acpl, black_acpl = calculate_acpl(pawns_list)
+            white_gi, black_gi, white_gpl, black_gpl, white_gi_raw, black_gi_raw, white_move_number, black_move_number = \
+                gi_and_gpl(pawns_list, game_result, white_elo, black_elo)
+            rows.append((white_gi, black_gi, white_gpl, black_gpl, white_acpl, black_acpl,
+                         white_gi_raw, black_gi_raw, white_move_number, black_move_number))
+        return rows
+
+    def batched():
+        pawns_lists, game_results, white_elos, black_elos = zip(*games)
+        evals, offsets = pgn_evaluation_fast_analyzer.flatten_pawns_lists(pawns_lists)
+        stats = pgn_evaluation_fast_analyzer.calculate_batch_stats(evals, offsets, game_results, white_elos, black_elos)
+        return list(zip(*(values.tolist() for values in stats.values())))
+
+    current, current_seconds = timed(per_game)
+    new, new_seconds = timed(batched)
+    print_comparison("pgn_evaluation_fast_analyzer GI/GPL/ACPL", current_seconds, new_seconds,
+                     len(games), "games", current == new)
+
+# Function to write a JSON file in the format of pgn_evaluation_analyzer with synthetic games
+def write_synthetic_games_json(json_file_path, game_count):
+    random.seed(0)
+    players = [f"Player{i}" for i in range(10000)]
+    aggregated_data = {}
+    for key in range(1, game_count + 1):
+        white_gpl, black_gpl = random.random(), random.random()
+        aggregated_data[key] = {
+            "white_gi": round(1 - white_gpl, 4), "black_gi": round(-black_gpl, 4),
+            "white_gpl": round(white_gpl, 4), "black_gpl": round(black_gpl, 4),
+            "white_acpl": round(random.uniform(0, 100), 4), "black_acpl": round(random.uniform(0, 100), 4),
+            "white_move_number": random.randint(10, 80), "black_move_number": random.randint(10, 80),
+            "White": random.choice(players), "Black": random.choice(players),
+            "Event": "Rated Blitz game", "Site": f"https://lichess.org/{key:08d}", "Round": "-",
+            "WhiteElo": str(random.randint(1000, 2800)), "BlackElo": str(random.randint(1000, 2800)),
+            "WhiteResult": 1, "BlackResult": 0, "Date": "2023.01.01",
+            "counts": {"white_blunder": random.randint(0, 5), "black_blunder": random.randint(0, 5)},
+        }
+    with open(json_file_path, 'w') as f:
+        json.dump(aggregated_data, f)
+
+# Benchmark building the game table from a JSON file
+def benchmark_json_to_csv(json_file_or_game_count):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        json_file_path = json_file_or_game_count
+        if json_file_or_game_count.isdigit():
+            json_file_path = os.path.join(temp_dir, 'games.json')
+            write_synthetic_games_json(json_file_path, int(json_file_or_game_count))
+
+        def per_game_frames():
+            data_list = []
+            with open(json_file_path) as f:
+                for key, data in json.load(f).items():
+                    data['White'] = json_to_csv_converter.extract_last_name(data.get('White', ''))
+                    data['Black'] = json_to_csv_converter.extract_last_name(data.get('Black', ''))
+                    data_list.append(pd.json_normalize(data))
+            return pd.concat(data_list, ignore_index=True)
+
+        def column_lists():
+            columns = {}
+            json_to_csv_converter.process_json_file(json_file_path, columns)
+            return pd.DataFrame(columns)
+
+        current, current_seconds = timed(per_game_frames)
+        new, new_seconds = timed(column_lists)
+        print_comparison("json_to_csv_converter", current_seconds, new_seconds,
+                         len(current), "games", current.to_csv(index=False) == new.to_csv(index=False))
+
+# Benchmark splitting decompressed data into games, checking that both splitters find the same games
+def benchmark_split(pgn_file_path):
+    with open(pgn_file_path, 'rb') as f:
+        data = f.read()
+    chunk_size = 1024 * 1024 * 10
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+    def decode_and_split():
+        games = []
+        previous_data = ''
+        for chunk in chunks:
+            split_games = re.split(r'\n\n(?=\[Event)', previous_data + chunk.decode('utf-8'))
+            games.extend(split_games[:-1])
+            previous_data = split_games[-1]
+        games.append(previous_data)
+        return games
+
+    def split_bytes():
+        games = []
+        pending = b''
+        for chunk in chunks:
+            split_games, pending = evaluated_games_extractor.split_chunk(pending, chunk)
+            games.extend(split_games)
+        games.append(pending)
+        return games
+
+    current, current_seconds = timed(decode_and_split)
+    new, new_seconds = timed(split_bytes)
+    print_comparison("evaluated_games_extractor.split_chunk", current_seconds, new_seconds,
+                     len(data) / (1024 * 1024), "MB", [game.encode('utf-8') for game in current] == new)
+
+# Function to build a game table with the columns used by csv_to_player_stats.py and synthetic values
+def synthetic_game_table(game_count, player_count=200):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'White': rng.integers(player_count, size=game_count).astype(str),
+        'Black': rng.integers(player_count, size=game_count).astype(str),
+        'white_move_number': rng.integers(10, 80, size=game_count),
+        'black_move_number': rng.integers(10, 80, size=game_count),
+    })
+    for side in ('white', 'black'):
+        df[f'{side}_gi'] = rng.normal(0.2, 1.4, size=game_count).round(4)
+        df[f'{side}_gpl'] = rng.exponential(0.5, size=game_count).round(4)
+        df[f'{side}_acpl'] = rng.lognormal(3, 1, size=game_count).round(4)
+        df[f'adjusted_{side}_gi'] = df[f'{side}_gi'] - rng.random(size=game_count)
+    return df
+
+# Benchmark the per-player medians and percentiles of quantile sketches against the exact values.
+# The rank error is the distance between the fraction of a player's values below the estimate and q.
+def benchmark_sketch(game_table_or_game_count):
+    if game_table_or_game_count.isdigit():
+        df = synthetic_game_table(int(game_table_or_game_count))
+    else:
+        df = read_game_table(game_table_or_game_count)
+    quantiles = [0.1, 0.5, 0.9]
+
+    exact = {}
+    _, exact_seconds = timed(player_accumulators.add_game_table, exact, df)
+    exact_bytes = sum(len(values) * 8 for accumulator in exact.values() for values in accumulator['values'].values())
+    print(f"exact: {len(exact)} players, {exact_seconds:.2f} s, {exact_bytes / 1024:,.0f} KB of values")
+
+    for compression in (25, 50, 100, 200):
+        sketched = {}
+        _, seconds = timed(player_accumulators.add_game_table, sketched, df, compression)
+        max_rank_error = 0.0
+        for player, accumulator in exact.items():
+            for name, values in accumulator['values'].items():
+                values = np.sort(np.frombuffer(values))
+                for q in quantiles:
+                    estimate = player_accumulators.player_quantile(sketched[player], name, q)
+                    # Any estimate between two equal exact values counts as the same rank
+                    low = np.searchsorted(values, estimate, side='left') / len(values)
+                    high = np.searchsorted(values, estimate, side='right') / len(values)
+                    max_rank_error = max(max_rank_error, 0.0 if low <= q <= high else min(abs(low - q), abs(high - q)))
+        sketch_bytes = sum(sketch['means'].buffer_info()[1] * 16
+                           for accumulator in sketched.values() for sketch in accumulator['sketches'].values())
+        print(f"sketch compression {compression}: {seconds:.2f} s, {sketch_bytes / 1024:,.0f} KB of centroids, "
+              f"max rank error {max_rank_error:.4f} at q = {quantiles}")
+
+# Function to calculate the player stats with the per-column groupbys and outer merges
+# previously used by csv_to_player_stats.py and csv_to_player_stats_non-adjusted_gi.py
+def player_stats_by_merges(df, value_names):
+    def calculate_sum(group_col, value_col, prefix):
+        sums = df.groupby(group_col, observed=True).agg({value_col: 'sum'}).reset_index()
+        sums.columns = ['Player', f'{prefix}_sum']
+        return sums
+
+    def calculate_games(player_col):
+        game_count = df[player_col].value_counts().reset_index()
+        game_count.columns = ['Player', f'{player_col}_games']
+        return game_count
+
+    def merge_dataframes(dfs):
+        merged_df = dfs[0]
+        for other in dfs[1:]:
+            merged_df = pd.merge(merged_df, other, on='Player', how='outer').fillna(0)
+        return merged_df
+
+    sums = []
+    for name in value_names:
+        white_column, black_column = player_stats_engine.VALUE_COLUMNS[name]
+        sums.append(calculate_sum('White', white_column, white_column))
+        sums.append(calculate_sum('Black', black_column, black_column))
+    total_games = pd.merge(calculate_games('White'), calculate_games('Black'), on='Player', how='outer').fillna(0)
+    total_games['total_game_count'] = total_games['White_games'] + total_games['Black_games']
+    total_moves = pd.merge(calculate_sum('White', 'white_move_number', 'white_move'),
+                           calculate_sum('Black', 'black_move_number', 'black_move'), on='Player', how='outer').fillna(0)
+    total_moves['total_moves'] = total_moves['white_move_sum'] + total_moves['black_move_sum']
+
+    combined_df = pd.concat([
+        df[['White'] + [player_stats_engine.VALUE_COLUMNS[name][0] for name in value_names]].set_axis(['Player'] + value_names, axis=1),
+        df[['Black'] + [player_stats_engine.VALUE_COLUMNS[name][1] for name in value_names]].set_axis(['Player'] + value_names, axis=1),
+    ])
+    statistics = []
+    for name in value_names:
+        stats = combined_df.groupby('Player', observed=True).agg(median=(name, 'median'), var=(name, 'var'),
+                                                                 std=(name, 'std')).reset_index()
+        statistics.append(stats.rename(columns={'median': f'{name}_median', 'var': f'{name}_var', 'std': f'{name}_std'}))
+
+    total_sums = merge_dataframes(sums + [total_games, total_moves[['Player', 'total_moves']]])
+    for name in ('gi', 'gpl', 'acpl'):
+        total_sums[f'total_{name}_sum'] = total_sums[f'white_{name}_sum'] + total_sums[f'black_{name}_sum']
+    player_stats = merge_dataframes([total_sums] + statistics)
+    for name in ('gi', 'gpl', 'acpl'):
+        player_stats[f'avg_{name}'] = player_stats[f'total_{name}_sum'] / player_stats['total_game_count']
+    if 'adjusted_gi' in value_names:
+        player_stats['adjusted_avg_gi'] = (player_stats['adjusted_white_gi_sum'] + player_stats['adjusted_black_gi_sum']) / player_stats['total_game_count']
+    return player_stats
+
+# Benchmark the player stats of csv_to_player_stats.py and csv_to_player_stats_non-adjusted_gi.py
+def benchmark_player_stats(game_table_or_game_count):
+    if game_table_or_game_count.isdigit():
+        df = synthetic_game_table(int(game_table_or_game_count), player_count=max(200, int(game_table_or_game_count) // 50))
+    else:
+        df = read_game_table(game_table_or_game_count)
+
+    for script, value_names in (('csv_to_player_stats', ['gi', 'gpl', 'acpl', 'adjusted_gi']),
+                                ('csv_to_player_stats_non-adjusted_gi', ['gi', 'gpl', 'acpl'])):
+        current, current_seconds = timed(player_stats_by_merges, df, value_names)
+        new, new_seconds = timed(player_stats_engine.calculate_player_stats, df, value_names)
+        print_comparison(script, current_seconds, new_seconds, len(df), "games",
+                         current.to_csv(index=False) == new.to_csv(index=False))
+
+# Function to time a function and measure the peak memory it allocates with tracemalloc
+def timed_peak_memory(function, *args):
+    tracemalloc.start()
+    result, seconds = timed(function, *args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+# Benchmark combining monthly CSV game tables, checking that both outputs have the same rows
+def benchmark_combine(game_table_or_game_count, file_count='100'):
+    if game_table_or_game_count.isdigit():
+        df = synthetic_game_table(int(game_table_or_game_count))
+    else:
+        df = read_game_table(game_table_or_game_count)
+    file_count = int(file_count)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        rows_per_file = -(-len(df) // file_count)
+        for index in range(file_count):
+            df.iloc[index * rows_per_file:(index + 1) * rows_per_file].to_csv(
+                os.path.join(temp_dir, f'month{index:03d}.csv'), index=False)
+        total_mb = sum(os.path.getsize(f) for f in glob.glob(os.path.join(temp_dir, '*.csv'))) / (1024 * 1024)
+
+        # combine_csv_files previously in csv_to_player_stats*.py and chess_stats_summarizer.py
+        def concat_in_loop():
+            combined_df = pd.DataFrame()
+            for file in sorted(glob.glob(os.path.join(temp_dir, 'month*.csv'))):
+                combined_df = pd.concat([combined_df, pd.read_csv(file)], ignore_index=True)
+            combined_df.to_csv(os.path.join(temp_dir, 'concat.out'), index=False)
+            return combined_df
+
+        # Peak memory is measured in a second run, since tracemalloc slows pandas down
+        current, current_seconds = timed(concat_in_loop)
+        current_peak = timed_peak_memory(concat_in_loop)[2]
+        for jobs in (1, 4):
+            new_path, new_seconds = timed(combine_csv_files, temp_dir, f'combined{jobs}.out', jobs)
+            new_peak = timed_peak_memory(combine_csv_files, temp_dir, f'combined{jobs}.out', jobs)[2]
+            # Compared with the concatenated frame rather than the file written from it: pd.read_csv
+            # does not round-trip every float, so rewriting the table changed the last digit of some values
+            print_comparison(f"combine_csv_files of {file_count} files, jobs={jobs}", current_seconds, new_seconds,
+                             total_mb, "MB", current.equals(pd.read_csv(new_path)))
+            print(f"  peak memory: {current_peak / (1024 * 1024):,.1f} MB vs. {new_peak / (1024 * 1024):,.1f} MB")
+
+# Benchmark loading the game table with inferred dtypes vs. the declared compact dtypes of game_table
+def benchmark_load(game_table_path):
+    for name, columns in (('all columns', None), ('csv_to_player_stats columns', csv_to_player_stats.GAME_COLUMNS)):
+        current, current_seconds = timed(read_game_table, game_table_path, columns)
+        new, new_seconds = timed(read_game_table, game_table_path, columns, True)
+        print_comparison(f"read_game_table, {name}", current_seconds, new_seconds, len(current), "games",
+                         list(current.columns) == list(new.columns) and len(current) == len(new))
+        current_mb = current.memory_usage(deep=True).sum() / (1024 * 1024)
+        new_mb = new.memory_usage(deep=True).sum() / (1024 * 1024)
+        print(f"  memory: {current_mb:,.1f} MB vs. {new_mb:,.1f} MB")
+
+# Benchmark analyzing a PGN file vs. recomputing the game data from the eval store saved by the analysis
+def benchmark_recompute(pgn_file_path):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store_path = os.path.join(temp_dir, 'evals')
+
+        def analyze():
+            eval_store = create_eval_store(store_path)
+            games_data = list(pgn_evaluation_analyzer.analyze_pgn_files([pgn_file_path], 'Standard', fast_scan=True,
+                                                                         eval_store=eval_store))
+            close_eval_store(eval_store)
+            return games_data
+
+        current, current_seconds = timed(analyze)
+        new, new_seconds = timed(lambda: list(pgn_evaluation_analyzer.recompute_games(load_eval_store(store_path),
+                                                                                      'Standard')))
+        print_comparison("pgn_evaluation_analyzer from the PGN file vs. the eval store", current_seconds, new_seconds,
+                         len(current), "games", current == new)
+        store_mb = sum(os.path.getsize(os.path.join(store_path, name)) for name in os.listdir(store_path)) / (1024 * 1024)
+        print(f"  eval store: {store_mb:,.1f} MB, PGN file: {os.path.getsize(pgn_file_path) / (1024 * 1024):,.1f} MB")
+
+        def fast_analyze():
+            output_dir = os.path.join(temp_dir, 'pgn_json')
+            pgn_dir = os.path.dirname(os.path.abspath(pgn_file_path))
+            # Only the benchmarked file is analyzed, through a directory with a link to it
+            link_dir = os.path.join(temp_dir, 'pgn')
+            os.makedirs(link_dir)
+            os.symlink(os.path.join(pgn_dir, os.path.basename(pgn_file_path)), os.path.join(link_dir, 'games.pgn'))
+            pgn_evaluation_fast_analyzer.main(link_dir, output_dir, fast_scan=True, eval_store_path=store_path)
+            with open(os.path.join(output_dir, 'games.json')) as f:
+                return json.load(f)
+
+        def fast_recompute():
+            output_dir = os.path.join(temp_dir, 'store_json')
+            pgn_evaluation_fast_analyzer.main(store_path, output_dir, recompute=True)
+            with open(os.path.join(output_dir, 'games.json')) as f:
+                return json.load(f)
+
+        current, current_seconds = timed(fast_analyze)
+        new, new_seconds = timed(fast_recompute)
+        print_comparison("pgn_evaluation_fast_analyzer from the PGN file vs. the eval store", current_seconds,
+                         new_seconds, len(current), "games", current == new)
+
+# Benchmark one analysis per scoring scheme vs. one analysis of all the schemes in one pass, checking that each
+# column group of the single pass equals the columns of the separate analysis of its scheme
+def benchmark_schemes(pgn_file_path):
+    schemes = list(SCORING_SCHEMES.values())
+    prefixes = [''] + [scheme_prefix(scheme) for scheme in schemes[1:]]
+
+    def scheme_columns(games_data, prefix, columns):
+        return [[game_data[prefix + column] for column in columns] for game_data in games_data]
+
+    def analyze(scheme_list):
+        return list(pgn_evaluation_analyzer.analyze_pgn_files([pgn_file_path], scheme_list, fast_scan=True))
+
+    current, current_seconds = timed(lambda: [analyze([scheme]) for scheme in schemes])
+    new, new_seconds = timed(analyze, schemes)
+    columns = ['white_gi', 'black_gi', 'white_gpl', 'black_gpl', 'white_avg_gpl', 'black_avg_gpl', 'counts']
+    identical = all(scheme_columns(games_data, '', columns) == scheme_columns(new, prefix, columns)
+                    for games_data, prefix in zip(current, prefixes))
+    print_comparison(f"pgn_evaluation_analyzer, {len(schemes)} runs vs. {len(schemes)} schemes in one run",
+                     current_seconds, new_seconds, len(new), "games", identical)
+
+    def fast_analyze(scheme_list):
+        game_infos, pawns_lists = [], []
+        with open(pgn_file_path) as pgn:
+            for headers, pawns_list in pgn_evaluation_fast_analyzer.read_pawn_evals(pgn, fast_scan=True):
+                if len(pawns_list) >= 2:
+                    game_infos.append(pgn_evaluation_fast_analyzer.game_info_from_headers(headers))
+                    pawns_lists.append(pawns_list)
+        evals, offsets = pgn_evaluation_fast_analyzer.flatten_pawns_lists(pawns_lists)
+        aggregated_data = {}
+        pgn_evaluation_fast_analyzer.add_batch_stats(aggregated_data, 1, game_infos, evals, offsets, scheme_list)
+        return list(aggregated_data.values())
+
+    current, current_seconds = timed(lambda: [fast_analyze([scheme]) for scheme in schemes])
+    new, new_seconds = timed(fast_analyze, schemes)
+    columns = ['white_gi', 'black_gi', 'white_gpl', 'black_gpl', 'white_gi_raw', 'black_gi_raw']
+    identical = all(scheme_columns(games_data, '', columns) == scheme_columns(new, prefix, columns)
+                    for games_data, prefix in zip(current, prefixes))
+    print_comparison(f"pgn_evaluation_fast_analyzer, {len(schemes)} runs vs. {len(schemes)} schemes in one run",
+                     current_seconds, new_seconds, len(new), "games", identical)
+
+# Benchmark one traversal of each game per metric vs. all the metrics in one traversal, checking that the columns
+# of the single traversal equal those of the separate ones
+def benchmark_metrics(pgn_file_path):
+    games = []
+    with open(pgn_file_path) as pgn:
+        for headers, mainline in scan_games(pgn):
+            games.append((headers, pgn_evaluation_analyzer.extract_evals_from_mainline(mainline),
+                          [parse_clock(comment) for turn, comment in mainline]))
+    schemes = list(SCORING_SCHEMES.values())
+
+    def analyze(metric_sets):
+        games_columns = []
+        for headers, evals, clocks in games:
+            columns = {}
+            for metric_set in metric_sets:
+                columns.update(run_metrics(metric_set, headers, evals, clocks))
+            games_columns.append(columns)
+        return games_columns
+
+    current, current_seconds = timed(analyze, [build_metric_set(schemes, [name]) for name in METRICS])
+    new, new_seconds = timed(analyze, [build_metric_set(schemes, list(METRICS))])
+    print_comparison(f"game_metrics, {len(METRICS)} traversals vs. {len(METRICS)} metrics in one traversal",
+                     current_seconds, new_seconds, len(games), "games", current == new)
+
+    metric_set = build_metric_set(schemes, list(METRICS), timing=True)
+    analyze([metric_set])
+    print_metric_timing(metric_set, len(games))
+
+BENCHMARKS = {
+    'scanner': benchmark_scanner,
+    'board-replay': benchmark_board_replay,
+    'expected-value': benchmark_expected_value,
+    'kernel': benchmark_kernel,
+    'json-to-csv': benchmark_json_to_csv,
+    'split': benchmark_split,
+    'sketch': benchmark_sketch,
+    'player-stats': benchmark_player_stats,
+    'combine': benchmark_combine,
+    'load': benchmark_load,
+    'recompute': benchmark_recompute,
+    'schemes': benchmark_schemes,
+    'metrics': benchmark_metrics,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Usage: python benchmark.py <benchmark> <args>")
+        print("Benchmarks: " + ", ".join(BENCHMARKS))
+        sys.exit(1)
+
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
@@ -11,31 +11,22 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import sys
 import os
-import glob
+import time
+from game_table import TEXT_COLUMNS, game_table_columns, print_load_report, read_game_table
 
-def combine_csv_files(input_dir, output_filename='combined.csv'):
-    csv_files = glob.glob(os.path.join(input_dir, '*.csv'))
-    combined_df = pd.DataFrame()
-
-    for file in csv_files:
-        df = pd.read_csv(file)
-        combined_df = pd.concat([combined_df, df], ignore_index=True)
-
-    output_path = os.path.join(input_dir, output_filename)
-    combined_df.to_csv(output_path, index=False)
-    print(f"Combined CSV created at {output_path}")
-    return output_path
-
-def calculate_statistics(csv_input_file, output_directory):
-    # Reading the CSV file
-    df = pd.read_csv(csv_input_file)
+def calculate_statistics(csv_input_file, output_directory, compact=False):
+    # Reading the CSV, Parquet or Arrow file, skipping the text columns and the specified ones
+    excluded_cols = ['WhiteElo', 'BlackElo', 'WhiteResult', 'BlackResult']
+    columns = [col for col in game_table_columns(csv_input_file) if col not in TEXT_COLUMNS + excluded_cols]
+    start_time = time.time()
+    df = read_game_table(csv_input_file, columns=columns, compact=compact)
+    print_load_report(csv_input_file, df, time.time() - start_time)
 
     # Calculating the total number of games
     total_games = len(df)
 
     # Selecting numeric columns except specified ones
     numeric_cols = df.select_dtypes(include='number').columns.tolist()
-    excluded_cols = ['WhiteElo', 'BlackElo', 'WhiteResult', 'BlackResult']
     cols_to_analyze = [col for col in numeric_cols if col not in excluded_cols]
 
     # Calculating average and median for individual columns
@@ -84,21 +75,19 @@ def calculate_statistics(csv_input_file, output_directory):
         plt.show()"""
 
 
-def main(input_csv_path, output_directory):
+def main(input_csv_path, output_directory, compact=False):
     # Ensure the output directory exists
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
-    calculate_statistics(input_csv_path, output_directory)
+    calculate_statistics(input_csv_path, output_directory, compact)
 
 if __name__ == "__main__":
-    # If multiple CSVs: 
-    # input_dir = ""
-    # csv_all_games_path = combine_csv_files(input_dir, output_filename='combined.csv')
     if len(sys.argv) < 3:
-        print("Usage: python chess_stats_summarizer.py <input_csv_path> <output_directory>")
+        print("Usage: python chess_stats_summarizer.py <input_csv_path> <output_directory> [--compact-dtypes]")
         sys.exit(1)
 
     input_csv_path = sys.argv[1]
     output_directory = sys.argv[2]
-    main(input_csv_path, output_directory)
+    # --compact-dtypes reads the game table with float32 metrics
+    main(input_csv_path, output_directory, '--compact-dtypes' in sys.argv[3:])
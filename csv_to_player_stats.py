@@ -1,135 +1,49 @@
 """This script analyzes chess game data, calculates various statistics (including sums, medians, and averages), 
 and generates a final DataFrame with player statistics, sorted by the average gi score in descending order.
 -- Adds a new column adjusted_gi to process adjusted_white_gi and adjusted_black_gi columns, which are weighted by the Elo ratings
-of the opponents."""
+of the opponents.
+-- With --state, the games are added to per-player accumulators (player_accumulators.py) that are saved to a state
+file, so the player stats of a new month can be added without reading the previous months again.
+With --sketch-compression the medians (and --percentiles) are estimated from mergeable quantile sketches,
+whose size per player does not grow with the number of games.
+"""
 
-import pandas as pd
-import sys
 import os
-import glob
+import time
+import argparse
+from game_table import read_game_table, iter_game_table, print_load_report
+from player_stats_engine import calculate_player_stats
+from player_accumulators import add_game_table, load_state, save_state, player_stats_frame
+from pipeline_runner import file_hash
 
-def combine_csv_files(input_dir, output_filename='combined.csv'):
-    csv_files = glob.glob(os.path.join(input_dir, '*.csv'))
-    combined_df = pd.DataFrame()
-
-    for file in csv_files:
-        df = pd.read_csv(file)
-        combined_df = pd.concat([combined_df, df], ignore_index=True)
-
-    output_path = os.path.join(input_dir, output_filename)
-    combined_df.to_csv(output_path, index=False)
-    print(f"Combined CSV created at {output_path}")
-    return output_path
+# Columns of the game table used for the player stats
+GAME_COLUMNS = ['White', 'Black', 'white_gi', 'black_gi', 'white_gpl', 'black_gpl', 'white_acpl', 'black_acpl',
+                'adjusted_white_gi', 'adjusted_black_gi', 'white_move_number', 'black_move_number']
 
 # Functions
-def read_csv(file_path):
-    return pd.read_csv(file_path)
+def read_csv(file_path, compact=False):
+    # Reads a CSV, Parquet or Arrow game table (see game_table.py), loading only the columns used here
+    start_time = time.time()
+    df = read_game_table(file_path, columns=GAME_COLUMNS, compact=compact)
+    print_load_report(file_path, df, time.time() - start_time)
+    return df
 
 def check_dataframe(df, df_name):
     print(f"Columns in {df_name}: {df.columns}")
 
-def calculate_sum(df, group_col, value_col, prefix):
-    sums = df.groupby(group_col).agg({value_col: 'sum'}).reset_index()
-    sums.columns = ['Player', f'{prefix}_sum']
-    return sums
-
-def calculate_games(df, player_col):
-    game_count = df[player_col].value_counts().reset_index()
-    game_count.columns = ['Player', f'{player_col}_games']
-    return game_count
-
-def calculate_total_games(white_games, black_games):
-    total_games = pd.merge(white_games, black_games, on='Player', how='outer').fillna(0)
-    total_games['total_game_count'] = total_games['White_games'] + total_games['Black_games']
-    return total_games
-
-def calculate_total_moves(df):
-    # Summing up the moves made by each player as White and Black
-    white_moves = calculate_sum(df, 'White', 'white_move_number', 'white_move')
-    black_moves = calculate_sum(df, 'Black', 'black_move_number', 'black_move')
-    total_moves = pd.merge(white_moves, black_moves, on='Player', how='outer').fillna(0)
-    total_moves['total_moves'] = total_moves['white_move_sum'] + total_moves['black_move_sum']
-    return total_moves[['Player', 'total_moves']]
-
-def calculate_statistics(df, value_col):
-    stats = df.groupby('Player').agg(median=(value_col, 'median'), 
-                                     var=(value_col, 'var'), 
-                                     std=(value_col, 'std')).reset_index()
-    return stats.rename(columns={'median': f'{value_col}_median', 
-                                 'var': f'{value_col}_var', 
-                                 'std': f'{value_col}_std'})
-
-def merge_dataframes(dfs, merge_on='Player'):
-    merged_df = dfs[0]
-    for df in dfs[1:]:
-        merged_df = pd.merge(merged_df, df, on=merge_on, how='outer').fillna(0)
-    return merged_df
-
-def calculate_averages(player_stats):
-    player_stats['avg_gi'] = player_stats['total_gi_sum'] / player_stats['total_game_count']
-    player_stats['avg_gpl'] = player_stats['total_gpl_sum'] / player_stats['total_game_count']
-    player_stats['avg_acpl'] = player_stats['total_acpl_sum'] / player_stats['total_game_count']
-    # Calculate adjusted_avg_gi
-    player_stats['adjusted_avg_gi'] = (player_stats['adjusted_white_gi_sum'] + player_stats['adjusted_black_gi_sum']) / player_stats['total_game_count']
-    
-    return player_stats
-
 def save_to_csv(df, file_path):
     df.to_csv(file_path, index=False)
 
 # Main Functionality
-def main(csv_all_games_path, player_stats_output_dir):
+def main(csv_all_games_path, player_stats_output_dir, compact=False):
     if not os.path.exists(csv_all_games_path):
         print(f"File not found: {csv_all_games_path}")
         return
-    df = read_csv(csv_all_games_path)
+    df = read_csv(csv_all_games_path, compact)
     # check_dataframe(df, "Initial DataFrame")
 
-    # Calculating Sums
-    white_gi_sum = calculate_sum(df, 'White', 'white_gi', 'white_gi')
-    black_gi_sum = calculate_sum(df, 'Black', 'black_gi', 'black_gi')
-    white_gpl_sum = calculate_sum(df, 'White', 'white_gpl', 'white_gpl')
-    black_gpl_sum = calculate_sum(df, 'Black', 'black_gpl', 'black_gpl')
-    white_acpl_sum = calculate_sum(df, 'White', 'white_acpl', 'white_acpl')
-    black_acpl_sum = calculate_sum(df, 'Black', 'black_acpl', 'black_acpl')
-
-    adjusted_white_gi_sum = calculate_sum(df, 'White', 'adjusted_white_gi', 'adjusted_white_gi')
-    adjusted_black_gi_sum = calculate_sum(df, 'Black', 'adjusted_black_gi', 'adjusted_black_gi')
-    
-    # Calculating Game Counts
-    white_games = calculate_games(df, 'White')
-    black_games = calculate_games(df, 'Black')
-    total_games = calculate_total_games(white_games, black_games)
-    total_moves = calculate_total_moves(df)
-    
-    # Calculating Statistics
-    combined_df = pd.concat([
-        df[['White', 'white_gi', 'white_gpl', 'white_acpl']].rename(columns={'White': 'Player', 'white_gi': 'gi', 'white_gpl': 'gpl', 'white_acpl': 'acpl'}),
-        df[['Black', 'black_gi', 'black_gpl', 'black_acpl']].rename(columns={'Black': 'Player', 'black_gi': 'gi', 'black_gpl': 'gpl', 'black_acpl': 'acpl'})
-    ])
-    gi_stats = calculate_statistics(combined_df, 'gi')
-    gpl_stats = calculate_statistics(combined_df, 'gpl')
-    acpl_stats = calculate_statistics(combined_df, 'acpl')
-
-    adjusted_combined_df = pd.concat([
-        df[['White', 'adjusted_white_gi']].rename(columns={'White': 'Player', 'adjusted_white_gi': 'adjusted_gi'}),
-        df[['Black', 'adjusted_black_gi']].rename(columns={'Black': 'Player', 'adjusted_black_gi': 'adjusted_gi'})
-    ])
-    adjusted_gi_stats = calculate_statistics(adjusted_combined_df, 'adjusted_gi')
-    
-    # Merging DataFrames
-    sums = [white_gi_sum, black_gi_sum, white_gpl_sum, black_gpl_sum, white_acpl_sum, black_acpl_sum, adjusted_white_gi_sum, adjusted_black_gi_sum]
-    total_sums = merge_dataframes(sums + [total_games, total_moves])
-    total_sums['total_gi_sum'] = total_sums['white_gi_sum'] + total_sums['black_gi_sum']
-    total_sums['total_gpl_sum'] = total_sums['white_gpl_sum'] + total_sums['black_gpl_sum']
-    total_sums['total_acpl_sum'] = total_sums['white_acpl_sum'] + total_sums['black_acpl_sum']
-    total_sums['adjusted_white_gi_sum'] = total_sums['adjusted_white_gi_sum']
-    total_sums['adjusted_black_gi_sum'] = total_sums['adjusted_black_gi_sum']
-    
-    player_stats = merge_dataframes([total_sums, gi_stats, gpl_stats, acpl_stats, adjusted_gi_stats])
-    
-    # Calculating Averages
-    player_stats = calculate_averages(player_stats)
+    # Sums, game counts, medians, variances, standard deviations and averages in one groupby
+    player_stats = calculate_player_stats(df, ['gi', 'gpl', 'acpl', 'adjusted_gi'])
 
     # Reordering columns
     columns_order = ['Player', 'adjusted_avg_gi', 'avg_gi', 'avg_gpl', 'avg_acpl', 'total_game_count', 'total_moves', 
@@ -149,14 +63,52 @@ def main(csv_all_games_path, player_stats_output_dir):
     player_stats = player_stats.sort_values(by='adjusted_avg_gi', ascending=False)
     save_to_csv(player_stats, output_file_path)
 
+# Incremental mode: reads the game table in chunks into the accumulators of the state file and writes the
+# player stats of all games added so far. A game table that was already added (same content hash) is skipped.
+# Without a state file the accumulators are only used to compute the player stats of this game table.
+def main_incremental(csv_all_games_path, player_stats_output_dir, state_path, chunksize=1000000,
+                     compression=None, percentiles=(), compact=False):
+    if not os.path.exists(csv_all_games_path):
+        print(f"File not found: {csv_all_games_path}")
+        return
+    accumulators, sources, _ = load_state(state_path)
+
+    # The content hash identifies the game table in the state file, so it is only calculated with one
+    source_hash = file_hash(csv_all_games_path) if state_path else None
+    if source_hash in sources:
+        print(f"{csv_all_games_path} was already added to {state_path} as {sources[source_hash]}")
+    else:
+        for chunk in iter_game_table(csv_all_games_path, columns=GAME_COLUMNS, chunksize=chunksize, compact=compact):
+            add_game_table(accumulators, chunk, compression)
+        if state_path:
+            sources[source_hash] = csv_all_games_path
+            save_state(accumulators, sources, state_path)
+
+    if not os.path.exists(player_stats_output_dir):
+        os.makedirs(player_stats_output_dir)
+    save_to_csv(player_stats_frame(accumulators, percentiles), os.path.join(player_stats_output_dir, 'player_stats.csv'))
+
 if __name__ == "__main__":
-    # If multiple CSVs in a directory, then uncomment the following two lines.
-    # input_dir = ''
-    # csv_all_games_path = combine_csv_files(input_dir, output_filename='combined.csv')
-    if len(sys.argv) < 3:
-        print("Usage: python csv_to_player_stats.py <csv_all_games_path> <player_stats_output_dir>")
-        sys.exit(1)
-
-    csv_all_games_path = sys.argv[1]
-    player_stats_output_dir = sys.argv[2]
-    main(csv_all_games_path, player_stats_output_dir)
+    parser = argparse.ArgumentParser(description="Calculate the player stats of a game table.")
+    parser.add_argument('csv_all_games_path')
+    parser.add_argument('player_stats_output_dir')
+    parser.add_argument('--state',
+                        help="state file of the per-player accumulators; the games are added to it and the "
+                             "player stats cover all games added so far")
+    parser.add_argument('--chunksize', type=int, default=1000000,
+                        help="rows of the game table read at a time with --state")
+    parser.add_argument('--sketch-compression', type=int,
+                        help="estimate the medians with quantile sketches of this compression (e.g. 100, "
+                             "rank error about 1/compression) instead of keeping every value")
+    parser.add_argument('--percentiles', type=lambda value: [float(p) for p in value.split(',')], default=[],
+                        help="comma separated percentiles of gi, gpl, acpl and adjusted gi to add, e.g. 10,90")
+    parser.add_argument('--compact-dtypes', action='store_true',
+                        help="read the game table with categorical player names and float32 metrics, "
+                             "which needs less memory; the stats are computed in float32")
+    args = parser.parse_args()
+
+    if args.state or args.sketch_compression or args.percentiles:
+        main_incremental(args.csv_all_games_path, args.player_stats_output_dir, args.state, args.chunksize,
+                         args.sketch_compression, args.percentiles, args.compact_dtypes)
+    else:
+        main(args.csv_all_games_path, args.player_stats_output_dir, args.compact_dtypes)
@@ -0,0 +1,66 @@
+"""Persistent index of the games already processed, so that the games of overlapping inputs (a monthly dump
+extracted twice, broadcast PGNs merged with Lichess exports) are analyzed and counted once.
+A game is identified by its Site header when it is a URL (e.g. https://lichess.org/abcd1234), and otherwise by
+the headers that identify a game (Event, Site, Date, Round, White, Black, Result, UTCDate, UTCTime), so the key
+is known before the moves are read. The keys are 64-bit BLAKE2b hashes stored as a sorted NumPy array (.npy)
+that is memory-mapped when loaded: the index takes 8 bytes per game on disk and a lookup is a binary search.
+The keys added during a run are kept in a set and merged into the file by save_dedup_index.
+Each stage that deduplicates needs its own index file, since every game it keeps is added to it.
+"""
+
+import hashlib
+import os
+import numpy as np
+
+FINGERPRINT_HEADERS = ['Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result', 'UTCDate', 'UTCTime']
+
+# Function to get the 64-bit key of a game from its headers (a dict or chess.pgn.Headers)
+def game_key(headers):
+    site = headers.get('Site') or ''
+    if site.startswith(('http://', 'https://')):
+        # The same game may be linked with http or https and with a trailing slash
+        text = 'site\x00' + site.split('://', 1)[1].rstrip('/')
+    else:
+        text = 'headers\x00' + '\x00'.join(headers.get(name) or '' for name in FINGERPRINT_HEADERS)
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+# Function to load the index at index_path, or start an empty one if the file does not exist yet
+def load_dedup_index(index_path):
+    if index_path and os.path.exists(index_path):
+        keys = np.load(index_path, mmap_mode='r')
+    else:
+        keys = np.empty(0, dtype='uint64')
+    return {'path': index_path, 'keys': keys, 'new_keys': set(), 'checked': 0, 'duplicates': 0}
+
+def contains_key(keys, key):
+    position = np.searchsorted(keys, np.uint64(key))
+    return position < len(keys) and keys[position] == key
+
+# Function to add the key of a game to the index. Returns False if the game is a duplicate.
+def add_game_key(index, key):
+    index['checked'] += 1
+    if key in index['new_keys'] or contains_key(index['keys'], key):
+        index['duplicates'] += 1
+        return False
+    index['new_keys'].add(key)
+    return True
+
+def add_game_headers(index, headers):
+    return add_game_key(index, game_key(headers))
+
+# Function to merge the keys added during the run into the index file, through a temporary file
+def save_dedup_index(index):
+    if not index['path'] or not index['new_keys']:
+        return
+    new_keys = np.fromiter(index['new_keys'], dtype='uint64', count=len(index['new_keys']))
+    # union1d returns a new sorted array, so the memory-mapped file is released before it is replaced
+    index['keys'] = np.union1d(index['keys'], new_keys)
+    index['new_keys'] = set()
+    temp_path = index['path'] + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.save(f, index['keys'])
+    os.replace(temp_path, index['path'])
+
+def print_dedup_stats(index):
+    print(f"Dedup index {index['path']}: {index['checked']} games checked, {index['duplicates']} duplicates skipped, "
+          f"{len(index['keys']) + len(index['new_keys'])} games in the index")
@@ -0,0 +1,144 @@
+"""Persistent store of the evaluation trace of every analyzed game, written by the analyzers with --save-evals,
+so that the metrics can be recomputed (e.g. with another scoring system or other blunder thresholds) without
+parsing the PGN files again. A store is a directory of columns, one value per game or per position:
+- evals.bin: the [%eval ...] of the root and of every mainline move of each game, one game after another,
+  as int16 centipawns from the perspective of the side to move. A mate in n for the side to move is stored as
+  32767 - n, a mate in n against it as -(32767 - n), and a position without an evaluation as -32768.
+  Centipawns are clipped to +-31999, so every value beyond +-32000 is a mate.
+- offsets.npy: the evaluations of game k are evals[offsets[k]:offsets[k + 1]].
+- white_to_move.npy: whether White is to move at the root of each game (False for a FEN with Black to move).
+- <header>.npy and <header>_values.npy for the headers the analyzers output, and source.npy and source_values.npy
+  for the PGN file each game was read from: the code of the value of each game (-1 when the game has no such
+  header) and the distinct values.
+- meta.json: the version of the format, the number of games and the header names.
+The store is written to a temporary directory that replaces the previous store when it is complete, and its
+columns are memory-mapped when it is loaded.
+"""
+
+import json
+import os
+import shutil
+import numpy as np
+import chess.engine
+
+STORE_VERSION = 1
+STORE_HEADERS = ['Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result', 'UTCDate', 'WhiteElo', 'BlackElo']
+MISSING_EVAL = -32768
+MATE_BASE = 32767
+# Stored values at or beyond +-MATE_THRESHOLD are mates
+MATE_THRESHOLD = 32000
+
+# Function to encode a PovScore (or None) as a stored value
+def encode_score(score):
+    if score is None:
+        return MISSING_EVAL
+    relative = score.relative
+    if relative.is_mate():
+        mate = relative.mate()
+        moves = min(abs(mate), MATE_BASE - MATE_THRESHOLD)
+        # Mate(-0), the side to move is mated, has mate() == 0 like MateGiven
+        if mate > 0 or relative == chess.engine.MateGiven:
+            return MATE_BASE - moves
+        return -(MATE_BASE - moves)
+    return max(1 - MATE_THRESHOLD, min(MATE_THRESHOLD - 1, relative.score()))
+
+# Function to decode a stored value into the PovScore it was encoded from (None for a missing evaluation)
+def decode_score(value, turn):
+    if value == MISSING_EVAL:
+        return None
+    if value >= MATE_THRESHOLD:
+        relative = chess.engine.MateGiven if value == MATE_BASE else chess.engine.Mate(MATE_BASE - value)
+    elif value <= -MATE_THRESHOLD:
+        relative = chess.engine.Mate(-(MATE_BASE + value))
+    else:
+        relative = chess.engine.Cp(value)
+    return chess.engine.PovScore(relative, turn)
+
+# Function to start writing a store at path
+def create_eval_store(path):
+    temp_path = path + '.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    return {
+        'path': path, 'temp_path': temp_path,
+        'evals_file': open(os.path.join(temp_path, 'evals.bin'), 'wb'),
+        'offsets': [0], 'white_to_move': [],
+        # Codes of each game and the distinct values, which dicts keep in the order of their codes
+        'columns': {name: ([], {}) for name in STORE_HEADERS + ['source']},
+    }
+
+# Function to add the trace of a game: its headers (a dict or chess.pgn.Headers), the PGN file it was read from,
+# the side to move at the root and the stored values of its positions (see encode_score)
+def add_game_trace(store, source, headers, white_to_move, values):
+    store['evals_file'].write(np.asarray(values, dtype='<i2').tobytes())
+    store['offsets'].append(store['offsets'][-1] + len(values))
+    store['white_to_move'].append(white_to_move)
+    for name in STORE_HEADERS:
+        add_column_value(store['columns'][name], headers.get(name))
+    add_column_value(store['columns']['source'], source)
+
+def add_column_value(column, value):
+    codes, values = column
+    codes.append(-1 if value is None else values.setdefault(value, len(values)))
+
+# Function to write the columns of the store and replace the previous store at its path
+def close_eval_store(store):
+    store['evals_file'].close()
+    temp_path = store['temp_path']
+    np.save(os.path.join(temp_path, 'offsets.npy'), np.array(store['offsets'], dtype=np.int64))
+    np.save(os.path.join(temp_path, 'white_to_move.npy'), np.array(store['white_to_move'], dtype=bool))
+    for name, (codes, values) in store['columns'].items():
+        np.save(os.path.join(temp_path, f'{name}.npy'), np.array(codes, dtype=np.int32))
+        np.save(os.path.join(temp_path, f'{name}_values.npy'),
+                np.array([value.encode('utf-8') for value in values], dtype='S'))
+    with open(os.path.join(temp_path, 'meta.json'), 'w') as f:
+        json.dump({'version': STORE_VERSION, 'games': len(store['white_to_move']), 'headers': STORE_HEADERS}, f)
+    shutil.rmtree(store['path'], ignore_errors=True)
+    os.replace(temp_path, store['path'])
+    print(f"Saved the evaluations of {len(store['white_to_move'])} games to {store['path']}")
+
+# Function to load a store, memory-mapping its columns
+def load_eval_store(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['version'] != STORE_VERSION:
+        raise ValueError(f"{path} has version {meta['version']} of the eval store format, expected {STORE_VERSION}")
+    evals_path = os.path.join(path, 'evals.bin')
+    # An empty file cannot be memory-mapped
+    if os.path.getsize(evals_path):
+        evals = np.memmap(evals_path, dtype='<i2', mode='r')
+    else:
+        evals = np.empty(0, dtype='<i2')
+    store = {
+        'path': path, 'games': meta['games'], 'headers': meta['headers'], 'evals': evals,
+        'offsets': np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r'),
+        'white_to_move': np.load(os.path.join(path, 'white_to_move.npy'), mmap_mode='r'),
+    }
+    for name in meta['headers'] + ['source']:
+        store[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+        store[name + '_values'] = [value.decode('utf-8') for value in np.load(os.path.join(path, f'{name}_values.npy')).tolist()]
+    return store
+
+# Function to get the values of a column (a header or 'source') for the games start:end, None where missing
+def column_values(store, name, start=0, end=None):
+    values = store[name + '_values']
+    return [values[code] if code >= 0 else None for code in store[name][start:end].tolist()]
+
+# Function to yield the headers of the games start:end as dicts, without the headers a game does not have
+def store_headers(store, start=0, end=None):
+    names = store['headers']
+    columns = [column_values(store, name, start, end) for name in names]
+    for row_values in zip(*columns):
+        yield {name: value for name, value in zip(names, row_values) if value is not None}
+
+# Function to split the games into the runs of consecutive games read from the same PGN file.
+# Returns [(source, start, end)], the games start:end coming from source.
+def source_runs(store):
+    codes = np.asarray(store['source'])
+    if len(codes) == 0:
+        return []
+    breaks = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+    starts = np.concatenate(([0], breaks)).tolist()
+    ends = np.concatenate((breaks, [len(codes)])).tolist()
+    values = store['source_values']
+    return [(values[codes[start]] if codes[start] >= 0 else None, start, end) for start, end in zip(starts, ends)]
@@ -1,79 +1,307 @@
 """This script efficiently decompresses and parses all .pgn.zst files in a directory, 
 and writes all games (excluding Bullet games) with eval comments to a .pgn file.
+The games to keep can be configured with the filter options of game_filter.py.
+With --dedup-index, games already in the index (see dedup_index.py) are skipped, e.g. when overlapping dumps are extracted.
+Decompression, splitting into games, filtering and writing run as a pipeline of threads,
+and the throughput of each stage is reported at the end.
 """
 
-import re
 import sys
 import os
+import time
+import queue
+import argparse
+import threading
 import zstandard as zstd
+from game_filter import add_filter_arguments, build_game_filter, game_filter_from_args, parse_headers
+from dedup_index import add_game_headers, load_dedup_index, print_dedup_stats, save_dedup_index
 
-def extract_games(file_path, chunk_size=1024 * 1024 * 10):  # Default to 10 MB chunks
+# Maximum number of chunks or game batches waiting between two pipeline stages
+QUEUE_SIZE = 8
+# Marker a reader puts on the game queue, as (file_path, END_OF_INPUT), when it has finished one .zst file
+END_OF_INPUT = 'END_OF_INPUT'
+
+def decompress_chunks(file_path, chunk_size=1024 * 1024 * 10):  # Default to 10 MB chunks
     dctx = zstd.ZstdDecompressor()
     with open(file_path, 'rb') as fh:
         with dctx.stream_reader(fh) as reader:
-            previous_data = ''
             while True:
                 chunk = reader.read(chunk_size)
                 if not chunk:
                     break
+                yield chunk
 
-                try:
-                    data = previous_data + chunk.decode('utf-8')
-                    games = re.split(r'\n\n(?=\[Event)', data)
-                    if len(games) > 1:
-                        yield from games[:-1]
-                        previous_data = games[-1]
-                    else:
-                        previous_data = data
-
-                except UnicodeDecodeError:
-                    # Skip this chunk and move on to the next one
-                    previous_data = ''
-                    continue
+# Every game but the first of a file starts after a blank line with its Event tag
+GAME_SEPARATOR = b'\n\n[Event'
+
+# Function to split a decompressed chunk into games without decoding it.
+# Returns the complete games and the incomplete data to prepend to the next chunk.
+# Splitting the bytes at the ASCII separator is safe for UTF-8, so a multibyte
+# character split across two chunks simply ends up in the pending data.
+def split_chunk(pending, chunk):
+    games = []
+    view = memoryview(chunk)
+    prefix, offset = pending, 0
+
+    # A separator may start in the pending data and end in this chunk
+    overlap_length = min(len(pending), len(GAME_SEPARATOR) - 1)
+    overlap = pending[len(pending) - overlap_length:] + chunk[:len(GAME_SEPARATOR) - 1]
+    index = overlap.find(GAME_SEPARATOR)
+    if index != -1:
+        boundary = len(pending) - overlap_length + index
+        games.append(pending[:boundary])
+        # The next game starts after the two newlines
+        next_start = boundary + 2
+        prefix = pending[next_start:]
+        offset = max(next_start - len(pending), 0)
+
+    index = chunk.find(GAME_SEPARATOR, offset)
+    while index != -1:
+        games.append(prefix + view[offset:index])
+        prefix = b''
+        offset = index + 2
+        index = chunk.find(GAME_SEPARATOR, offset)
+    return games, prefix + view[offset:]
+
+# Function to yield the games of a .zst file as bytes
+def extract_games(file_path, chunk_size=1024 * 1024 * 10):  # Default to 10 MB chunks
+    pending = b''
+    for chunk in decompress_chunks(file_path, chunk_size):
+        games, pending = split_chunk(pending, chunk)
+        yield from games
+
+    if pending:
+        yield pending
+
+# Function to create the throughput counters of the pipeline stages
+def new_pipeline_stats():
+    return {stage: {'bytes': 0, 'games': 0, 'seconds': 0.0}
+            for stage in ('decompress', 'split', 'filter', 'write')}
+
+def add_stats(stats, lock, stage, nbytes, games, seconds):
+    with lock:
+        stats[stage]['bytes'] += nbytes
+        stats[stage]['games'] += games
+        stats[stage]['seconds'] += seconds
+
+# Function to record the exception of a failed stage. The other stages stop at their next chunk or only drain
+# their input queue, every stage still puts its sentinels, and filter_and_save_files raises the first exception.
+def record_error(errors, lock, error):
+    with lock:
+        errors.append(error)
 
-            if previous_data:
-                yield previous_data
+# Stage 1: decompress a .zst file into chunks (zstandard releases the GIL while decompressing)
+def decompress_stage(file_path, chunk_queue, stats, lock, errors):
+    nbytes, seconds = 0, 0.0
+    try:
+        chunks = decompress_chunks(file_path)
+        while not errors:
+            start_time = time.perf_counter()
+            chunk = next(chunks, None)
+            seconds += time.perf_counter() - start_time
+            if chunk is None:
+                break
+            nbytes += len(chunk)
+            chunk_queue.put(chunk)
+    except Exception as error:
+        record_error(errors, lock, error)
+    finally:
+        chunk_queue.put(None)
+        add_stats(stats, lock, 'decompress', nbytes, 0, seconds)
 
+# Function to split the chunks of one .zst file, decompressed by a thread of its own, into batches of games,
+# which are put on game_queue together with file_path
+def split_file(file_path, game_queue, stats, lock, errors):
+    chunk_queue = queue.Queue(QUEUE_SIZE)
+    decompressor = threading.Thread(target=decompress_stage, args=(file_path, chunk_queue, stats, lock, errors))
+    decompressor.start()
 
-def filter_and_save_games(input_directory, output_directory, max_file_size):
+    nbytes, game_count, seconds = 0, 0, 0.0
+    pending = b''
+    chunks = iter(chunk_queue.get, None)
+    try:
+        for chunk in chunks:
+            start_time = time.perf_counter()
+            games, pending = split_chunk(pending, chunk)
+            seconds += time.perf_counter() - start_time
+            nbytes += len(chunk)
+            game_count += len(games)
+            game_queue.put((file_path, games))
+        if pending:
+            game_count += 1
+            game_queue.put((file_path, [pending]))
+        game_queue.put((file_path, END_OF_INPUT))
+    finally:
+        # After a failure the remaining chunks are dropped, so that the decompressor can put its sentinel
+        for chunk in chunks:
+            pass
+        decompressor.join()
+        add_stats(stats, lock, 'split', nbytes, game_count, seconds)
+
+# Stage 2: split the chunks of the .zst files taken from file_queue into batches of games
+def split_stage(file_queue, game_queue, stats, lock, errors):
+    try:
+        while not errors:
+            try:
+                file_path = file_queue.get_nowait()
+            except queue.Empty:
+                break
+            print(file_path)
+            split_file(file_path, game_queue, stats, lock, errors)
+    except Exception as error:
+        record_error(errors, lock, error)
+    finally:
+        game_queue.put(None)
+
+# Stage 3: keep the games for which keep_game returns True
+def filter_stage(game_queue, write_queue, reader_count, keep_game, stats, lock, errors):
+    finished_readers = 0
+    nbytes, game_count, seconds = 0, 0, 0.0
+    try:
+        while finished_readers < reader_count:
+            batch = game_queue.get()
+            if batch is None:
+                finished_readers += 1
+                continue
+            # After a failure the games are only taken from the queue, until every reader has stopped
+            if errors:
+                continue
+            file_path, games = batch
+            if games == END_OF_INPUT:
+                write_queue.put(batch)
+                continue
+            try:
+                start_time = time.perf_counter()
+                kept_games = [game for game in games if keep_game(game)]
+                seconds += time.perf_counter() - start_time
+                nbytes += sum(len(game) for game in games)
+                game_count += len(games)
+                write_queue.put((file_path, kept_games))
+            except Exception as error:
+                record_error(errors, lock, error)
+    finally:
+        write_queue.put(None)
+        add_stats(stats, lock, 'filter', nbytes, game_count, seconds)
+
+# Stage 4: write the kept games to PGN files of at most max_file_size bytes.
+# Each .zst file has output files of its own, also when several .zst files are split concurrently (--jobs),
+# so an output file never mixes the games of two .zst files.
+def write_stage(write_queue, output_directory, max_file_size, stats, lock, errors):
     file_index = 1
-    current_file_size = 0
-    output_file = None
+    # The open output file of each .zst file being written and its size
+    output_files = {}
+    nbytes, game_count, seconds = 0, 0, 0.0
+    try:
+        for file_path, games in iter(write_queue.get, None):
+            # After a failure the batches are only taken from the queue, until the filter stage has stopped
+            if errors:
+                continue
+            try:
+                start_time = time.perf_counter()
+                if games == END_OF_INPUT:
+                    if file_path in output_files:
+                        output_files.pop(file_path)['file'].close()
+                    continue
+                output = output_files.get(file_path)
+                for game in games:
+                    if not output or output['size'] >= max_file_size:
+                        if output:
+                            output['file'].close()
+                        output_filename = os.path.join(output_directory, f'games_with_eval_no_bullet{file_index}.pgn')
+                        output = output_files[file_path] = {'file': open(output_filename, 'wb'), 'size': 0}
+                        file_index += 1
+                        print("file_index: ", file_index)
+
+                    # The games are written as they were read, so they are never decoded
+                    output['file'].write(game + b'\n\n')
+                    output['size'] += len(game)
+                    nbytes += len(game)
+                game_count += len(games)
+                seconds += time.perf_counter() - start_time
+            except Exception as error:
+                record_error(errors, lock, error)
+    finally:
+        for output in output_files.values():
+            output['file'].close()
+        add_stats(stats, lock, 'write', nbytes, game_count, seconds)
+
+def print_pipeline_stats(stats, wall_seconds):
+    print(f"Pipeline finished in {wall_seconds:.2f} s")
+    processed_games = stats['filter']['games']
+    kept_games = stats['write']['games']
+    print(f"Games: {processed_games} processed, {kept_games} kept, {processed_games - kept_games} skipped")
+    for stage, stage_stats in stats.items():
+        megabytes = stage_stats['bytes'] / (1024 * 1024)
+        seconds = stage_stats['seconds']
+        mb_per_sec = megabytes / seconds if seconds else 0
+        games_per_sec = stage_stats['games'] / seconds if seconds else 0
+        print(f"  {stage:<10} {megabytes:10.1f} MB {stage_stats['games']:10d} games {seconds:8.2f} s busy "
+              f"{mb_per_sec:8.1f} MB/s {games_per_sec:10.0f} games/s")
 
-    zst_files = [f for f in os.listdir(input_directory) if f.endswith('.zst')]
+# Decompression, game splitting, filtering and writing run in separate threads connected by bounded queues,
+# and `jobs` .zst files are decompressed and split concurrently
+# game_filter defaults to the games with eval comments, excluding Bullet games.
+# Games that pass the filter are skipped if their key is already in dedup_index (see dedup_index.py).
+# If a stage fails (e.g. on a file that is not zstd data), the pipeline stops and its exception is raised.
+def filter_and_save_files(zst_files, output_directory, max_file_size, jobs=1, game_filter=None, dedup_index=None):
+    if game_filter is None:
+        game_filter = build_game_filter()
+    if dedup_index is not None:
+        # The filter stage is a single thread, so the index is only updated from one thread
+        keep_game = game_filter
+        game_filter = lambda game: keep_game(game) and add_game_headers(dedup_index, parse_headers(game)[0])
+    start_time = time.perf_counter()
+    stats = new_pipeline_stats()
+    lock = threading.Lock()
+    errors = []
+
+    file_queue = queue.Queue()
     for zst_file in zst_files:
-        full_path = os.path.join(input_directory, zst_file)
-        print(full_path)
-        for game in extract_games(full_path):
-            if "[%eval" in game and "Bullet" not in game:
-                if not output_file or current_file_size >= max_file_size:
-                    if output_file:
-                        output_file.close()
-                    output_filename = os.path.join(output_directory, f'games_with_eval_no_bullet{file_index}.pgn')
-                    output_file = open(output_filename, 'w')
-                    file_index += 1
-                    print("file_index: ", file_index)
-                    current_file_size = 0
-
-                output_file.write(game + '\n\n')
-                current_file_size += len(game.encode('utf-8'))
-
-        if output_file:
-            output_file.close()
-            output_file = None
-
-def main(input_directory, output_directory, max_file_size):
+        file_queue.put(zst_file)
+    game_queue = queue.Queue(QUEUE_SIZE)
+    write_queue = queue.Queue(QUEUE_SIZE)
+
+    readers = [threading.Thread(target=split_stage, args=(file_queue, game_queue, stats, lock, errors))
+               for _ in range(jobs)]
+    filterer = threading.Thread(target=filter_stage,
+                                args=(game_queue, write_queue, len(readers), game_filter, stats, lock, errors))
+    for thread in readers + [filterer]:
+        thread.start()
+    write_stage(write_queue, output_directory, max_file_size, stats, lock, errors)
+    for thread in readers + [filterer]:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    print_pipeline_stats(stats, time.perf_counter() - start_time)
+
+def filter_and_save_games(input_directory, output_directory, max_file_size, jobs=1, game_filter=None, dedup_index=None):
+    zst_files = [os.path.join(input_directory, f) for f in os.listdir(input_directory) if f.endswith('.zst')]
+    filter_and_save_files(zst_files, output_directory, max_file_size, jobs, game_filter, dedup_index)
+
+def main(input_directory, output_directory, max_file_size, jobs=1, game_filter=None, dedup_index_path=None):
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
-    filter_and_save_games(input_directory, output_directory, max_file_size)
+    dedup_index = load_dedup_index(dedup_index_path) if dedup_index_path else None
+    filter_and_save_games(input_directory, output_directory, max_file_size, jobs, game_filter, dedup_index)
+    if dedup_index is not None:
+        save_dedup_index(dedup_index)
+        print_dedup_stats(dedup_index)
                           
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python evaluated_games_extractor.py <input_directory> <output_directory> <max_file_size>")
-        sys.exit(1)
-    input_directory = sys.argv[1]
-    output_directory = sys.argv[2]
-    max_file_size = 1024 * 1024 * 100  # Default 100 MB, can be modified
-
-    main(input_directory, output_directory, max_file_size)
+    parser = argparse.ArgumentParser(description="Extract the games with eval comments (excluding Bullet games) from .zst files.")
+    parser.add_argument('input_directory')
+    parser.add_argument('output_directory')
+    parser.add_argument('--max-file-size-mb', type=int, default=100,
+                        help="maximum size of each output PGN file (default: 100 MB)")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="number of .zst files decompressed and split concurrently")
+    parser.add_argument('--dedup-index',
+                        help="index file of the games already extracted; games in it are skipped and new games added")
+    add_filter_arguments(parser)
+    args = parser.parse_args()
+    max_file_size = 1024 * 1024 * args.max_file_size_mb
+
+    main(args.input_directory, args.output_directory, max_file_size, args.jobs, game_filter_from_args(args),
+         args.dedup_index)
@@ -0,0 +1,80 @@
+"""Precomputed expected points of a position for every centipawn evaluation.
+Cp(cp).wdl() evaluates a logistic model on every call, yet the analyzers only ever ask for integer centipawns,
+so the expected points of the side to move and of its opponent are computed once per scoring system
+and looked up by index. The tables of other points for a win and a draw (see scoring_schemes.py) are built the
+first time they are asked for.
+"""
+
+import numpy as np
+from chess.engine import Cp
+
+# Points for a win and for a draw in each scoring system
+SCORING_SYSTEMS = {
+    "Standard": (1, 0.5),
+    "NorwayChess": (3, 1.25),
+}
+
+# The WDL model clamps the evaluation to +-4000 internal units (356 per pawn), i.e. about +-11.24 pawns,
+# so every evaluation beyond CP_LIMIT has the same expected points as CP_LIMIT.
+CP_LIMIT = 2000
+
+# Function to build the table of expected points for a scoring system.
+# Index cp + CP_LIMIT holds the expected points of the side to move and of its opponent.
+def build_expected_value_table(win_points, draw_points):
+    mover_points = np.empty(2 * CP_LIMIT + 1)
+    opponent_points = np.empty(2 * CP_LIMIT + 1)
+    for index, cp in enumerate(range(-CP_LIMIT, CP_LIMIT + 1)):
+        win_draw_loss = Cp(cp).wdl()
+        win_prob, draw_prob, loss_prob = win_draw_loss.wins / 1000, win_draw_loss.draws / 1000, win_draw_loss.losses / 1000
+        # Same arithmetic as the former calculate_expected_value of the analyzer (kept in benchmark.py), so the
+        # looked up values are bit-identical
+        mover_points[index] = win_prob * win_points + draw_prob * draw_points
+        opponent_points[index] = loss_prob * win_points + draw_prob * draw_points
+    return mover_points, opponent_points
+
+EXPECTED_VALUE_TABLES = {
+    scoring_system: build_expected_value_table(win_points, draw_points)
+    for scoring_system, (win_points, draw_points) in SCORING_SYSTEMS.items()
+}
+
+# Python lists for scalar lookups, which are much faster than indexing a NumPy array element by element
+_EXPECTED_VALUE_LISTS = {
+    scoring_system: (mover_points.tolist(), opponent_points.tolist())
+    for scoring_system, (mover_points, opponent_points) in EXPECTED_VALUE_TABLES.items()
+}
+
+# Tables by the points for a win and for a draw, as NumPy arrays and as Python lists
+_TABLES_BY_POINTS = {points: EXPECTED_VALUE_TABLES[scoring_system] for scoring_system, points in SCORING_SYSTEMS.items()}
+_LISTS_BY_POINTS = {points: _EXPECTED_VALUE_LISTS[scoring_system] for scoring_system, points in SCORING_SYSTEMS.items()}
+
+# Function to get the tables of the expected points for any points for a win and for a draw
+def expected_value_tables(win_points, draw_points):
+    points = (win_points, draw_points)
+    if points not in _TABLES_BY_POINTS:
+        _TABLES_BY_POINTS[points] = build_expected_value_table(win_points, draw_points)
+    return _TABLES_BY_POINTS[points]
+
+# Function to get the tables of expected_value_tables as Python lists, for scalar lookups
+def expected_value_lists(win_points, draw_points):
+    points = (win_points, draw_points)
+    if points not in _LISTS_BY_POINTS:
+        mover_points, opponent_points = expected_value_tables(win_points, draw_points)
+        _LISTS_BY_POINTS[points] = (mover_points.tolist(), opponent_points.tolist())
+    return _LISTS_BY_POINTS[points]
+
+# Function to convert centipawns to table indices, clamping evaluations beyond CP_LIMIT
+def table_index(cp):
+    return np.clip(cp, -CP_LIMIT, CP_LIMIT) + CP_LIMIT
+
+# Function to convert one evaluation in centipawns to its table index, without the overhead of NumPy
+def scalar_table_index(cp):
+    return (-CP_LIMIT if cp < -CP_LIMIT else CP_LIMIT if cp > CP_LIMIT else cp) + CP_LIMIT
+
+# Function to look up the expected points of White and Black for an evaluation
+# in centipawns from the perspective of the side to move ("White" or "Black")
+def lookup_expected_value(cp, turn, scoring_system="Standard"):
+    mover_points, opponent_points = _EXPECTED_VALUE_LISTS[scoring_system]
+    index = scalar_table_index(cp)
+    if turn == "White":
+        return mover_points[index], opponent_points[index]
+    return opponent_points[index], mover_points[index]
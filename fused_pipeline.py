@@ -0,0 +1,129 @@
+"""This script runs the pipeline from the .zst files of the Lichess Open Database to the player statistics in one pass.
+Each game is decompressed with extract_games, filtered with game_filter.py, analyzed as in pgn_evaluation_analyzer.py,
+adjusted for the Elo ratings as in json_adjust_gi.py and added to the per-player accumulators (player_accumulators.py).
+No PGN or JSON files are written: the output is the game table aggregated_game_data.csv, which is appended to
+in chunks, and player_stats.csv, the same files json_to_csv_converter.py and csv_to_player_stats.py write.
+With --state the accumulators are merged into a state file, so the player stats cover every month added so far,
+and .zst files that were already added are skipped. The game table of the earlier runs is then appended to,
+so it also covers every month added so far. The state records the size of the game table it covers, and a run
+that was interrupted before saving the state is cut off the table by the next run, so no game is added twice.
+A game table only takes games with its own columns: adding e.g. a scoring scheme needs a new table. With --sketch-compression the per-player medians are
+estimated from quantile sketches, so memory no longer grows with the number of games.
+"""
+
+import argparse
+import io
+import os
+import time
+import pandas as pd
+from evaluated_games_extractor import extract_games
+from game_filter import add_filter_arguments, game_filter_from_args
+from pgn_scanner import scan_games
+from pgn_evaluation_analyzer import calculate_gi_from_evals, extract_evals_from_mainline
+from game_metrics import build_metric_set
+from json_adjust_gi import adjust_game
+from json_to_csv_converter import process_game
+from scoring_schemes import add_scoring_arguments, scoring_schemes_from_args
+from player_accumulators import add_game, load_state, merge_accumulators, player_stats_frame, save_state
+from pipeline_runner import file_hash
+
+# Function to analyze the games of a .zst file that pass the game filter, yielding the adjusted game data.
+# metric_set is a metric set of game_metrics.py, built once for all the games.
+def analyze_zst_file(zst_file, game_filter, metric_set):
+    for game in extract_games(zst_file):
+        if not game_filter(game):
+            continue
+        for headers, mainline in scan_games(io.StringIO(game.decode('utf-8', errors='replace'))):
+            game_data = calculate_gi_from_evals(headers, extract_evals_from_mainline(mainline), metric_set)
+            adjust_game(game_data)
+            yield game_data
+
+# Function to append the games collected in the column lists to the game table
+def write_game_table_chunk(columns, game_table_path, column_order):
+    chunk = pd.DataFrame(columns)
+    if column_order is None:
+        chunk.to_csv(game_table_path, index=False)
+        return list(chunk.columns)
+    unknown = [column for column in chunk.columns if column not in column_order]
+    if unknown:
+        raise ValueError(f"The games have columns {unknown} that {game_table_path} does not have, e.g. from another "
+                         f"scoring scheme or metric; write them to a new game table")
+    chunk.reindex(columns=column_order).to_csv(game_table_path, mode='a', header=False, index=False)
+    return column_order
+
+def main(input_directory, output_directory, game_filter, scoring_schemes='Standard', chunk_games=100000, state_path=None,
+         compression=None, percentiles=()):
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+    game_table_path = os.path.join(output_directory, 'aggregated_game_data.csv')
+
+    accumulators = {}
+    columns = {}
+    column_order = None
+    game_count = 0
+    metric_set = build_metric_set(scoring_schemes)
+    state_accumulators, sources, game_table_size = load_state(state_path)
+    # With a state file of earlier runs the game table is appended to, so that it covers the same files as the
+    # player stats. The new games get the columns of the existing table.
+    if state_path and sources and os.path.exists(game_table_path):
+        # Games appended by a run that stopped before saving the state are added again by this run
+        if game_table_size is not None and os.path.getsize(game_table_path) > game_table_size:
+            print(f"Removing the games appended to {game_table_path} after the last save of {state_path}")
+            with open(game_table_path, 'r+b') as f:
+                f.truncate(game_table_size)
+        column_order = list(pd.read_csv(game_table_path, nrows=0).columns)
+    zst_files = [os.path.join(input_directory, f) for f in os.listdir(input_directory) if f.endswith('.zst')]
+    for zst_file in zst_files:
+        print(zst_file)
+        if state_path:
+            source_hash = file_hash(zst_file)
+            if source_hash in sources:
+                print(f"Already added to {state_path}, skipping")
+                continue
+            sources[source_hash] = zst_file
+        for game_data in analyze_zst_file(zst_file, game_filter, metric_set):
+            # process_game replaces the player names by their last names, as in the game table
+            process_game(game_data, columns)
+            add_game(accumulators, game_data, compression)
+            game_count += 1
+            if game_count % chunk_games == 0:
+                column_order = write_game_table_chunk(columns, game_table_path, column_order)
+                columns = {}
+
+    if columns:
+        column_order = write_game_table_chunk(columns, game_table_path, column_order)
+    if column_order is not None:
+        print(f"{game_count} games saved to {game_table_path}")
+    if state_path:
+        merge_accumulators(state_accumulators, accumulators)
+        accumulators = state_accumulators
+        game_table_size = os.path.getsize(game_table_path) if os.path.exists(game_table_path) else None
+        save_state(accumulators, sources, state_path, game_table_size)
+    if not accumulators:
+        print("No games found.")
+        return
+
+    player_stats_path = os.path.join(output_directory, 'player_stats.csv')
+    player_stats_frame(accumulators, percentiles).to_csv(player_stats_path, index=False)
+    print(f"Player stats saved to {player_stats_path}")
+
+if __name__ == "__main__":
+    start_time = time.time()
+    parser = argparse.ArgumentParser(description="Compute the game table and the player stats from .zst files in one pass.")
+    parser.add_argument('input_directory')
+    parser.add_argument('output_directory')
+    add_scoring_arguments(parser)
+    parser.add_argument('--chunk-games', type=int, default=100000,
+                        help="number of games kept in memory before they are appended to the game table")
+    parser.add_argument('--state', help="state file of the per-player accumulators to add the games to")
+    parser.add_argument('--sketch-compression', type=int,
+                        help="estimate the medians with quantile sketches of this compression (e.g. 100)")
+    parser.add_argument('--percentiles', type=lambda value: [float(p) for p in value.split(',')], default=[],
+                        help="comma separated percentiles of gi, gpl, acpl and adjusted gi to add, e.g. 10,90")
+    add_filter_arguments(parser)
+    args = parser.parse_args()
+
+    main(args.input_directory, args.output_directory, game_filter_from_args(args), scoring_schemes_from_args(parser, args),
+         args.chunk_games, args.state, args.sketch_compression, args.percentiles)
+    end_time = time.time()
+    print("Script finished in {:.2f} minutes".format((end_time - start_time) / 60.0))
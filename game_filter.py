@@ -0,0 +1,187 @@
+"""Header-based game filter for evaluated_games_extractor.py.
+The filter is compiled once from the CLI options into a list of predicates. For each game only the header
+block is parsed and the header predicates run first (time control class, Elo range, rated/casual, variant,
+date range), so the move text is only searched (for [%eval ...] annotations and the number of plies)
+when all header predicates pass. Games are bytes and only their header values are decoded.
+The header options alone are compiled by build_header_filter, which game_index.py runs on the indexed headers.
+"""
+
+import argparse
+import re
+
+HEADER_REGEX = re.compile(rb'^\[([A-Za-z0-9_]+)\s+"((?:[^"\\]|\\.)*)"\]', re.MULTILINE)
+COMMENT_REGEX = re.compile(rb'\{[^}]*\}')
+MOVE_NUMBER_REGEX = re.compile(rb'^\d+\.+$')
+RESULTS = (b'1-0', b'0-1', b'1/2-1/2', b'*')
+
+# Lichess time control classes, by the estimated game duration base + 40 * increment in seconds
+TIME_CONTROL_CLASSES = [(30, 'ultrabullet'), (180, 'bullet'), (480, 'blitz'), (1500, 'rapid')]
+ALL_TIME_CONTROL_CLASSES = ['ultrabullet', 'bullet', 'blitz', 'rapid', 'classical', 'correspondence']
+
+# Function to find the first blank line of data[start:end], which ends the header block of a game, with LF or
+# CRLF line endings. Returns the end of the headers and the start of the move text, or end twice if there is none.
+def find_header_end(data, start, end):
+    lf = data.find(b'\n\n', start, end)
+    crlf = data.find(b'\n\r\n', start, end)
+    if crlf != -1 and (lf == -1 or crlf < lf):
+        return crlf, crlf + 3
+    if lf != -1:
+        return lf, lf + 2
+    return end, end
+
+# Function to split a game into its headers (decoded) and the bytes of its move text
+def parse_headers(game):
+    header_end, movetext_start = find_header_end(game, 0, len(game))
+    headers = {match.group(1).decode('ascii'): match.group(2).decode('utf-8', errors='replace')
+               for match in HEADER_REGEX.finditer(game, 0, header_end)}
+    return headers, game[movetext_start:]
+
+# Function to get the time control class of a game from its TimeControl header,
+# or from the Event header (e.g. "Rated Blitz game") when there is no TimeControl header
+def time_control_class(headers):
+    time_control = headers.get('TimeControl')
+    if time_control == '-':
+        return 'correspondence'
+    if time_control and '+' in time_control:
+        base, increment = time_control.split('+', 1)
+        if base.isdigit() and increment.isdigit():
+            estimated_seconds = int(base) + 40 * int(increment)
+            for limit, name in TIME_CONTROL_CLASSES:
+                if estimated_seconds < limit:
+                    return name
+            return 'classical'
+    event_words = headers.get('Event', '').lower().split()
+    for name in ALL_TIME_CONTROL_CLASSES:
+        if name in event_words:
+            return name
+    return None
+
+# Function to count the mainline plies of the move text, ignoring comments, variations, move numbers,
+# NAGs and the result
+def count_plies(movetext):
+    plies = 0
+    variation_depth = 0
+    text = COMMENT_REGEX.sub(b' ', movetext).replace(b'(', b' ( ').replace(b')', b' ) ')
+    for token in text.split():
+        if token == b'(':
+            variation_depth += 1
+        elif token == b')':
+            variation_depth = max(variation_depth - 1, 0)
+        elif not (variation_depth or MOVE_NUMBER_REGEX.match(token) or token.startswith(b'$') or token in RESULTS):
+            plies += 1
+    return plies
+
+def parse_elo(value):
+    return int(value) if value and value.isdigit() else None
+
+# Function to normalize a date given as YYYY-MM-DD or YYYY.MM.DD to the PGN format YYYY.MM.DD
+def normalize_date(date):
+    return date.replace('-', '.') if date else None
+
+# Function to compile the header options into a function that returns True for the headers (a dict of str) to keep,
+# or None if no header option is set. time_controls keeps only the given classes and exclude_time_controls drops them.
+def build_header_filter(time_controls=None, exclude_time_controls=None, min_elo=None, max_elo=None, rated=None,
+                        variant=None, start_date=None, end_date=None):
+    header_predicates = []
+    if time_controls:
+        included = set(time_controls)
+        header_predicates.append(lambda headers: time_control_class(headers) in included)
+    if exclude_time_controls:
+        excluded = set(exclude_time_controls)
+        header_predicates.append(lambda headers: time_control_class(headers) not in excluded)
+    if min_elo is not None or max_elo is not None:
+        low = min_elo if min_elo is not None else 0
+        high = max_elo if max_elo is not None else float('inf')
+
+        def elo_in_range(headers):
+            white_elo, black_elo = parse_elo(headers.get('WhiteElo')), parse_elo(headers.get('BlackElo'))
+            return (white_elo is not None and black_elo is not None
+                    and low <= white_elo <= high and low <= black_elo <= high)
+        header_predicates.append(elo_in_range)
+    if rated is not None:
+        header_predicates.append(lambda headers: headers.get('Event', '').startswith('Rated') == rated)
+    if variant:
+        header_predicates.append(lambda headers: headers.get('Variant', 'Standard').lower() == variant.lower())
+    if start_date or end_date:
+        low_date = normalize_date(start_date) or ''
+        high_date = normalize_date(end_date) or '9999.99.99'
+
+        def date_in_range(headers):
+            date = headers.get('UTCDate') or headers.get('Date', '')
+            return low_date <= date <= high_date
+        header_predicates.append(date_in_range)
+
+    if not header_predicates:
+        return None
+    return lambda headers: all(predicate(headers) for predicate in header_predicates)
+
+# Function to compile the filter options into a function that returns True for the games to keep.
+# By default the filter keeps the games with [%eval ...] annotations that are not (ultra)bullet games.
+def build_game_filter(time_controls=None, exclude_time_controls=('ultrabullet', 'bullet'), min_elo=None,
+                      max_elo=None, rated=None, variant=None, start_date=None, end_date=None,
+                      min_plies=None, has_eval=True):
+    header_filter = build_header_filter(time_controls, exclude_time_controls, min_elo, max_elo, rated, variant,
+                                        start_date, end_date)
+
+    movetext_predicates = []
+    if has_eval:
+        movetext_predicates.append(lambda movetext: b'[%eval' in movetext)
+    if min_plies:
+        movetext_predicates.append(lambda movetext: count_plies(movetext) >= min_plies)
+
+    def keep_game(game):
+        headers, movetext = parse_headers(game)
+        return ((header_filter is None or header_filter(headers))
+                and all(predicate(movetext) for predicate in movetext_predicates))
+    return keep_game
+
+# Function to parse a comma separated list of time control classes on the command line. Empty names are dropped,
+# so that --exclude-time-controls '' keeps all classes.
+def parse_time_control_classes(value):
+    names = [name for name in value.split(',') if name]
+    unknown = [name for name in names if name not in ALL_TIME_CONTROL_CLASSES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown time control classes {', '.join(unknown)}, "
+                                         f"expected some of {', '.join(ALL_TIME_CONTROL_CLASSES)}")
+    return names
+
+# Function to add the filter options to an argparse parser. The analyzers and split_large_pgn.py, which filter
+# through the game index, keep every game by default and have no --min-plies, since the index has no move text.
+def add_filter_arguments(parser, exclude_time_controls=('ultrabullet', 'bullet'), has_eval=True, min_plies=True):
+    group = parser.add_argument_group('game filter')
+    group.add_argument('--time-controls', type=parse_time_control_classes,
+                       help="keep only these time control classes, comma separated ("
+                            + ", ".join(ALL_TIME_CONTROL_CLASSES) + ")")
+    group.add_argument('--exclude-time-controls', type=parse_time_control_classes,
+                       default=list(exclude_time_controls),
+                       help="drop these time control classes, comma separated (default: "
+                            + (",".join(exclude_time_controls) + "; '' keeps all" if exclude_time_controls else "none")
+                            + ")")
+    group.add_argument('--min-elo', type=int, help="minimum Elo of both players")
+    group.add_argument('--max-elo', type=int, help="maximum Elo of both players")
+    group.add_argument('--rated', dest='rated', action='store_true', default=None, help="keep only rated games")
+    group.add_argument('--casual', dest='rated', action='store_false', help="keep only casual games")
+    group.add_argument('--variant', help="keep only this variant (games without a Variant header are Standard)")
+    group.add_argument('--start-date', help="first date to keep, YYYY-MM-DD")
+    group.add_argument('--end-date', help="last date to keep, YYYY-MM-DD")
+    if min_plies:
+        group.add_argument('--min-plies', type=int, help="minimum number of plies")
+    if has_eval:
+        group.add_argument('--no-eval-required', dest='has_eval', action='store_false',
+                           help="also keep games without [%%eval ...] annotations")
+    else:
+        group.add_argument('--eval-required', dest='has_eval', action='store_true',
+                           help="keep only games with [%%eval ...] annotations")
+
+# Function to build the header filter from the parsed arguments of add_filter_arguments
+def header_filter_from_args(args):
+    return build_header_filter(time_controls=args.time_controls, exclude_time_controls=args.exclude_time_controls,
+                               min_elo=args.min_elo, max_elo=args.max_elo, rated=args.rated, variant=args.variant,
+                               start_date=args.start_date, end_date=args.end_date)
+
+# Function to build the game filter from the parsed arguments of add_filter_arguments
+def game_filter_from_args(args):
+    return build_game_filter(time_controls=args.time_controls, exclude_time_controls=args.exclude_time_controls,
+                             min_elo=args.min_elo, max_elo=args.max_elo, rated=args.rated, variant=args.variant,
+                             start_date=args.start_date, end_date=args.end_date, min_plies=args.min_plies,
+                             has_eval=args.has_eval)
@@ -0,0 +1,199 @@
+"""Persistent index of the games of a PGN file, stored next to it as <file>.pgn.idx.npz.
+For each game the index holds its byte offset and length, the headers the tools select games by (Event, Site,
+White, Black, Date, WhiteElo, BlackElo, TimeControl and Variant) and whether its move text has [%eval ...]
+annotations. Games start at the lines starting with [Event, as in split_large_pgn.py, and Date is the UTCDate
+header when there is one and the Date header otherwise, as in game_filter.py.
+The string headers are stored as codes into their distinct values and the Elo ratings as int16 (-1 when missing),
+in a compressed NumPy archive. The index also records the size and modification time of the PGN file, and is
+rebuilt when they change.
+With the index, pgn_evaluation_analyzer.py, pgn_evaluation_fast_analyzer.py and split_large_pgn.py select games by
+their headers without reading the move text, seek straight to the selected games and cut a file into batches of
+about the same number of bytes.
+Usage: python game_index.py <PGN files or directories> [--force]
+"""
+
+import argparse
+import mmap
+import os
+import time
+import numpy as np
+from game_filter import HEADER_REGEX, find_header_end
+
+GAME_START = b'\n[Event '
+INDEX_SUFFIX = '.idx.npz'
+INDEX_VERSION = 1
+STRING_HEADERS = ['Event', 'Site', 'White', 'Black', 'Date', 'TimeControl', 'Variant']
+ELO_HEADERS = ['WhiteElo', 'BlackElo']
+MISSING_ELO = -1
+# Header names as they appear in the file, and the index column they go to
+INDEXED_HEADERS = {name.encode('ascii'): name for name in STRING_HEADERS + ELO_HEADERS}
+INDEXED_HEADERS[b'UTCDate'] = 'UTCDate'
+
+# Function to yield the offsets of the games of the data, i.e. of the lines starting with [Event.
+# Anything before the first game (e.g. a byte order mark or blank lines) stays with the first game.
+def find_game_starts(data):
+    yield 0
+    position = data.find(GAME_START, 1)
+    while position != -1:
+        yield position + 1
+        position = data.find(GAME_START, position + 1)
+
+def index_path_for(pgn_path):
+    return pgn_path + INDEX_SUFFIX
+
+def source_stamp(pgn_path):
+    stat = os.stat(pgn_path)
+    return stat.st_size, stat.st_mtime_ns
+
+def parse_index_elo(value):
+    elo = int(value) if value and value.isdigit() else MISSING_ELO
+    return elo if elo <= np.iinfo(np.int16).max else MISSING_ELO
+
+# Function to scan a PGN file and build its index. Only the header block of each game is parsed.
+def build_game_index(pgn_path):
+    size, mtime_ns = source_stamp(pgn_path)
+    starts, has_eval = [], []
+    codes = {name: [] for name in STRING_HEADERS}
+    values = {name: {} for name in STRING_HEADERS}
+    elos = {name: [] for name in ELO_HEADERS}
+    if size:
+        with open(pgn_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            starts = list(find_game_starts(data))
+            for start, end in zip(starts, starts[1:] + [size]):
+                # The headers end at the first blank line of the game (LF or CRLF line endings)
+                header_end, movetext_start = find_header_end(data, start, end)
+                headers = {}
+                for match in HEADER_REGEX.finditer(data, start, header_end):
+                    name = INDEXED_HEADERS.get(match.group(1))
+                    if name:
+                        headers[name] = match.group(2)
+                headers['Date'] = headers.get('UTCDate') or headers.get('Date', b'')
+                for name in STRING_HEADERS:
+                    name_values = values[name]
+                    codes[name].append(name_values.setdefault(headers.get(name, b''), len(name_values)))
+                for name in ELO_HEADERS:
+                    elos[name].append(parse_index_elo(headers.get(name)))
+                has_eval.append(data.find(b'[%eval', header_end, end) != -1)
+
+    offsets = np.array(starts, dtype=np.int64)
+    index = {
+        'version': INDEX_VERSION, 'source_size': size, 'source_mtime_ns': mtime_ns,
+        'offset': offsets,
+        'length': np.diff(offsets, append=size),
+        'has_eval': np.array(has_eval, dtype=bool),
+    }
+    for name in STRING_HEADERS:
+        index[name] = np.array(codes[name], dtype=np.int32)
+        # dicts keep the insertion order, so the values are in the order of their codes
+        index[name + '_values'] = np.array(list(values[name]), dtype='S')
+    for name in ELO_HEADERS:
+        index[name] = np.array(elos[name], dtype=np.int16)
+    return index
+
+# Function to save an index next to its PGN file, through a temporary file
+def save_game_index(index, index_path):
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez_compressed(f, **index)
+    os.replace(temp_path, index_path)
+
+# Function to load the index of a PGN file. Returns None if there is no index or the file changed since it was built.
+def load_game_index(pgn_path):
+    index_path = index_path_for(pgn_path)
+    if not os.path.exists(index_path):
+        return None
+    with np.load(index_path) as archive:
+        index = {name: archive[name] for name in archive.files}
+    for name in ('version', 'source_size', 'source_mtime_ns'):
+        index[name] = int(index[name])
+    if index['version'] != INDEX_VERSION or (index['source_size'], index['source_mtime_ns']) != source_stamp(pgn_path):
+        return None
+    return index
+
+# Function to load the index of a PGN file, building and saving it first if it is missing or out of date
+def game_index_for(pgn_path, force=False):
+    index = None if force else load_game_index(pgn_path)
+    if index is None:
+        start_time = time.perf_counter()
+        index = build_game_index(pgn_path)
+        save_game_index(index, index_path_for(pgn_path))
+        print(f"Indexed {len(index['offset'])} games of {pgn_path} in {time.perf_counter() - start_time:.2f} s")
+    return index
+
+# Function to yield the indexed headers of the given rows as dicts of str, as game_filter's header filter takes them.
+# Missing headers are left out, so that e.g. a game without a Variant header is a Standard game.
+def header_rows(index, rows):
+    columns = {}
+    for name in STRING_HEADERS:
+        values = [value.decode('utf-8', errors='replace') for value in index[name + '_values'].tolist()]
+        columns[name] = [values[code] for code in index[name][rows].tolist()]
+    for name in ELO_HEADERS:
+        columns[name] = ['' if elo == MISSING_ELO else str(elo) for elo in index[name][rows].tolist()]
+    names = list(columns)
+    for row_values in zip(*columns.values()):
+        yield {name: value for name, value in zip(names, row_values) if value}
+
+# Function to select the rows of the games whose headers pass header_filter (see game_filter.build_header_filter)
+# and, with has_eval, that have [%eval ...] annotations
+def select_games(index, header_filter=None, has_eval=False):
+    rows = np.flatnonzero(index['has_eval']) if has_eval else np.arange(len(index['offset']))
+    if header_filter is not None:
+        keep = np.fromiter((header_filter(headers) for headers in header_rows(index, rows)), dtype=bool, count=len(rows))
+        rows = rows[keep]
+    return rows
+
+# Function to merge the byte ranges of the given rows (in file order) into as few (start, end) ranges as possible
+def merge_ranges(index, rows):
+    if len(rows) == 0:
+        return []
+    starts = index['offset'][rows]
+    ends = starts + index['length'][rows]
+    # A new range starts wherever a game does not follow the previous one
+    breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+    first = np.concatenate(([0], breaks))
+    last = np.concatenate((breaks, [len(rows)])) - 1
+    return list(zip(starts[first].tolist(), ends[last].tolist()))
+
+# Function to cut the given rows into batches of at most batch_size bytes (a larger game gets a batch of its own).
+# Returns a list of batches, each a list of (start, end) byte ranges.
+def game_batches(index, rows, batch_size):
+    cumulative = np.cumsum(index['length'][rows])
+    batches = []
+    first = 0
+    while first < len(rows):
+        base = cumulative[first - 1] if first else 0
+        last = max(int(np.searchsorted(cumulative, base + batch_size, side='right')), first + 1)
+        batches.append(merge_ranges(index, rows[first:last]))
+        first = last
+    return batches
+
+# Function to read the byte ranges of an open (binary) PGN file
+def read_ranges(pgn, ranges):
+    parts = []
+    for start, end in ranges:
+        pgn.seek(start)
+        parts.append(pgn.read(end - start))
+    return b''.join(parts)
+
+# Function to list the PGN files of the given files and directories
+def find_pgn_paths(paths):
+    pgn_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                pgn_paths.extend(os.path.join(dirpath, filename) for filename in sorted(filenames)
+                                 if filename.endswith('.pgn'))
+        else:
+            pgn_paths.append(path)
+    return pgn_paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the game index of PGN files.")
+    parser.add_argument('paths', nargs='+', help="PGN files or directories of PGN files")
+    parser.add_argument('--force', action='store_true', help="rebuild the indexes that are up to date")
+    args = parser.parse_args()
+
+    for pgn_path in find_pgn_paths(args.paths):
+        index = game_index_for(pgn_path, args.force)
+        print(f"{pgn_path}: {len(index['offset'])} games, {int(index['has_eval'].sum())} with evaluations, "
+              f"index {os.path.getsize(index_path_for(pgn_path)) / 1024:.1f} KB")
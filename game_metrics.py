@@ -0,0 +1,335 @@
+"""Metric plugins of pgn_evaluation_analyzer.py, evaluated in one loop over the moves of each game.
+A metric is registered with register_metric as three functions:
+- start(game, scheme) returns the state of the metric for a game. game is a dict with the 'headers', the 'evals'
+  (the side to move and the evaluation in pawns from its perspective, or None, of the root and every mainline
+  node) and the 'clocks' (the [%clk ...] of every node in seconds, or None) of the game.
+- update(state, move) is called for every move followed by an evaluation, in order. move is a dict with the
+  'ply' (the index in evals of the position after the move), the 'side' that made it (0 for White, 1 for Black),
+  'white_to_move' after it, the evaluations in pawns and centipawns before and after it from the perspective of
+  the side to move ('premove_eval', 'postmove_eval', 'premove_cp', 'postmove_cp'), their indices in the tables of
+  expected_value_table.py ('premove_index', 'postmove_index'), 'first_move' when the position before the move had
+  no evaluation (e.g. the initial position) and the 'clock' left to the player who made it. The dict is reused for
+  the next move, so a metric keeps what it needs in its state.
+- finish(state, game, scheme) returns the columns of the metric for the game.
+A metric registered with per_scheme=True runs once for each scoring scheme (see scoring_schemes.py), gets the
+scheme in start and finish and the 'exp_point_loss' of the move in that scheme in move: the expected points of
+the player before the move less those after it, 0 for a first move of White. The columns of the first scheme
+keep their names and those of every further scheme are prefixed with its name. A metric registered with
+uses_clocks=True needs the [%clk ...] annotations, which are only parsed when such a metric is enabled.
+The GI, GPL, ACPL and blunder counts of the analyzer are the built-in metrics 'acpl', 'gpl' and 'blunders'.
+The other metrics ('accuracy', 'volatility', 'time_trouble', 'phase_gpl') are enabled with --metrics.
+With --metric-timing the time spent in each metric is measured and printed.
+"""
+
+import math
+import time
+import chess
+from expected_value_table import expected_value_lists, scalar_table_index
+from scoring_schemes import resolve_scoring_schemes, scheme_prefix
+
+METRICS = {}
+DEFAULT_METRICS = ['acpl', 'gpl', 'blunders']
+# Keys of the counts of blunders, mistakes and inaccuracies in the game data
+COUNT_KEYS = ["white_blunder", "black_blunder", "white_mistake", "black_mistake", "white_inaccuracy", "black_inaccuracy"]
+# Remaining time below which a player is in time trouble
+TIME_TROUBLE_SECONDS = 60
+# Last ply of each phase of phase_gpl: moves 1-15 are the opening and moves 16-40 the middlegame
+PHASES = [('opening', 30), ('middlegame', 80), ('endgame', None)]
+
+def register_metric(name, start, update, finish, per_scheme=False, uses_clocks=False):
+    METRICS[name] = {'start': start, 'update': update, 'finish': finish, 'per_scheme': per_scheme,
+                     'uses_clocks': uses_clocks}
+
+# Function to build the set of metrics the analyzer runs on each game, for the given scoring schemes.
+# With timing the seconds spent in each metric are added up in metric_set['seconds'].
+def build_metric_set(scoring_schemes='Standard', metric_names=None, timing=False):
+    scoring_schemes = resolve_scoring_schemes(scoring_schemes)
+    metric_names = list(DEFAULT_METRICS if metric_names is None else metric_names)
+    unknown = [name for name in metric_names if name not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics {unknown}, expected some of {list(METRICS)}")
+    return {
+        'schemes': scoring_schemes,
+        'metrics': [name for name in metric_names if not METRICS[name]['per_scheme']],
+        'scheme_metrics': [name for name in metric_names if METRICS[name]['per_scheme']],
+        'uses_clocks': any(METRICS[name]['uses_clocks'] for name in metric_names),
+        'timing': timing,
+        'seconds': dict.fromkeys(metric_names + ['total'], 0.0),
+    }
+
+# Function to get a metric set from a metric set or from scoring schemes, for which the default metrics are run
+def resolve_metric_set(metric_set):
+    if isinstance(metric_set, dict) and 'scheme_metrics' in metric_set:
+        return metric_set
+    return build_metric_set(metric_set)
+
+def timed_function(function, seconds, name):
+    def timed(*args):
+        start_time = time.perf_counter()
+        result = function(*args)
+        seconds[name] += time.perf_counter() - start_time
+        return result
+    return timed
+
+# Function to get the start, update and finish functions of a metric, timed if the metric set is timed
+def metric_functions(metric_set, name):
+    metric = METRICS[name]
+    functions = (metric['start'], metric['update'], metric['finish'])
+    if metric_set['timing']:
+        functions = tuple(timed_function(function, metric_set['seconds'], name) for function in functions)
+    return functions
+
+# Function to run the metrics of a metric set on a game in one pass over its moves. evals are the side to move
+# and the evaluation of the root and every mainline node (see pgn_evaluation_analyzer.extract_evals_from_mainline)
+# and clocks their clocks, if the metrics use them. Returns the columns of all the metrics.
+def run_metrics(metric_set, headers, evals, clocks=None):
+    if metric_set['timing']:
+        start_time = time.perf_counter()
+    game = {'headers': headers, 'evals': evals, 'clocks': clocks}
+    functions = {name: metric_functions(metric_set, name)
+                 for name in metric_set['metrics'] + metric_set['scheme_metrics']}
+    states = [(name, functions[name][0](game, None)) for name in metric_set['metrics']]
+    updates = [(functions[name][1], state) for name, state in states]
+    # The metrics of each scheme, with its tables
+    scheme_groups = []
+    if metric_set['scheme_metrics']:
+        for scheme in metric_set['schemes']:
+            scheme_states = [(name, functions[name][0](game, scheme)) for name in metric_set['scheme_metrics']]
+            scheme_groups.append((scheme, expected_value_lists(scheme['win'], scheme['draw']), scheme_states,
+                                  [(functions[name][1], state) for name, state in scheme_states]))
+
+    move = {}
+    # The centipawns and table index after the previous move are those before the next one
+    previous_ply, previous_cp, previous_index = None, None, None
+    for ply in range(1, len(evals)):
+        postmove_turn, postmove_eval = evals[ply]
+        if postmove_eval is None:
+            continue
+        premove_eval = evals[ply - 1][1]
+        # Evaluation of the initial position
+        first_move = premove_eval is None
+        if previous_ply == ply - 1:
+            premove_cp, premove_index = previous_cp, previous_index
+        else:
+            premove_cp = 30 if first_move else int(100*premove_eval)
+            premove_index = scalar_table_index(premove_cp)
+        postmove_cp = int(100*postmove_eval)
+        postmove_index = scalar_table_index(postmove_cp)
+        previous_ply, previous_cp, previous_index = ply, postmove_cp, postmove_index
+        white_to_move = postmove_turn == chess.WHITE
+        side = 1 if white_to_move else 0
+        move['ply'] = ply
+        move['side'] = side
+        move['white_to_move'] = white_to_move
+        move['premove_eval'] = premove_eval
+        move['postmove_eval'] = postmove_eval
+        move['premove_cp'] = premove_cp
+        move['postmove_cp'] = postmove_cp
+        move['premove_index'] = premove_index
+        move['postmove_index'] = postmove_index
+        move['first_move'] = first_move
+        move['clock'] = clocks[ply] if clocks else None
+        for update, state in updates:
+            update(state, move)
+        for scheme, (mover_points, opponent_points), scheme_states, scheme_updates in scheme_groups:
+            # Assuming that first move's loss is 0
+            if first_move and side == 0:
+                move['exp_point_loss'] = 0
+            else:
+                move['exp_point_loss'] = mover_points[premove_index] - opponent_points[postmove_index]
+            for update, state in scheme_updates:
+                update(state, move)
+
+    columns = {}
+    for name, state in states:
+        columns.update(functions[name][2](state, game, None))
+    for position, (scheme, tables, scheme_states, scheme_updates) in enumerate(scheme_groups):
+        prefix = scheme_prefix(scheme) if position else ''
+        for name, state in scheme_states:
+            columns.update((prefix + column, value) for column, value in functions[name][2](state, game, scheme).items())
+    if metric_set['timing']:
+        metric_set['seconds']['total'] += time.perf_counter() - start_time
+    return columns
+
+# Function to add the seconds of a metric set used elsewhere (e.g. in a worker process) to a metric set
+def add_metric_seconds(metric_set, seconds):
+    for name, value in seconds.items():
+        metric_set['seconds'][name] += value
+
+def print_metric_timing(metric_set, game_count):
+    seconds = metric_set['seconds']
+    total = seconds['total']
+    print(f"Metric timing over {game_count} games: {total:.2f} s in the metric loop")
+    metric_seconds = 0
+    for name in metric_set['metrics'] + metric_set['scheme_metrics']:
+        metric_seconds += seconds[name]
+        print(f"  {name}: {seconds[name]:.2f} s ({100 * seconds[name] / total if total else 0:.1f}%)")
+    traversal = total - metric_seconds
+    print(f"  traversal and timing: {traversal:.2f} s ({100 * traversal / total if total else 0:.1f}%)")
+
+# Built-in metric 'acpl': the centipawn loss of each player
+def start_acpl(game, scheme):
+    return {'tcpl': [0, 0], 'moves': [0, 0]}
+
+def update_acpl(state, move):
+    side = move['side']
+    # Assuming that first move's loss is 0. The cp loss is a sum because cp is from the perspective of the active player.
+    if not (move['first_move'] and side == 0):
+        state['tcpl'][side] += move['premove_cp'] + move['postmove_cp']
+    state['moves'][side] += 1
+
+def finish_acpl(state, game, scheme):
+    (white_tcpl, black_tcpl), (white_move_number, black_move_number) = state['tcpl'], state['moves']
+    white_acpl = white_tcpl / white_move_number if white_move_number != 0 else 0
+    black_acpl = black_tcpl / black_move_number if black_move_number != 0 else 0
+    return {
+        "white_acpl": round(white_acpl, 4), "black_acpl": round(black_acpl, 4),
+        "white_tcpl": white_tcpl, "black_tcpl": black_tcpl,
+        "white_move_number": white_move_number, "black_move_number": black_move_number,
+    }
+
+# Built-in metric 'gpl': the GPL of each player and their GI, from the result of the game or else from the
+# expectation after the last evaluated move
+def start_gpl(game, scheme):
+    return {'gpl': [0, 0], 'moves': [0, 0], 'last_index': None, 'last_white_to_move': None}
+
+def update_gpl(state, move):
+    side = move['side']
+    state['gpl'][side] += move['exp_point_loss']
+    state['moves'][side] += 1
+    state['last_index'] = move['postmove_index']
+    state['last_white_to_move'] = move['white_to_move']
+
+def finish_gpl(state, game, scheme):
+    (white_gpl, black_gpl), (white_move_number, black_move_number) = state['gpl'], state['moves']
+    result = game['headers'].get('Result')
+    if result == '1-0':
+        white_gi = scheme['win'] - white_gpl
+        black_gi = -black_gpl
+    elif result == '0-1':
+        white_gi = -white_gpl
+        black_gi = scheme['win'] - black_gpl
+    elif result == '1/2-1/2':
+        white_gi = scheme['draw'] - white_gpl
+        black_gi = scheme['draw'] - black_gpl
+    elif state['last_index'] is None:
+        # An unfinished game without an evaluated move has no expectation, and no GPL
+        white_gi, black_gi = -white_gpl, -black_gpl
+    else:
+        mover_points, opponent_points = expected_value_lists(scheme['win'], scheme['draw'])
+        index = state['last_index']
+        if state['last_white_to_move']:
+            white_gi, black_gi = mover_points[index] - white_gpl, opponent_points[index] - black_gpl
+        else:
+            white_gi, black_gi = opponent_points[index] - white_gpl, mover_points[index] - black_gpl
+    white_avg_gpl = white_gpl / white_move_number if white_move_number != 0 else 0
+    black_avg_gpl = black_gpl / black_move_number if black_move_number != 0 else 0
+    return {
+        "white_gi": round(white_gi, 4), "black_gi": round(black_gi, 4),
+        "white_gpl": round(white_gpl, 4), "black_gpl": round(black_gpl, 4),
+        "white_avg_gpl": round(white_avg_gpl, 4), "black_avg_gpl": round(black_avg_gpl, 4),
+    }
+
+# Built-in metric 'blunders': the blunders, mistakes and inaccuracies of each player
+def start_blunders(game, scheme):
+    return {'counts': [0] * 6, 'blunder': scheme['blunder'], 'mistake': scheme['mistake']}
+
+def update_blunders(state, move):
+    exp_point_loss = move['exp_point_loss']
+    if exp_point_loss >= state['blunder']:
+        state['counts'][move['side']] += 1
+    elif exp_point_loss >= state['mistake']:
+        state['counts'][2 + move['side']] += 1
+    else:
+        state['counts'][4 + move['side']] += 1
+
+def finish_blunders(state, game, scheme):
+    return {"counts": dict(zip(COUNT_KEYS, state['counts']))}
+
+# Metric 'accuracy': the average accuracy of the moves of each player, as on Lichess: the winning chances of the
+# player before and after the move (clamped to +-10 pawns) and 103.1668 * exp(-0.04354 * drop) - 3.1669
+def win_percent(cp):
+    cp = max(-1000, min(1000, cp))
+    return 50 + 50 * (2 / (1 + math.exp(-0.00368208 * cp)) - 1)
+
+def start_accuracy(game, scheme):
+    return {'total': [0.0, 0.0], 'moves': [0, 0]}
+
+def update_accuracy(state, move):
+    drop = max(0.0, win_percent(move['premove_cp']) - win_percent(-move['postmove_cp']))
+    accuracy = 103.1668 * math.exp(-0.04354 * drop) - 3.1669
+    state['total'][move['side']] += max(0.0, min(100.0, accuracy))
+    state['moves'][move['side']] += 1
+
+def finish_accuracy(state, game, scheme):
+    (white_total, black_total), (white_moves, black_moves) = state['total'], state['moves']
+    return {
+        "white_accuracy": round(white_total / white_moves, 4) if white_moves else None,
+        "black_accuracy": round(black_total / black_moves, 4) if black_moves else None,
+    }
+
+# Metric 'volatility': the standard deviation of the evaluations of the game from White's perspective, in pawns
+def start_volatility(game, scheme):
+    return {'count': 0, 'mean': 0.0, 'm2': 0.0}
+
+def update_volatility(state, move):
+    value = move['postmove_eval'] if move['white_to_move'] else -move['postmove_eval']
+    state['count'] += 1
+    delta = value - state['mean']
+    state['mean'] += delta / state['count']
+    state['m2'] += delta * (value - state['mean'])
+
+def finish_volatility(state, game, scheme):
+    return {"eval_volatility": round(math.sqrt(state['m2'] / state['count']), 4) if state['count'] else None}
+
+# Metric 'time_trouble': the moves each player made with less than TIME_TROUBLE_SECONDS left on the clock
+# and the blunders among them
+def start_time_trouble(game, scheme):
+    return {'moves': [0, 0], 'blunders': [0, 0], 'blunder': scheme['blunder']}
+
+def update_time_trouble(state, move):
+    clock = move['clock']
+    if clock is not None and clock < TIME_TROUBLE_SECONDS:
+        state['moves'][move['side']] += 1
+        if move['exp_point_loss'] >= state['blunder']:
+            state['blunders'][move['side']] += 1
+
+def finish_time_trouble(state, game, scheme):
+    return {
+        "white_time_trouble_moves": state['moves'][0], "black_time_trouble_moves": state['moves'][1],
+        "white_time_trouble_blunders": state['blunders'][0], "black_time_trouble_blunders": state['blunders'][1],
+    }
+
+# Metric 'phase_gpl': the GPL of each player in the opening, the middlegame and the endgame (see PHASES),
+# by the ply from the start of the game record
+def start_phase_gpl(game, scheme):
+    return {'gpl': [[0] * len(PHASES), [0] * len(PHASES)]}
+
+def update_phase_gpl(state, move):
+    phase = 0
+    while PHASES[phase][1] is not None and move['ply'] > PHASES[phase][1]:
+        phase += 1
+    state['gpl'][move['side']][phase] += move['exp_point_loss']
+
+def finish_phase_gpl(state, game, scheme):
+    columns = {}
+    for side, player in enumerate(('white', 'black')):
+        for (phase, last_ply), gpl in zip(PHASES, state['gpl'][side]):
+            columns[f"{player}_{phase}_gpl"] = round(gpl, 4)
+    return columns
+
+register_metric('acpl', start_acpl, update_acpl, finish_acpl)
+register_metric('gpl', start_gpl, update_gpl, finish_gpl, per_scheme=True)
+register_metric('blunders', start_blunders, update_blunders, finish_blunders, per_scheme=True)
+register_metric('accuracy', start_accuracy, update_accuracy, finish_accuracy)
+register_metric('volatility', start_volatility, update_volatility, finish_volatility)
+register_metric('time_trouble', start_time_trouble, update_time_trouble, finish_time_trouble, per_scheme=True,
+                uses_clocks=True)
+register_metric('phase_gpl', start_phase_gpl, update_phase_gpl, finish_phase_gpl, per_scheme=True)
+
+# Function to add the metric options to an argparse parser
+def add_metric_arguments(parser):
+    parser.add_argument('--metrics', nargs='+', choices=list(METRICS), default=DEFAULT_METRICS, metavar='METRIC',
+                        help="metrics calculated in one pass over each game: " + ", ".join(METRICS)
+                             + " (default: " + " ".join(DEFAULT_METRICS) + ")")
+    parser.add_argument('--metric-timing', action='store_true', help="print the time spent in each metric")
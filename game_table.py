@@ -0,0 +1,229 @@
+"""Helpers to write and read the aggregated game table produced by json_to_csv_converter.py.
+Besides CSV, the table can be stored in columnar form as Parquet (.parquet) or Arrow IPC (.feather),
+with compact dtypes (categorical player names, int16 Elo, float32 metrics), and the stats scripts
+read only the columns they need. Parquet and Arrow IPC need pyarrow.
+With compact=True a CSV game table is read with the declared dtypes of the columns written by
+json_to_csv_converter.py, through the pyarrow parser when it is installed, so the player names are
+categoricals and the metrics float32 from the start; the stats are then computed in float32.
+Monthly CSV game tables are combined with combine_csv_files, which streams the files into the output
+instead of holding them all in memory.
+"""
+
+import glob
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+GAME_TABLE_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.feather'}
+# Largest CSV file combine_csv_files reads ahead whole in a thread; larger files are copied block by block
+READ_AHEAD_MAX_BYTES = 64 * 1024 * 1024
+
+# Columns with few distinct values, stored as categoricals
+CATEGORICAL_COLUMNS = ['White', 'Black', 'Event', 'Round', 'Date']
+# Text columns of the game table
+TEXT_COLUMNS = CATEGORICAL_COLUMNS + ['Site']
+ELO_COLUMNS = ['WhiteElo', 'BlackElo']
+# 1, 0.5, 0 or '...' for unfinished games, stored as float32 with NaN for '...'
+RESULT_COLUMNS = ['WhiteResult', 'BlackResult']
+
+# Metric and move count columns written by json_to_csv_converter.py
+METRIC_COLUMNS = ['white_gi', 'black_gi', 'white_gpl', 'black_gpl', 'white_acpl', 'black_acpl',
+                  'white_avg_gpl', 'black_avg_gpl', 'adjusted_white_gi', 'adjusted_black_gi']
+MOVE_COLUMNS = ['white_move_number', 'black_move_number']
+# Dtypes used to parse these columns of a CSV game table with compact=True. The Elo and result columns
+# may hold '?' or '...', so they are parsed as categoricals and converted by optimize_dtypes. The other
+# columns (tcpl, counts.*) are parsed with inferred dtypes and then downcast.
+CSV_DTYPES = {column: 'category' for column in CATEGORICAL_COLUMNS + ELO_COLUMNS + RESULT_COLUMNS}
+CSV_DTYPES.update({column: 'float32' for column in METRIC_COLUMNS})
+CSV_DTYPES.update({column: 'int32' for column in MOVE_COLUMNS})
+
+# Function to convert a column to numbers, with NaN for values such as '?' or '...'.
+# A categorical column is converted through its categories instead of value by value.
+def to_numeric_column(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = pd.to_numeric(pd.Series(series.cat.categories.astype(str)), errors='coerce').to_numpy('float64')
+        codes = series.cat.codes.to_numpy()
+        return pd.Series(np.where(codes >= 0, categories[codes], np.nan), index=series.index)
+    return pd.to_numeric(series, errors='coerce')
+
+# Function to convert the columns of the game table to compact dtypes
+def optimize_dtypes(df):
+    # Columns are replaced rather than modified, so a shallow copy leaves the caller's frame unchanged
+    df = df.copy(deep=False)
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].astype('category')
+        elif column in ELO_COLUMNS:
+            df[column] = to_numeric_column(df[column]).astype('Int16')
+        elif column in RESULT_COLUMNS:
+            df[column] = to_numeric_column(df[column]).astype('float32')
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype('float32')
+        elif pd.api.types.is_integer_dtype(df[column]):
+            df[column] = df[column].astype('int32')
+    return df
+
+# Function to write the game table in the format given by the file extension
+def write_game_table(df, file_path):
+    if file_path.endswith(('.parquet', '.feather', '.arrow')):
+        import pyarrow as pa
+        # A frame concatenated from many small frames converts to many small chunks, so merge them
+        table = pa.Table.from_pandas(optimize_dtypes(df), preserve_index=False).combine_chunks()
+        if file_path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            pq.write_table(table, file_path)
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(table, file_path)
+    else:
+        df.to_csv(file_path, index=False)
+
+# Function to get the parser of pandas.read_csv for compact reads: pyarrow if it is installed
+def csv_engine():
+    try:
+        import pyarrow
+        return 'pyarrow'
+    except ImportError:
+        return 'c'
+
+# Function to get the declared dtypes of the columns of a CSV game table that are read
+def csv_dtypes(file_path, columns=None):
+    return {column: CSV_DTYPES[column] for column in columns or game_table_columns(file_path) if column in CSV_DTYPES}
+
+# Function to read the game table, or only the given columns of it, in the format given by the file extension.
+# With compact=True the table is read with compact dtypes (see CSV_DTYPES and optimize_dtypes).
+def read_game_table(file_path, columns=None, compact=False):
+    if file_path.endswith('.parquet'):
+        df = pd.read_parquet(file_path, columns=columns, memory_map=True)
+    elif file_path.endswith(('.feather', '.arrow')):
+        df = pd.read_feather(file_path, columns=columns)
+    elif compact:
+        df = pd.read_csv(file_path, usecols=columns, dtype=csv_dtypes(file_path, columns), engine=csv_engine())
+        # The pyarrow parser returns the columns in the order of usecols rather than of the file
+        df = df[[column for column in game_table_columns(file_path) if column in df.columns]]
+    else:
+        # The default parser, so the values are the same as in previous versions
+        return pd.read_csv(file_path, usecols=columns)
+    return optimize_dtypes(df) if compact else df
+
+# Function to read the game table in chunks of about chunksize rows
+def iter_game_table(file_path, columns=None, chunksize=1000000, compact=False):
+    if file_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        chunks = (batch.to_pandas() for batch in
+                  pq.ParquetFile(file_path, memory_map=True).iter_batches(batch_size=chunksize, columns=columns))
+    elif file_path.endswith(('.feather', '.arrow')):
+        df = pd.read_feather(file_path, columns=columns)
+        chunks = (df.iloc[start:start + chunksize] for start in range(0, len(df), chunksize))
+    elif compact:
+        # The pyarrow parser cannot read in chunks
+        chunks = pd.read_csv(file_path, usecols=columns, chunksize=chunksize, memory_map=True,
+                             dtype=csv_dtypes(file_path, columns))
+    else:
+        chunks = pd.read_csv(file_path, usecols=columns, chunksize=chunksize)
+    for chunk in chunks:
+        yield optimize_dtypes(chunk) if compact else chunk
+
+# Function to print the number of games, the load time and the memory used by a loaded game table
+def print_load_report(file_path, df, seconds):
+    memory_mb = df.memory_usage(deep=True).sum() / (1024 * 1024)
+    print(f"Loaded {len(df)} games and {len(df.columns)} columns of {file_path} in {seconds:.2f} s, "
+          f"{memory_mb:.1f} MB in memory")
+
+# Function to get the column names of the game table without reading its data
+def game_table_columns(file_path):
+    if file_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_schema(file_path).names
+    if file_path.endswith(('.feather', '.arrow')):
+        import pyarrow.ipc as ipc
+        with ipc.open_file(file_path) as reader:
+            return reader.schema.names
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+# Function to read the header line of a CSV file as a list of column names
+def csv_header(file_path):
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+# Function to read a CSV file without its header line, ending with a newline
+def read_csv_body(file_path):
+    with open(file_path, 'rb') as f:
+        f.readline()
+        body = f.read()
+    if body and not body.endswith(b'\n'):
+        body += b'\n'
+    return body
+
+# Function to copy a CSV file without its header line to the output file in blocks
+def copy_csv_body(file_path, outfile):
+    with open(file_path, 'rb') as f:
+        f.readline()
+        body_start = f.tell()
+        shutil.copyfileobj(f, outfile, 1024 * 1024)
+        if f.tell() > body_start:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                outfile.write(b'\n')
+
+# Function to start reading a CSV file without its header line in a thread, or None if it is too large to be
+# held in memory and has to be copied block by block
+def read_ahead(executor, file_path):
+    if os.path.getsize(file_path) > READ_AHEAD_MAX_BYTES:
+        return None
+    return executor.submit(read_csv_body, file_path)
+
+# Function to combine the CSV files of a directory (e.g. one game table per month) into one CSV file.
+# The header of every file is checked against the first one. If they all match, the files are copied
+# to the output as bytes, one block at a time, so memory does not grow with the number of files; with
+# jobs > 1, up to jobs files of at most READ_AHEAD_MAX_BYTES are read ahead in threads while the previous ones are
+# written, and larger files are still copied block by block, so memory stays below (jobs + 1) * READ_AHEAD_MAX_BYTES.
+# If the columns
+# differ, a ValueError is raised, unless allow_missing_columns is set: then the files are streamed in chunks
+# of chunksize rows into the union of their columns, with empty values for the missing ones.
+def combine_csv_files(input_dir, output_filename='combined.csv', jobs=1, allow_missing_columns=False, chunksize=1000000):
+    output_path = os.path.join(input_dir, output_filename)
+    csv_files = sorted(f for f in glob.glob(os.path.join(input_dir, '*.csv'))
+                       if os.path.abspath(f) != os.path.abspath(output_path))
+    if not csv_files:
+        raise ValueError(f"No CSV files found in {input_dir}")
+
+    headers = [csv_header(f) for f in csv_files]
+    columns = list(headers[0])
+    mismatched = [(f, header) for f, header in zip(csv_files, headers) if header != headers[0]]
+    for file_path, header in mismatched:
+        if not allow_missing_columns:
+            raise ValueError(f"Columns of {file_path} differ from {csv_files[0]}: "
+                             f"missing {sorted(set(columns) - set(header))}, extra {sorted(set(header) - set(columns))}")
+        columns += [column for column in header if column not in columns]
+
+    temp_path = output_path + '.tmp'
+    if mismatched:
+        pd.DataFrame(columns=columns).to_csv(temp_path, index=False)
+        for file_path in csv_files:
+            for chunk in pd.read_csv(file_path, chunksize=chunksize):
+                chunk.reindex(columns=columns).to_csv(temp_path, mode='a', header=False, index=False)
+    else:
+        with open(csv_files[0], 'rb') as f:
+            header_line = f.readline()
+        with open(temp_path, 'wb') as outfile:
+            outfile.write(header_line if header_line.endswith(b'\n') else header_line + b'\n')
+            if jobs > 1:
+                with ThreadPoolExecutor(max_workers=jobs) as executor:
+                    futures = [read_ahead(executor, f) for f in csv_files[:jobs]]
+                    for index, file_path in enumerate(csv_files):
+                        body = futures[index].result() if futures[index] is not None else None
+                        futures[index] = None
+                        if index + jobs < len(csv_files):
+                            futures.append(read_ahead(executor, csv_files[index + jobs]))
+                        if body is None:
+                            copy_csv_body(file_path, outfile)
+                        else:
+                            outfile.write(body)
+            else:
+                for file_path in csv_files:
+                    copy_csv_body(file_path, outfile)
+    os.replace(temp_path, output_path)
+    print(f"Combined {len(csv_files)} CSV files into {output_path}")
+    return output_path
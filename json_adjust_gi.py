@@ -1,12 +1,26 @@
 """
 This Python script recursively modifies each JSON file by adding 'adjusted_white_gi' and 'adjusted_black_gi' keys based on given formulas.
 The formula gives different weights to the intelligence scores achieved against opponents with lower rating.
+JSON Lines files (.jsonl, .jsonl.zst) are processed in batches of games, without loading the whole file.
+The adjusted gi of all games of a batch (or JSON file) is calculated at once with NumPy, each file is written
+to a temporary file that then replaces it, files that already have the adjusted gi are skipped, and with
+--workers N the files are processed in N processes.
 """
 
 import os
 import json
 import math
-import sys
+import argparse
+from itertools import chain, islice
+from multiprocessing import Pool
+import numpy as np
+from jsonl_io import is_jsonl_file, open_jsonl, read_jsonl, write_jsonl_record
+
+# Rating the expected scores are calculated against
+REFERENCE_ELO = 2800
+# Games of a JSON Lines file adjusted at once
+BATCH_SIZE = 10000
+TEMP_PREFIX = '.tmp-'
 
 def expected_score(elo, opponent_elo):
     return 1 / (1 + 10 ** ((opponent_elo - elo) / 400))
@@ -14,28 +28,100 @@ def expected_score(elo, opponent_elo):
 def calculate_adjusted_gi(gi, elo, opponent_elo):
     return gi - (1 - 2 * expected_score(elo, opponent_elo)) * abs(gi)
 
+# Function to calculate the adjusted gi of many games at once. The expected score is calculated once per
+# distinct rating with expected_score, so the values are the same as those of calculate_adjusted_gi.
+def calculate_adjusted_gis(gis, elos, opponent_elo):
+    gis = np.asarray(gis, dtype='float64')
+    unique_elos, inverse = np.unique(np.asarray(elos, dtype='int64'), return_inverse=True)
+    expected = np.array([expected_score(elo, opponent_elo) for elo in unique_elos.tolist()], dtype='float64')
+    return gis - (1 - 2 * expected[inverse]) * np.abs(gis)
+
+def adjust_game(game):
+    white_elo = int(game["WhiteElo"])
+    black_elo = int(game["BlackElo"])
+    game["adjusted_white_gi"] = calculate_adjusted_gi(game["white_gi"], white_elo, REFERENCE_ELO)
+    game["adjusted_black_gi"] = calculate_adjusted_gi(game["black_gi"], black_elo, REFERENCE_ELO)
+
+# Function to add the adjusted gi to a list of games
+def adjust_games(games):
+    for side, elo_key in (('white', 'WhiteElo'), ('black', 'BlackElo')):
+        adjusted = calculate_adjusted_gis([game[f'{side}_gi'] for game in games],
+                                          [int(game[elo_key]) for game in games], REFERENCE_ELO)
+        for game, value in zip(games, adjusted.tolist()):
+            game[f'adjusted_{side}_gi'] = value
+
+def is_adjusted(game):
+    return 'adjusted_white_gi' in game and 'adjusted_black_gi' in game
+
+def temp_path_for(filepath):
+    directory, filename = os.path.split(filepath)
+    return os.path.join(directory, TEMP_PREFIX + filename)
+
+# Adjusts the games of a JSON file and replaces it through a temporary file. Returns False if it was already adjusted.
 def process_json_file(filepath):
     with open(filepath, 'r') as file:
         data = json.load(file)
 
-    for key, game in data.items():
-        white_elo = int(game["WhiteElo"])
-        black_elo = int(game["BlackElo"])
-        game["adjusted_white_gi"] = calculate_adjusted_gi(game["white_gi"], white_elo, 2800)
-        game["adjusted_black_gi"] = calculate_adjusted_gi(game["black_gi"], black_elo, 2800)
+    games = list(data.values())
+    if all(is_adjusted(game) for game in games):
+        return False
+    adjust_games(games)
 
-    with open(filepath, 'w') as file:
+    temp_path = temp_path_for(filepath)
+    with open(temp_path, 'w') as file:
         json.dump(data, file, indent=4)
+    os.replace(temp_path, filepath)
+    return True
+
+# Streams the games of a JSON Lines file into a temporary file, which then replaces the original.
+# Files are only ever replaced whole, so a file whose first game is adjusted is skipped.
+def process_jsonl_file(filepath):
+    games = read_jsonl(filepath)
+    first_game = next(games, None)
+    if first_game is None or is_adjusted(first_game):
+        games.close()
+        return False
+
+    temp_path = temp_path_for(filepath)
+    games = chain([first_game], games)
+    with open_jsonl(temp_path, 'w') as file:
+        while True:
+            batch = list(islice(games, BATCH_SIZE))
+            if not batch:
+                break
+            adjust_games(batch)
+            for game in batch:
+                write_jsonl_record(file, game)
+    os.replace(temp_path, filepath)
+    return True
 
-def main(json_output_dir):
-    input_directory = json_output_dir
+def process_file(filepath):
+    if is_jsonl_file(filepath):
+        return process_jsonl_file(filepath)
+    return process_json_file(filepath)
+
+# Function to list the JSON and JSON Lines files of a directory and its subdirectories,
+# leaving out the temporary files of an interrupted run
+def find_json_files(input_directory):
+    json_files = []
     for root, dirs, files in os.walk(input_directory):
         for file in files:
-            if file.endswith('.json'):
-                process_json_file(os.path.join(root, file))
+            if (file.endswith('.json') or is_jsonl_file(file)) and not file.startswith(TEMP_PREFIX):
+                json_files.append(os.path.join(root, file))
+    return sorted(json_files)
+
+def main(json_output_dir, workers=1):
+    json_files = find_json_files(json_output_dir)
+    if workers > 1:
+        with Pool(workers) as pool:
+            adjusted = pool.map(process_file, json_files, chunksize=1)
+    else:
+        adjusted = [process_file(filepath) for filepath in json_files]
+    print(f"Adjusted {sum(adjusted)} files, skipped {len(adjusted) - sum(adjusted)} already adjusted files")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python json_adjust_gi.py <json_output_dir>")
-        sys.exit(1)
-    main(json_output_dir)
+    parser = argparse.ArgumentParser(description="Add the Elo-adjusted gi to the JSON files of the analyzer.")
+    parser.add_argument('json_output_dir')
+    parser.add_argument('--workers', type=int, default=1, help="number of files processed in parallel")
+    args = parser.parse_args()
+    main(args.json_output_dir, args.workers)
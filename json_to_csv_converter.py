@@ -1,14 +1,18 @@
 """This script inputs the JSON files generated by evaluated_games_extractor.py and outputs a CSV file
 containing the following columns:
 - White, Black, WhiteElo, BlackElo, WhiteResult, BlackResult, gi, gpl, acpl, white_move_number, black_move_number
+JSON Lines files (.jsonl, .jsonl.zst) are read one game at a time.
+With --output-format parquet or arrow the table is written in columnar form with compact dtypes (see game_table.py).
 """
 
 import json
 import os
 import pandas as pd
-from pandas import json_normalize
 import time
 import sys
+import argparse
+from jsonl_io import is_jsonl_file, read_jsonl
+from game_table import GAME_TABLE_EXTENSIONS, write_game_table
 
 def extract_last_name(full_name):
     if not full_name:
@@ -22,7 +26,7 @@ def extract_last_name(full_name):
 
     return last_name
 
-def process_json_file(json_file_path, data_list):
+def process_json_file(json_file_path, columns):
     try:
         with open(json_file_path, 'r') as f:
             all_data = json.load(f)
@@ -32,51 +36,93 @@ def process_json_file(json_file_path, data_list):
                 return
             # Iterate through each key in the JSON file
             for key, data in all_data.items():
-                white_player = data.get('White', '')
-                black_player = data.get('Black', '')
+                process_game(data, columns)
 
-                data['White'] = extract_last_name(white_player)
-                data['Black'] = extract_last_name(black_player)
+    except Exception as e:
+        print(f'Error processing {json_file_path}: {e}')
 
-                flattened_data = json_normalize(data)
-                data_list.append(flattened_data)
+def process_jsonl_file(jsonl_file_path, columns):
+    try:
+        game_count = 0
+        for data in read_jsonl(jsonl_file_path):
+            process_game(data, columns)
+            game_count += 1
+
+        if not game_count:
+            print(f"No data found in {jsonl_file_path}")
 
     except Exception as e:
-        print(f'Error processing {json_file_path}: {e}')
+        print(f'Error processing {jsonl_file_path}: {e}')
+
+# Function to flatten nested dicts (e.g. counts) into 'counts.white_blunder' keys, with the same
+# column order as pandas.json_normalize: plain keys first, then the flattened nested keys
+def flatten_game(data, prefix=''):
+    flattened_data = {}
+    nested = []
+    for key, value in data.items():
+        if isinstance(value, dict):
+            nested.append((key, value))
+        else:
+            flattened_data[prefix + key] = value
+    for key, value in nested:
+        flattened_data.update(flatten_game(value, prefix + key + '.'))
+    return flattened_data
+
+# Function to append a game to the column lists of the table. A column that first appears in a later game
+# is filled with None for the earlier games, and a column missing from a game gets None, as with pd.concat.
+def process_game(data, columns):
+    white_player = data.get('White', '')
+    black_player = data.get('Black', '')
+
+    data['White'] = extract_last_name(white_player)
+    data['Black'] = extract_last_name(black_player)
+
+    row_count = len(next(iter(columns.values()))) if columns else 0
+    for column, value in flatten_game(data).items():
+        if column not in columns:
+            columns[column] = [None] * row_count
+        columns[column].append(value)
+    for values in columns.values():
+        if len(values) == row_count:
+            values.append(None)
 
-def main(directory_path, csv_output_dir):
-    data_list = []
+def main(directory_path, csv_output_dir, output_format='csv'):
+    # One list of values per column, so the DataFrame is built once at the end
+    columns = {}
 
     # Walk through the directory and its subdirectories
     for root, dirs, files in os.walk(directory_path):
         for file in files:
             if file.endswith('.json'):
                 json_file_path = os.path.join(root, file)
-                process_json_file(json_file_path, data_list)
+                process_json_file(json_file_path, columns)
+            elif is_jsonl_file(file):
+                process_jsonl_file(os.path.join(root, file), columns)
 
-    if not data_list:  # Check if data_list is empty
+    if not columns:  # Check if no game was found
         print("No JSON files found or all files are empty.")
         return
 
-    data_frame = pd.concat(data_list, ignore_index=True)
+    data_frame = pd.DataFrame(columns)
 
     # Ensure the output directory exists
     if not os.path.exists(csv_output_dir):
         os.makedirs(csv_output_dir)
 
-    # Define the output CSV file path within the output directory
-    csv_output_file = os.path.join(csv_output_dir, 'aggregated_game_data.csv')
-    data_frame.to_csv(csv_output_file, index=False)
+    # Define the output file path within the output directory
+    csv_output_file = os.path.join(csv_output_dir, 'aggregated_game_data' + GAME_TABLE_EXTENSIONS[output_format])
+    write_game_table(data_frame, csv_output_file)
     print(f"Data saved to {csv_output_file}")
 
 if __name__ == "__main__":
     start_time = time.time()
-    if len(sys.argv) < 3:
-        print("Usage: python json_to_csv_converter.py <json_dir> <csv_output_dir>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Convert the JSON files of the analyzers to one game table.")
+    parser.add_argument('json_dir')
+    parser.add_argument('csv_output_dir')
+    parser.add_argument('--output-format', choices=list(GAME_TABLE_EXTENSIONS), default='csv',
+                        help="csv, parquet or arrow (Arrow IPC / Feather); the columnar formats need pyarrow")
+    args = parser.parse_args()
 
-    json_dir = sys.argv[1]
-    csv_output_dir = sys.argv[2]
-    main(json_dir, csv_output_dir)
+    main(args.json_dir, args.csv_output_dir, args.output_format)
     end_time = time.time()
     print("Script finished in {:.2f} minutes".format((end_time - start_time) / 60.0))
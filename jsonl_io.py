@@ -0,0 +1,29 @@
+"""Helpers to read and write JSON Lines files, i.e. one compact JSON record per game and line,
+optionally zstd-compressed (.jsonl.zst). Records are read and written one at a time,
+so a file never has to fit in memory and a crash only loses the games not yet written.
+"""
+
+import json
+import zstandard as zstd
+
+JSONL_EXTENSIONS = ('.jsonl', '.jsonl.zst')
+
+def is_jsonl_file(filename):
+    return filename.endswith(JSONL_EXTENSIONS)
+
+# Function to open a JSON Lines file in text mode, compressing or decompressing .zst files on the fly
+def open_jsonl(file_path, mode='r'):
+    if file_path.endswith('.zst'):
+        return zstd.open(file_path, mode + 't', encoding='utf-8')
+    return open(file_path, mode, encoding='utf-8')
+
+# Function to read the records of a JSON Lines file one by one
+def read_jsonl(file_path):
+    with open_jsonl(file_path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+# Function to write one record to an open JSON Lines file
+def write_jsonl_record(f, record):
+    f.write(json.dumps(record, separators=(',', ':')) + '\n')
@@ -1,49 +1,120 @@
+"""This script runs the whole pipeline in-process, from the Lichess .zst files to the player statistics.
+Progress is recorded in a manifest (see pipeline_runner.py), so a second run only processes the files
+that changed since the last run, and a run that was interrupted resumes where it stopped.
+"""
+
 import os
-import subprocess
+import shutil
+import sys
+import evaluated_games_extractor
+import pgn_evaluation_analyzer
+import json_adjust_gi
+import json_to_csv_converter
+import csv_to_player_stats
+import chess_stats_summarizer
+from jsonl_io import open_jsonl, write_jsonl_record
+from pipeline_runner import load_manifest, run_aggregate_stage, run_file_stage
 
 def prompt_for_path(message):
     return input(f"Enter the {message}: ").strip()
 
-def run_script(script_path, args):
-    try:
-        subprocess.run(['python', script_path] + args, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"An error occurred while running {script_path}: {e}")
+# Function to list the files with the given extension in a directory and its subdirectories, in a stable order
+def find_files(directory, extension):
+    found_files = []
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            if file.endswith(extension):
+                found_files.append(os.path.join(root, file))
+    return sorted(found_files)
+
+# Function to extract the games of one .zst file into its own directory of PGN files
+def extract_zst_file(zst_file, pgn_output_dir, json_output_dir, max_file_size):
+    name = os.path.basename(zst_file).split('.')[0]
+    output_directory = os.path.join(pgn_output_dir, name)
+    # Remove the PGN files of an interrupted run, since the extractor numbers its output files from 1,
+    # and the JSON Lines files of the previous extraction, which may have had more PGN files
+    shutil.rmtree(output_directory, ignore_errors=True)
+    shutil.rmtree(os.path.join(json_output_dir, name), ignore_errors=True)
+    os.makedirs(output_directory)
+    evaluated_games_extractor.filter_and_save_files([zst_file], output_directory, max_file_size)
+
+# Function to analyze one PGN file into a JSON Lines file, written to a temporary file first
+def analyze_pgn_file(pgn_file, json_file, scoring_system, workers, fast_scan):
+    os.makedirs(os.path.dirname(json_file), exist_ok=True)
+    temp_path = json_file + '.tmp'
+    with open_jsonl(temp_path, 'w') as outfile:
+        for game_data in pgn_evaluation_analyzer.analyze_pgn_files([pgn_file], scoring_system, workers,
+                                                                    fast_scan=fast_scan):
+            write_jsonl_record(outfile, game_data)
+    os.replace(temp_path, json_file)
 
 def main():
-    base_path = os.path.dirname(os.path.abspath(__file__))
     # input directory for Lichess Open Database files (.zst files). E.g. https://database.lichess.org/
     lichess_db_input_dir = ''
-    # output directory for PGN files
+    # output directory for PGN files (one subdirectory per .zst file)
     pgn_output_dir = ''
-    # folder path for the output JSON file (from PGN files)
-    json_output_dir = ''     
-    # path for the output CSV file (from JSON file)
+    # folder path for the output JSON Lines files (one per PGN file)
+    json_output_dir = ''
+    # path for the output CSV file (from JSON files)
     csv_output_dir = ''
-    # input the combined CSV file path for calculating statistics
-    csv_combined_file_path = '.../aggregated_game_data.csv'
     # output directory for statistics
     stats_output_dir = ''
-    # input the player stats CSV file path
-    csv_player_stats_file_path = '.../player_stats.csv'
-    # output CSV file for player statistics
-    player_stats_output_dir = ''
-
-    # Define the paths and arguments for each script
-    scripts = [
-        ('evaluated_games_extractor.py', [lichess_db_input_dir, pgn_output_dir]), 
-        ('pgn_evaluation_analyzer.py', [pgn_output_dir, json_output_dir]),
-        ('json_adjust_gi.py', [json_output_dir]),
-        ('json_to_csv_converter.py', [json_output_dir, csv_output_dir]),
-        ('csv_to_player_stats.py', [csv_combined_file_path, stats_output_dir]),
-        ('chess_stats_summarizer.py', [csv_combined_file_path, stats_output_dir]),
+    # manifest of the processed files, used to skip up-to-date stages and to resume an interrupted run
+    manifest_path = os.path.join(stats_output_dir, 'pipeline_manifest.json')
+    # maximum size of each extracted PGN file
+    max_file_size = 1024 * 1024 * 100
+    # number of worker processes of the analyzer
+    workers = 1
+    # read the games with pgn_scanner instead of chess.pgn.read_game (same results, without replaying the moves)
+    fast_scan = True
+    scoring_system = 'Standard'  # Or 'NorwayChess' 3-1-0 scoring, or a list of schemes (see scoring_schemes.py)
+
+    csv_combined_file_path = os.path.join(csv_output_dir, 'aggregated_game_data.csv')
+    os.makedirs(stats_output_dir or '.', exist_ok=True)
+    manifest = load_manifest(manifest_path)
+
+    # The JSON Lines file of each PGN file mirrors its path below pgn_output_dir
+    def json_file_for(pgn_file):
+        relative_path = os.path.relpath(pgn_file, pgn_output_dir)
+        return os.path.join(json_output_dir, os.path.splitext(relative_path)[0] + '.jsonl')
+
+    def extract_output_exists(zst_file):
+        return os.path.isdir(os.path.join(pgn_output_dir, os.path.basename(zst_file).split('.')[0]))
+
+    stages = [
+        lambda: run_file_stage(
+            manifest, manifest_path, 'evaluated_games_extractor', find_files(lichess_db_input_dir, '.zst'),
+            lambda zst_file: extract_zst_file(zst_file, pgn_output_dir, json_output_dir, max_file_size),
+            extract_output_exists),
+        lambda: run_file_stage(
+            manifest, manifest_path, 'pgn_evaluation_analyzer', find_files(pgn_output_dir, '.pgn'),
+            lambda pgn_file: analyze_pgn_file(pgn_file, json_file_for(pgn_file), scoring_system, workers, fast_scan),
+            lambda pgn_file: os.path.exists(json_file_for(pgn_file))),
+        # Adjusts the JSON Lines files in place; the manifest records them after the adjustment
+        lambda: run_file_stage(
+            manifest, manifest_path, 'json_adjust_gi', find_files(json_output_dir, '.jsonl'),
+            json_adjust_gi.process_jsonl_file),
+        lambda: run_aggregate_stage(
+            manifest, manifest_path, 'json_to_csv_converter', find_files(json_output_dir, '.jsonl'),
+            lambda: json_to_csv_converter.main(json_output_dir, csv_output_dir), [csv_combined_file_path]),
+        lambda: run_aggregate_stage(
+            manifest, manifest_path, 'csv_to_player_stats', [csv_combined_file_path],
+            lambda: csv_to_player_stats.main(csv_combined_file_path, stats_output_dir),
+            [os.path.join(stats_output_dir, 'player_stats.csv')]),
+        lambda: run_aggregate_stage(
+            manifest, manifest_path, 'chess_stats_summarizer', [csv_combined_file_path],
+            lambda: chess_stats_summarizer.main(csv_combined_file_path, stats_output_dir),
+            [os.path.join(stats_output_dir, 'summarized_game_data.csv')]),
     ]
 
-    # Sequentially run the scripts with their full paths and arguments
-    for script_name, args in scripts:
-        script_path = os.path.join(base_path, script_name)
-        print(f"Running {script_path}...")
-        run_script(script_path, args)
+    # Run the stages in order and stop at the first failure, since the later stages would read stale data
+    for stage in stages:
+        try:
+            stage()
+        except Exception as e:
+            print(f"The pipeline stopped with an error: {e}")
+            print("Run it again to resume from the last completed file.")
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
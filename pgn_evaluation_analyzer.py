@@ -1,38 +1,49 @@
 """This script inputs the PGN file generated by lichess_evals_extractor.py and outputs a JSON file
 containing the following columns:
 - White, Black, WhiteElo, BlackElo, WhiteResult, BlackResult, gi, gpl, acpl, white_move_number, black_move_number
+With --dedup-index, games already in the index (see dedup_index.py) are skipped before they are analyzed.
+With --game-index the games are read through the game index of each PGN file (see game_index.py): the batches of
+the workers are cut from the index instead of searching the file, and the header options of game_filter.py
+(e.g. --min-elo, --time-controls, --eval-required) select the games without reading their move text.
+With --save-evals <dir> the evaluation trace of every game is saved to an eval store (see eval_store.py), and
+with --recompute the input is such a store: the game data is recomputed from the stored evaluations, e.g. with
+other scoring schemes, without parsing the PGN files again.
+With --scoring-system the game data is calculated for one or more scoring schemes (see scoring_schemes.py) in one
+pass over the evaluations of each game, e.g. --scoring-system Standard NorwayChess adds the norwaychess_ columns.
+The columns come from the metrics of game_metrics.py, which are calculated in one traversal of each game:
+--metrics chooses them (by default acpl, gpl and blunders, e.g. --metrics acpl gpl blunders accuracy time_trouble)
+and --metric-timing prints the time spent in each of them.
 """
 
+import argparse
+import io
 import json
 import os
 import chess.pgn
 import time
-from chess.engine import Cp, Mate, MateGiven, Wdl
-import chess.engine
-import sys
+from multiprocessing import Pool
+import numpy as np
+from pgn_scanner import parse_clock, parse_eval, scan_games
+from jsonl_io import open_jsonl, write_jsonl_record
+from dedup_index import add_game_headers, add_game_key, game_key, load_dedup_index, print_dedup_stats, save_dedup_index
+from game_filter import add_filter_arguments, header_filter_from_args
+from game_index import game_batches, game_index_for, read_ranges, select_games
+from eval_store import (MATE_BASE, MATE_THRESHOLD, MISSING_EVAL, STORE_HEADERS, add_game_trace, close_eval_store,
+                        create_eval_store, encode_score, load_eval_store, store_headers)
+from scoring_schemes import add_scoring_arguments, scoring_schemes_from_args
+from game_metrics import (METRICS, add_metric_arguments, add_metric_seconds, build_metric_set, print_metric_timing,
+                          resolve_metric_set, run_metrics)
 
-# Function to calculate the expected value of a position based on the scoring system
-def calculate_expected_value(win_prob, draw_prob, loss_prob, turn, scoring_system):
-    if scoring_system == "Standard":
-        if turn == "White":
-            expected_value_white = win_prob * 1 + draw_prob * 0.5
-            expected_value_black = loss_prob * 1 + draw_prob * 0.5
-        else:
-            expected_value_white = loss_prob * 1 + draw_prob * 0.5
-            expected_value_black = win_prob * 1 + draw_prob * 0.5
-    else:  # NorwayChess
-        if turn == "White":
-            expected_value_white = win_prob * 3 + draw_prob * 1.25
-            expected_value_black = loss_prob * 3 + draw_prob * 1.25
-        else:
-            expected_value_white = loss_prob * 3 + draw_prob * 1.25
-            expected_value_black = win_prob * 3 + draw_prob * 1.25
-    return expected_value_white, expected_value_black
+# Games of an eval store decoded at once by recompute_games
+RECOMPUTE_CHUNK_GAMES = 10000
+# Columns of the built-in metrics that come before the game details in the game data
+LEADING_COLUMNS = ["white_gi", "black_gi", "white_gpl", "black_gpl", "white_acpl", "black_acpl", "white_avg_gpl",
+                   "black_avg_gpl", "white_tcpl", "black_tcpl", "white_move_number", "black_move_number"]
 
-# Function to extract %eval from comments
-def extract_eval_from_node(node):
-    if node.eval():
-        eval_value = node.eval().relative
+# Function to convert a %eval score to pawns from the perspective of the side to move
+def extract_eval_from_score(score):
+    if score:
+        eval_value = score.relative
         if eval_value.is_mate():
             return 10 if eval_value.mate() > 0 else -10
         else:
@@ -40,142 +51,41 @@ def extract_eval_from_node(node):
     else:
         return None
 
-# Function to classify blunders, mistakes, inaccuracies
-def blunder_mistake_inaccuracy(exp_point_loss, is_white, counts, scoring_system):
-    if scoring_system == "NorwayChess":
-        blunder_threshold, mistake_threshold = 1.25, 0.625
-    else:  # Standard
-        blunder_threshold, mistake_threshold = 0.4, 0.2
+# Function to extract %eval from comments
+def extract_eval_from_node(node):
+    return extract_eval_from_score(node.eval())
 
-    if exp_point_loss >= blunder_threshold:
-        key = 'white_blunder' if is_white else 'black_blunder'
-    elif exp_point_loss >= mistake_threshold:
-        key = 'white_mistake' if is_white else 'black_mistake'
-    else:
-        key = 'white_inaccuracy' if is_white else 'black_inaccuracy'
-    counts[key] += 1
+# Function to collect the side to move and the comment of the root and each mainline node of a game.
+# The side to move is tracked by ply parity: node.board() and node.eval() walk back to the root on every call,
+# which makes the analysis quadratic in the game length.
+def game_mainline(game):
+    turn = game.turn()
+    mainline = [(turn, game.comment)]
+    for node in game.mainline():
+        turn = not turn
+        mainline.append((turn, node.comment))
+    return mainline
 
-    return counts
+# Function to collect the side to move and the %eval of the root and each mainline node of a game
+def extract_evals_from_game(game):
+    return extract_evals_from_mainline(game_mainline(game))
 
-def calculate_gi(game, scoring_system):
-    node = game
-    white_gpl = black_gpl = white_tcpl = black_tcpl = 0
-    white_move_number = black_move_number = 0
-    counts = {
-        "white_blunder": 0, "black_blunder": 0,
-        "white_mistake": 0, "black_mistake": 0,
-        "white_inaccuracy": 0, "black_inaccuracy": 0
-    }
-    while not node.is_end():
-        premove_eval = extract_eval_from_node(node)
-        # Set the first move variable
-        first_move = False
-        if premove_eval is None:
-            # Evaluation of the initial position
-            premove_eval = Cp(30)
-            first_move = True
-        else:
-            premove_eval = Cp(int(100*premove_eval))
-        win_draw_loss = premove_eval.wdl()
-        # print("premove: win_draw_loss",win_draw_loss)
-        win_prob, draw_prob, loss_prob = win_draw_loss.wins / 1000, win_draw_loss.draws / 1000, win_draw_loss.losses / 1000
-        turn = "White" if node.board().turn == chess.WHITE else "Black"
-        premove_exp_white, premove_exp_black = calculate_expected_value(
-            win_prob, draw_prob, loss_prob, turn, scoring_system)
-        # Make the move on the board
-        next_node = node.variation(0)
-        #print("premove_eval", premove_eval)
-        node = next_node
-        # Get the %eval from the comment after the move
-        postmove_eval = extract_eval_from_node(node)
-        if postmove_eval is not None:
-            postmove_eval = Cp(int(100*postmove_eval))
-            # Get the expectation for both players after making the move
-            win_draw_loss = postmove_eval.wdl()
-            # print("postmove: win_draw_loss",win_draw_loss)
-            win_prob, draw_prob, loss_prob = win_draw_loss.wins / 1000, win_draw_loss.draws / 1000, win_draw_loss.losses / 1000
-            turn = "White" if node.board().turn == chess.WHITE else "Black"
-            postmove_exp_white, postmove_exp_black = calculate_expected_value(win_prob, draw_prob, loss_prob, turn, scoring_system)
-            # If it's black's turn
-            if node.board().turn == chess.BLACK:
-                # Assuming that first move's loss is 0
-                if first_move is True:
-                    exp_white_point_loss = 0
-                    white_cp_loss = 0
-                else:
-                    # Define expected point loss of white's move
-                    exp_white_point_loss = premove_exp_white - postmove_exp_white
-                    # Define cp loss of white's move. It's plus because cp is from the perspective of the active player
-                    white_cp_loss = int(str(premove_eval))+int(str(postmove_eval))
-                # print("white_move_number white_cp_loss: ", white_move_number +1, white_cp_loss)
-                # Update white's GPL
-                white_gpl += exp_white_point_loss
-                # Update white's tcpl
-                white_tcpl += white_cp_loss
-                # Add blunder, mistake, inaccuracy
-                # Update counts with the new function
-                counts = blunder_mistake_inaccuracy(exp_white_point_loss, 'white', counts, scoring_system)
-                # Update white's move number
-                white_move_number += 1
-            else:
-                # Define expected point loss of black's move
-                exp_black_point_loss = premove_exp_black - postmove_exp_black
-                # Define cp loss of black's move. It's plus because cp is from the perspective of the active player
-                black_cp_loss = int(str(premove_eval))+int(str(postmove_eval))
-                # Update black's GPL
-                black_gpl += exp_black_point_loss
-                # Update black's tcpl
-                black_tcpl += black_cp_loss
-                # Update counts with the new function
-                counts = blunder_mistake_inaccuracy(exp_black_point_loss, 'black', counts, scoring_system)
-                # Update black's move number
-                black_move_number += 1
-        # Check if the game has a result
-        if 'Result' in game.headers and game.headers['Result'] != '*':
-            # Get the result of the game
-            result = game.headers['Result']
-            # If white won
-            if result == '1-0':
-                # Calculate GI for both players
-                if scoring_system == "NorwayChess":
-                    white_gi = 3 - white_gpl
-                    black_gi = -black_gpl
-                # If the scoring system is "Standard"
-                else:
-                    white_gi = 1 - white_gpl
-                    black_gi = -black_gpl
-            # If black won
-            elif result == '0-1':
-                # Calculate GI for both players
-                if scoring_system == "NorwayChess":
-                    black_gi = 3 - black_gpl
-                    white_gi = -white_gpl
-                # If the scoring system is "Standard"
-                else:
-                    black_gi = 1 - black_gpl
-                    white_gi = -white_gpl
-            elif result == '1/2-1/2':
-                # If it's a draw, calculate GI for both players
-                if scoring_system == "NorwayChess":
-                    white_gi = 1.25 - white_gpl
-                    black_gi = 1.25 - black_gpl
-                # If the scoring system is "Standard"
-                else:
-                    white_gi = 0.5 - white_gpl
-                    black_gi = 0.5 - black_gpl
-        else:
-            # Calculate (expected) GI for both players
-            white_gi = postmove_exp_white - white_gpl
-            black_gi = postmove_exp_black - black_gpl
+# Function to collect the side to move and the %eval of each node of a game read by pgn_scanner
+def extract_evals_from_mainline(mainline):
+    return [(turn, extract_eval_from_score(parse_eval(comment, turn))) for turn, comment in mainline]
 
-    # Calculate average GPL and ACPL
-    white_avg_gpl = white_gpl / white_move_number if white_move_number != 0 else 0
-    black_avg_gpl = black_gpl / black_move_number if black_move_number != 0 else 0
-    white_acpl = white_tcpl / white_move_number if white_move_number != 0 else 0
-    black_acpl = black_tcpl / black_move_number if black_move_number != 0 else 0
+def calculate_gi(game, metric_set):
+    return analyze_mainline(game.headers, game_mainline(game), metric_set)
+
+# Function to calculate the game data of a game with the metrics of metric_set (see game_metrics.py), in one pass
+# over its evaluations. metric_set may also be scoring schemes (see scoring_schemes.py), for which the default
+# metrics (ACPL, and the GI, GPL and counts of each scheme) are calculated. clocks are the [%clk ...] of the nodes,
+# for the metrics that use them.
+def calculate_gi_from_evals(headers, evals, metric_set, clocks=None):
+    metric_columns = run_metrics(resolve_metric_set(metric_set), headers, evals, clocks)
 
     # Extract game details
-    Result = game.headers.get("Result", None)
+    Result = headers.get("Result", None)
     if Result == '1-0':
         whiteResult = 1
         blackResult = 0
@@ -189,78 +99,308 @@ def calculate_gi(game, scoring_system):
         whiteResult = '...'
         blackResult = '...'
     # Create a dictionary with the data to be saved
-    
-    date = None
-    if "UTCDate" in game.headers:
-        dates = game.headers["UTCDate"]
-    elif "Date" in game.headers:
-        dates = game.headers["Date"]
+    dates = None
+    if "UTCDate" in headers:
+        dates = headers["UTCDate"]
+    elif "Date" in headers:
+        dates = headers["Date"]
 
     # Further game details
     game_details = {
-        "White": game.headers.get("White", None),
-        "Black": game.headers.get("Black", None),
-        "Event": game.headers.get("Event", None),
-        "Site": game.headers.get("Site", None),
-        "Round": game.headers.get("Round", None),
-        "WhiteElo": game.headers.get("WhiteElo", None),
-        "BlackElo": game.headers.get("BlackElo", None),
+        "White": headers.get("White", None),
+        "Black": headers.get("Black", None),
+        "Event": headers.get("Event", None),
+        "Site": headers.get("Site", None),
+        "Round": headers.get("Round", None),
+        "WhiteElo": headers.get("WhiteElo", None),
+        "BlackElo": headers.get("BlackElo", None),
         "WhiteResult": whiteResult,
         "BlackResult": blackResult,
         "Date": dates,
             }
-    # Return the dictionary with the data
-    return {
-        "white_gi": round(white_gi, 4), "black_gi": round(black_gi, 4),
-        "white_gpl": round(white_gpl, 4), "black_gpl": round(black_gpl, 4),
-        "white_acpl": round(white_acpl, 4), "black_acpl": round(black_acpl, 4),
-        "white_avg_gpl": round(white_avg_gpl, 4), "black_avg_gpl": round(black_avg_gpl, 4),
-        "white_tcpl": white_tcpl, "black_tcpl": black_tcpl,
-        "white_move_number": white_move_number, "black_move_number": black_move_number,
-        **game_details,
-        "counts": counts,
-    }
+    # Return the dictionary with the data: the columns of the built-in metrics in their usual order, the game
+    # details and then the other columns in the order of the metrics
+    game_data = {column: metric_columns.pop(column) for column in LEADING_COLUMNS if column in metric_columns}
+    game_data.update(game_details)
+    game_data.update(metric_columns)
+    return game_data
+
+# Function to list the PGN files of a folder in the order os.walk visits them
+def find_pgn_files(input_folder):
+    pgn_files = []
+    for dirpath, dirnames, filenames in os.walk(input_folder):
+        for filename in filenames:
+            if filename.endswith('.pgn'):
+                pgn_files.append(os.path.join(dirpath, filename))
+    return pgn_files
+
+# Function to split a PGN file into byte ranges that start at an [Event header
+def find_batch_ranges(pgn_file_path, batch_size):
+    file_size = os.path.getsize(pgn_file_path)
+    ranges = []
+    start = 0
+    with open(pgn_file_path, 'rb') as pgn:
+        while start < file_size:
+            end = start + batch_size
+            if end >= file_size:
+                ranges.append((start, file_size))
+                break
+            # Move the end of the batch forward to the beginning of the next game
+            pgn.seek(end)
+            next_game = -1
+            offset = end
+            tail = b''
+            while next_game == -1:
+                chunk = pgn.read(1024 * 1024)
+                if not chunk:
+                    break
+                data = tail + chunk
+                index = data.find(b'\n[Event ')
+                if index != -1:
+                    next_game = offset - len(tail) + index + 1
+                tail = data[-7:]
+                offset += len(chunk)
+            if next_game == -1:
+                ranges.append((start, file_size))
+                break
+            ranges.append((start, next_game))
+            start = next_game
+    return ranges
 
-# Main function to process PGN files and output a single JSON file
-def main(input_folder, output_json_dir):
-    aggregated_data = {}
-    scoring_system = 'Standard'  # Or 'NorwayChess' 3-1-0 scoring
+# Function to get the batches of (start, end) byte ranges of a PGN file the workers analyze.
+# With use_index the batches are cut from the game index and hold only the games selected by header_filter
+# and has_eval; otherwise each batch is one range found by find_batch_ranges.
+def pgn_file_batches(pgn_file_path, batch_size, use_index=False, header_filter=None, has_eval=False):
+    if use_index:
+        index = game_index_for(pgn_file_path)
+        return game_batches(index, select_games(index, header_filter, has_eval), batch_size)
+    return [[batch_range] for batch_range in find_batch_ranges(pgn_file_path, batch_size)]
+
+# Function to analyze a game given its headers and mainline (see game_mainline).
+# With return_trace (game_data, trace) is returned, where trace is the headers, the side to move at the root
+# and the encoded evaluations of the game for the eval store.
+def analyze_mainline(headers, mainline, metric_set, return_trace=False):
+    metric_set = resolve_metric_set(metric_set)
+    # The clocks are only parsed for the metrics that use them
+    clocks = [parse_clock(comment) for turn, comment in mainline] if metric_set['uses_clocks'] else None
+    if not return_trace:
+        return calculate_gi_from_evals(headers, extract_evals_from_mainline(mainline), metric_set, clocks)
+    scores = [(turn, parse_eval(comment, turn)) for turn, comment in mainline]
+    game_data = calculate_gi_from_evals(headers, [(turn, extract_eval_from_score(score)) for turn, score in scores],
+                                        metric_set, clocks)
+    trace_headers = {name: headers[name] for name in STORE_HEADERS if name in headers}
+    return game_data, (trace_headers, mainline[0][0] == chess.WHITE, [encode_score(score) for _, score in scores])
+
+# Function to analyze every game read from an open PGN file.
+# With fast_scan the games are read by pgn_scanner, which skips building the game tree and replaying the moves.
+# Games whose key is already in dedup_index are skipped before they are analyzed (and, without fast_scan,
+# before their moves are parsed). With return_keys or return_traces (key, game_data, trace) is yielded for
+# each game (see analyze_mainline), with None in place of what was not asked for.
+def analyze_games(pgn, metric_set, fast_scan=False, dedup_index=None, return_keys=False, return_traces=False):
+    if fast_scan:
+        for headers, mainline in scan_games(pgn):
+            key = game_key(headers) if dedup_index is not None or return_keys else None
+            if dedup_index is not None and not add_game_key(dedup_index, key):
+                continue
+            if return_keys or return_traces:
+                game_data, trace = analyze_mainline(headers, mainline, metric_set, True)
+                yield key, game_data, trace if return_traces else None
+            else:
+                yield analyze_mainline(headers, mainline, metric_set)
+        return
+    while True:
+        if dedup_index is not None:
+            # Read only the headers, and go back to read the whole game if it is new
+            offset = pgn.tell()
+            headers = chess.pgn.read_headers(pgn)
+            if headers is None:
+                break
+            if not add_game_headers(dedup_index, headers):
+                continue
+            pgn.seek(offset)
+        game = chess.pgn.read_game(pgn)
+        if game is None:
+            break
+        if return_keys or return_traces:
+            game_data, trace = analyze_mainline(game.headers, game_mainline(game), metric_set, True)
+            yield game_key(game.headers) if return_keys else None, game_data, trace if return_traces else None
+        else:
+            yield calculate_gi(game, metric_set)
+
+# Worker function to analyze the games of a batch of byte ranges of a PGN file.
+# Returns the results of analyze_games and the seconds spent in each metric of the batch.
+def analyze_batch(batch):
+    pgn_file_path, ranges, metric_set, fast_scan, return_keys, return_traces = batch
+    # The metric set is a copy of that of the main process, which adds up the seconds of the batches
+    metric_set['seconds'] = dict.fromkeys(metric_set['seconds'], 0.0)
+    with open(pgn_file_path, 'rb') as pgn:
+        data = read_ranges(pgn, ranges)
+    games_data = list(analyze_games(io.StringIO(data.decode('utf-8')), metric_set, fast_scan, return_keys=return_keys,
+                                    return_traces=return_traces))
+    return games_data, metric_set['seconds']
+
+# Function to add the traces of analyzed games read from pgn_file_path to the eval store, yielding their game data
+def store_traces(games, eval_store, pgn_file_path):
+    for key, game_data, trace in games:
+        add_game_trace(eval_store, pgn_file_path, *trace)
+        yield game_data
+
+# Function to analyze the games of all PGN files, yielding the game data in file order.
+# Games whose key is already in dedup_index are skipped (see analyze_games).
+# With use_index the games are read through the game index, keeping those selected by header_filter and has_eval.
+# The evaluation traces of the games are added to eval_store, if given.
+# metric_set is a metric set of game_metrics.py, or scoring schemes for the default metrics.
+def analyze_pgn_files(pgn_files, metric_set, workers=1, batch_size_mb=8, fast_scan=False, dedup_index=None,
+                      use_index=False, header_filter=None, has_eval=False, eval_store=None):
+    metric_set = resolve_metric_set(metric_set)
+    batch_size = int(batch_size_mb * 1024 * 1024)
+    return_traces = eval_store is not None
+    if workers > 1:
+        # Fan the files and the batches within large files out to the pool.
+        # imap returns the batches in order, so the keys match a serial run.
+        # The index lives in this process, so the workers return the key of each game and the
+        # duplicates are dropped here, in the same order as in a serial run.
+        return_keys = dedup_index is not None
+        batches = [(pgn_file_path, ranges, metric_set, fast_scan, return_keys, return_traces)
+                   for pgn_file_path in pgn_files
+                   for ranges in pgn_file_batches(pgn_file_path, batch_size, use_index, header_filter, has_eval)]
+        with Pool(workers) as pool:
+            for batch, (games_data, seconds) in zip(batches, pool.imap(analyze_batch, batches)):
+                add_metric_seconds(metric_set, seconds)
+                if not (return_keys or return_traces):
+                    yield from games_data
+                    continue
+                for key, game_data, trace in games_data:
+                    if return_keys and not add_game_key(dedup_index, key):
+                        continue
+                    if return_traces:
+                        add_game_trace(eval_store, batch[0], *trace)
+                    yield game_data
+    elif use_index:
+        # The selected games are read one batch at a time
+        for pgn_file_path in pgn_files:
+            batches = pgn_file_batches(pgn_file_path, batch_size, use_index, header_filter, has_eval)
+            with open(pgn_file_path, 'rb') as pgn:
+                for ranges in batches:
+                    text = read_ranges(pgn, ranges).decode('utf-8')
+                    games = analyze_games(io.StringIO(text), metric_set, fast_scan, dedup_index,
+                                          return_traces=return_traces)
+                    yield from store_traces(games, eval_store, pgn_file_path) if return_traces else games
+    else:
+        for pgn_file_path in pgn_files:
+            with open(pgn_file_path) as pgn:
+                games = analyze_games(pgn, metric_set, fast_scan, dedup_index, return_traces=return_traces)
+                yield from store_traces(games, eval_store, pgn_file_path) if return_traces else games
+
+# Function to recompute the game data of every game of an eval store, without reading the PGN files.
+# The stored values are decoded as extract_eval_from_score converts the scores, so the game data is the same
+# as that of the analysis that saved the store (with the same scoring schemes). The store has no clocks, so the
+# metrics that use them cannot be recomputed.
+def recompute_games(eval_store, metric_set):
+    metric_set = resolve_metric_set(metric_set)
+    offsets = np.asarray(eval_store['offsets'])
+    for chunk_start in range(0, eval_store['games'], RECOMPUTE_CHUNK_GAMES):
+        chunk_end = min(chunk_start + RECOMPUTE_CHUNK_GAMES, eval_store['games'])
+        base = offsets[chunk_start]
+        values = np.asarray(eval_store['evals'][base:offsets[chunk_end]], dtype=np.int64)
+        # Mates count as 10 pawns for the side that mates; MateGiven has mate() == 0, so it counts as -10
+        pawns = np.where(values >= MATE_THRESHOLD, np.where(values == MATE_BASE, -10.0, 10.0),
+                         np.where(values <= -MATE_THRESHOLD, -10.0, values / 100.0))
+        evals = [pawn if value != MISSING_EVAL else None for pawn, value in zip(pawns.tolist(), values.tolist())]
+        white_to_move = eval_store['white_to_move'][chunk_start:chunk_end].tolist()
+        chunk_offsets = (offsets[chunk_start:chunk_end + 1] - base).tolist()
+        for k, headers in enumerate(store_headers(eval_store, chunk_start, chunk_end)):
+            turn = chess.WHITE if white_to_move[k] else chess.BLACK
+            game_evals = evals[chunk_offsets[k]:chunk_offsets[k + 1]]
+            yield calculate_gi_from_evals(headers, [(turn if ply % 2 == 0 else not turn, value)
+                                                    for ply, value in enumerate(game_evals)], metric_set)
+
+# Main function to process PGN files and output a single JSON file.
+# With output_format 'jsonl' or 'jsonl.zst' each game is written as one compact line as soon as it is analyzed.
+# With eval_store_path the evaluations of the games are saved to an eval store, and with recompute
+# input_folder is an eval store the game data is recomputed from.
+def main(input_folder, output_json_dir, workers=1, batch_size_mb=8, fast_scan=False, output_format='json',
+         dedup_index_path=None, use_index=False, header_filter=None, has_eval=False, scoring_schemes='Standard',
+         eval_store_path=None, recompute=False, metric_names=None, metric_timing=False):
+    # scoring_schemes is 'Standard', 'NorwayChess' 3-1.25-0 scoring or a list of schemes (see scoring_schemes.py),
+    # and metric_names the metrics of game_metrics.py to calculate (by default ACPL, GI, GPL and the counts)
+    metric_set = build_metric_set(scoring_schemes, metric_names, metric_timing)
 
     # Ensure the output directory exists
     if not os.path.exists(output_json_dir):
         os.makedirs(output_json_dir)
 
     # Define the output JSON file path
-    output_json = os.path.join(output_json_dir, 'aggregated_game_data.json')
+    output_json = os.path.join(output_json_dir, f'aggregated_game_data.{output_format}')
 
-    key_counter = 1
-    for dirpath, dirnames, filenames in os.walk(input_folder):
-        for filename in filenames:
-            if filename.endswith('.pgn'):
-                pgn_file_path = os.path.join(dirpath, filename)
-                with open(pgn_file_path) as pgn:
-                    while True:
-                        game = chess.pgn.read_game(pgn)
-                        if game is None:
-                            break
-                        key = key_counter
-                        game_data = calculate_gi(game, scoring_system)
-                        aggregated_data[key] = game_data
-                        key_counter += 1
+    dedup_index = load_dedup_index(dedup_index_path) if dedup_index_path else None
+    eval_store = create_eval_store(eval_store_path) if eval_store_path else None
+    if recompute:
+        games_data = recompute_games(load_eval_store(input_folder), metric_set)
+    else:
+        pgn_files = find_pgn_files(input_folder)
+        games_data = analyze_pgn_files(pgn_files, metric_set, workers, batch_size_mb, fast_scan, dedup_index,
+                                       use_index, header_filter, has_eval, eval_store)
+    game_count = 0
+    if output_format == 'json':
+        aggregated_data = {}
+        for key_counter, game_data in enumerate(games_data, start=1):
+            aggregated_data[key_counter] = game_data
+        game_count = len(aggregated_data)
 
-    with open(output_json, 'w') as outfile:
-        json.dump(aggregated_data, outfile, indent=4)
+        with open(output_json, 'w') as outfile:
+            json.dump(aggregated_data, outfile, indent=4)
+    else:
+        with open_jsonl(output_json, 'w') as outfile:
+            for game_data in games_data:
+                write_jsonl_record(outfile, game_data)
+                game_count += 1
 
     print(f"Aggregated data saved to {output_json}")
+    if metric_timing:
+        print_metric_timing(metric_set, game_count)
+    if eval_store is not None:
+        close_eval_store(eval_store)
+    if dedup_index is not None:
+        save_dedup_index(dedup_index)
+        print_dedup_stats(dedup_index)
 
 if __name__ == "__main__":
     start_time = time.time()
-    if len(sys.argv) < 3:
-        print("Usage: python pgn_evaluation_analyzer.py <input_folder> <output_json_dir>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Analyze PGN files and output a single JSON file.")
+    parser.add_argument('input_folder', help="folder of PGN files, or with --recompute an eval store")
+    parser.add_argument('output_json_dir')
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes (default: 1, no pool)")
+    parser.add_argument('--batch-size-mb', type=float, default=8,
+                        help="size of the game batches a large PGN file is split into for the workers")
+    parser.add_argument('--fast-scan', action='store_true',
+                        help="read only the headers and comments of each game, without replaying the moves")
+    parser.add_argument('--output-format', choices=['json', 'jsonl', 'jsonl.zst'], default='json',
+                        help="jsonl writes one line per game as it is analyzed, jsonl.zst also compresses it")
+    parser.add_argument('--dedup-index',
+                        help="index file of the games already analyzed; games in it are skipped and new games added")
+    parser.add_argument('--game-index', action='store_true',
+                        help="read the games through the game index of each PGN file (built if missing); "
+                             "implied by the game filter options")
+    add_scoring_arguments(parser)
+    add_metric_arguments(parser)
+    parser.add_argument('--save-evals', metavar='STORE',
+                        help="save the evaluations of the games to this eval store directory")
+    parser.add_argument('--recompute', action='store_true',
+                        help="recompute the game data from the eval store given as input_folder")
+    add_filter_arguments(parser, exclude_time_controls=(), has_eval=False, min_plies=False)
+    args = parser.parse_args()
+    if args.recompute and args.save_evals:
+        parser.error("--save-evals cannot be used with --recompute")
+    if args.recompute and any(METRICS[name]['uses_clocks'] for name in args.metrics):
+        parser.error("the eval store has no clocks, so --recompute cannot calculate "
+                     + ", ".join(name for name in args.metrics if METRICS[name]['uses_clocks']))
 
-    input_folder = sys.argv[1]
-    output_json_dir = sys.argv[2]
-    main(input_folder, output_json_dir)
+    header_filter = header_filter_from_args(args)
+    use_index = args.game_index or header_filter is not None or args.has_eval
+    main(args.input_folder, args.output_json_dir, args.workers, args.batch_size_mb, args.fast_scan, args.output_format,
+         args.dedup_index, use_index, header_filter, args.has_eval, scoring_schemes_from_args(parser, args),
+         args.save_evals, args.recompute, args.metrics, args.metric_timing)
     end_time = time.time()
     print("Script finished in {:.2f} minutes".format((end_time - start_time) / 60.0))
@@ -1,20 +1,40 @@
 """
 This script inputs the PGN files with games annotated with Stockfish and outputs a JSON file including calculations of stats such as GI, GPL, ACPL, etc. for each game. 
+With --dedup-index, games already in the index (see dedup_index.py) are skipped before their evaluations are read.
+With --game-index the games are read through the game index of each PGN file (see game_index.py), and the header
+options of game_filter.py (e.g. --min-elo, --time-controls, --eval-required) select the games without reading
+their move text.
+With --save-evals <dir> the evaluation trace of every game is saved to an eval store (see eval_store.py), and with
+--recompute the input is such a store: the stats are recomputed from the stored evaluations with NumPy, without
+parsing the PGN files again, and written to one JSON file per PGN file as before.
+With --scoring-system the GPL and GI are calculated for one or more scoring schemes (see scoring_schemes.py) in the
+same pass, e.g. --scoring-system Standard NorwayChess adds the norwaychess_ columns. The normalized GI uses the
+linear function of Standard for every scheme, and the blunder and mistake thresholds are not used here.
 """
 
 import chess
 import chess.pgn
-import chess.engine
+import io
 import json
 import os
-from chess.engine import Cp, Wdl
 import time
-import sys
+import argparse
+import numpy as np
+from pgn_scanner import parse_eval, scan_games
+from expected_value_table import expected_value_tables, table_index
+from dedup_index import add_game_headers, load_dedup_index, print_dedup_stats, save_dedup_index
+from game_filter import add_filter_arguments, header_filter_from_args
+from game_index import game_batches, game_index_for, read_ranges, select_games
+from eval_store import (MATE_BASE, MATE_THRESHOLD, MISSING_EVAL, add_game_trace, close_eval_store, create_eval_store,
+                        encode_score, load_eval_store, source_runs, store_headers)
+from scoring_schemes import add_scoring_arguments, resolve_scoring_schemes, scheme_prefix, scoring_schemes_from_args
 
+# Bytes of games read at once from a PGN file read through its game index
+INDEX_BATCH_SIZE = 8 * 1024 * 1024
 
-# Function to extract the evaluation from a node
-def extract_eval_from_node(node):
-    node_evaluation = node.eval()
+
+# Function to convert a %eval score to pawns from White's perspective
+def extract_eval_from_score(node_evaluation):
     #print("node_evaluation: ", node_evaluation)
     if node_evaluation:
         cp_value = node_evaluation.pov(chess.WHITE).score(mate_score=10000) / 100.0
@@ -22,11 +42,15 @@ def extract_eval_from_node(node):
     else:
         return None
 
-# Function to extract the evaluations from a PGN file
-def extract_pawn_evals_from_pgn(game):
+# Function to extract the evaluation from a node
+def extract_eval_from_node(node):
+    return extract_eval_from_score(node.eval())
+
+# Function to extract the evaluations from a sequence of %eval scores
+def extract_pawn_evals(scores):
     pawns_list = [0]
-    for node in game.mainline():
-        eval_value = extract_eval_from_node(node)
+    for score in scores:
+        eval_value = extract_eval_from_score(score)
         if eval_value is not None:
             pawns_list.append(eval_value)
     if len(pawns_list) > 1:
@@ -34,92 +58,269 @@ def extract_pawn_evals_from_pgn(game):
     #print("pawns_list: ", pawns_list)
     return pawns_list
 
-# Function to calculate the ACPL for both players
-def calculate_acpl(pawns_list):
-    white_losses, black_losses = [], []
-    for i in range(1, len(pawns_list)):
-        centipawn_loss = 100*(pawns_list[i] - pawns_list[i - 1])
-        if i % 2 == 1:  # White's turn
-            white_losses.append(-centipawn_loss)
-        else:  # Black's turn
-            black_losses.append(centipawn_loss)
-    white_acpl = sum(white_losses) / len(white_losses) if white_losses else 0
-    black_acpl = sum(black_losses) / len(black_losses) if black_losses else 0
-    return white_acpl, black_acpl
-
-def calculate_gi_by_result(white_gpl, black_gpl, game_result, postmove_exp_white, postmove_exp_black):
-    # Calculate GI based on game result
-    if game_result == '1/2-1/2':
-        white_gi = 0.5 - white_gpl
-        black_gi = 0.5 - black_gpl
-    elif game_result == '1-0':
-        white_gi = 1 - white_gpl
-        black_gi = -black_gpl
+# Function to extract the evaluations from a PGN file
+def extract_pawn_evals_from_pgn(game):
+    return extract_pawn_evals(node.eval() for node in game.mainline())
+
+# Function to read the headers and the evaluations of every game in an open PGN file.
+# With fast_scan the games are read by pgn_scanner, which skips building the game tree and replaying the moves.
+# Games whose key is already in dedup_index are skipped before their evaluations are read.
+# With return_traces (headers, pawns_list, trace) is yielded, where trace is the side to move at the root and
+# the encoded evaluations of the root and every mainline node for the eval store.
+def read_pawn_evals(pgn, fast_scan=False, dedup_index=None, return_traces=False):
+    if fast_scan:
+        for headers, mainline in scan_games(pgn):
+            if dedup_index is not None and not add_game_headers(dedup_index, headers):
+                continue
+            if return_traces:
+                scores = [parse_eval(comment, turn) for turn, comment in mainline]
+                yield headers, extract_pawn_evals(scores[1:]), (mainline[0][0] == chess.WHITE,
+                                                                [encode_score(score) for score in scores])
+            else:
+                yield headers, extract_pawn_evals(parse_eval(comment, turn) for turn, comment in mainline[1:])
+        return
+    while True:
+        if dedup_index is not None:
+            # Read only the headers, and go back to read the whole game if it is new
+            offset = pgn.tell()
+            headers = chess.pgn.read_headers(pgn)
+            if headers is None:
+                break
+            if not add_game_headers(dedup_index, headers):
+                continue
+            pgn.seek(offset)
+        game = chess.pgn.read_game(pgn)
+        if game is None:
+            break
+        if return_traces:
+            scores = [game.eval()] + [node.eval() for node in game.mainline()]
+            yield game.headers, extract_pawn_evals(scores[1:]), (game.turn() == chess.WHITE,
+                                                                 [encode_score(score) for score in scores])
+        else:
+            yield game.headers, extract_pawn_evals_from_pgn(game)
+
+# Function to read the headers and the evaluations of the games of a PGN file. With use_index only the games
+# selected by header_filter and has_eval are read, a batch of games at a time, through the game index.
+# The evaluation traces of the games are added to eval_store, if given.
+def read_file_pawn_evals(pgn_file_path, fast_scan=False, dedup_index=None, use_index=False, header_filter=None,
+                         has_eval=False, eval_store=None):
+    return_traces = eval_store is not None
+    if not use_index:
+        with open(pgn_file_path) as pgn:
+            games = read_pawn_evals(pgn, fast_scan, dedup_index, return_traces)
+            yield from store_traces(games, eval_store, pgn_file_path) if return_traces else games
+        return
+    index = game_index_for(pgn_file_path)
+    batches = game_batches(index, select_games(index, header_filter, has_eval), INDEX_BATCH_SIZE)
+    with open(pgn_file_path, 'rb') as pgn:
+        for ranges in batches:
+            text = read_ranges(pgn, ranges).decode('utf-8')
+            games = read_pawn_evals(io.StringIO(text), fast_scan, dedup_index, return_traces)
+            yield from store_traces(games, eval_store, pgn_file_path) if return_traces else games
+
+# Function to add the traces of the games read from pgn_file_path to the eval store, yielding their evaluations
+def store_traces(games, eval_store, pgn_file_path):
+    for headers, pawns_list, (white_to_move, values) in games:
+        add_game_trace(eval_store, pgn_file_path, headers, white_to_move, values)
+        yield headers, pawns_list
+
+# Function to get the details of a game for the JSON output, its result and the Elo ratings of the players
+def game_info_from_headers(headers):
+    # Get the headers of the game
+    game_result = headers.get('Result', None)
+    if game_result == '1-0':
+        whiteResult = 1
+        blackResult = 0
     elif game_result == '0-1':
-        black_gi = 1 - black_gpl
-        white_gi = -white_gpl
+        whiteResult = 0
+        blackResult = 1
+    elif game_result == '1/2-1/2':
+        whiteResult = 0.5
+        blackResult = 0.5
     else:
-        white_gi = postmove_exp_white - white_gpl
-        black_gi = postmove_exp_black - black_gpl
-
-    return white_gi, black_gi
-
-# Function to calculate GI and GPL in the usual way
-def gi_and_gpl(pawns_list, game_result, WhiteElo, BlackElo):
-    white_gpl, black_gpl = 0, 0
-    white_gi, black_gi = 0, 0
-    white_move_number, black_move_number = 0, 0
-
-    for i, cp in enumerate(pawns_list):
-        # Determine whose turn it is
-        turn = "White" if i % 2 == 0 else "Black"
-        
-        # Convert centipawn value to probability
-        # handle the initial case
-        premove_eval = Cp(int(100 * pawns_list[i-1] if i > 0 else 100 * pawns_list[1]))
-        postmove_eval = Cp(int(100 * cp))
-
-        # Calculate expected values before the move
-        win_draw_loss = premove_eval.wdl()
-        win_prob, draw_prob, loss_prob = win_draw_loss.wins / 1000, win_draw_loss.draws / 1000, win_draw_loss.losses / 1000
-        premove_exp_white, premove_exp_black = calculate_expected_value(win_prob, draw_prob, loss_prob, turn)
-
-        # Calculate expected values after the move
-        win_draw_loss = postmove_eval.wdl()
-        win_prob, draw_prob, loss_prob = win_draw_loss.wins / 1000, win_draw_loss.draws / 1000, win_draw_loss.losses / 1000
-        postmove_exp_white, postmove_exp_black = calculate_expected_value(win_prob, draw_prob, loss_prob, turn)
-
-        # Calculate GPL and update move number
-        if turn == "Black":
-            exp_white_point_loss = postmove_exp_white - premove_exp_white
-            white_gpl += exp_white_point_loss
-            white_move_number += 1
+        whiteResult = '...'
+        blackResult = '...'
+    # Further game details
+    game_details = {
+        "White": headers.get("White", None),
+        "Black": headers.get("Black", None),
+        "Event": headers.get("Event", None),
+        "Site": headers.get("Site", None),
+        "Round": headers.get("Round", None),
+        "WhiteElo": headers.get("WhiteElo", None),
+        "BlackElo": headers.get("BlackElo", None),
+        "WhiteResult": whiteResult,
+        "BlackResult": blackResult,
+        "Date": headers.get("Date", None),
+            }
+    # Get the ELO ratings of the players as integers
+    WhiteElo = int(headers.get("WhiteElo", None)) if headers.get("WhiteElo", None) else None
+    BlackElo = int(headers.get("BlackElo", None)) if headers.get("BlackElo", None) else None
+    return game_details, game_result, WhiteElo, BlackElo
+
+# Function to calculate GI, GPL and ACPL for the games of a file at once and add them to aggregated_data,
+# numbered from key_counter. game_infos are the game_info_from_headers of the games, whose evaluations are
+# evals[offsets[k]:offsets[k + 1]]. Returns the next key.
+def add_batch_stats(aggregated_data, key_counter, game_infos, evals, offsets, scoring_schemes="Standard"):
+    game_details_list, game_results, white_elos, black_elos = zip(*game_infos)
+    stats = calculate_batch_stats(evals, offsets, game_results, white_elos, black_elos, scoring_schemes)
+    # Convert to Python numbers, so that round() rounds like for the per-game functions
+    stats = {column: values.tolist() for column, values in stats.items()}
+    for k, game_details in enumerate(game_details_list):
+        game_data = {column: values[k] if column.endswith('_move_number') else round(values[k], 4)
+                     for column, values in stats.items()}
+        game_data.update(game_details)
+        aggregated_data[key_counter] = game_data
+        key_counter += 1
+    return key_counter
+
+# Function to get the flattened evaluations (see flatten_pawns_lists) of the games start:end of an eval store,
+# as extract_pawn_evals gets them from the PGN file: from White's perspective, with mates as +-(10000 - n)
+# centipawns, without the root and the positions without an evaluation, and with the first evaluation repeated.
+# Games without any evaluation are left out. Returns evals, offsets and the indices of the games kept.
+def pawn_evals_from_store(eval_store, start, end):
+    store_offsets = np.asarray(eval_store['offsets'][start:end + 1], dtype=np.int64)
+    values = np.asarray(eval_store['evals'][store_offsets[0]:store_offsets[-1]], dtype=np.int64)
+    lengths = np.diff(store_offsets)
+    game_index = np.repeat(np.arange(end - start), lengths)
+    ply = np.arange(len(values)) - np.repeat(store_offsets[:-1] - store_offsets[0], lengths)
+    # Mate in n for the side to move is 32767 - n stored and 10000 - n centipawns, and likewise for mates against it
+    mate_offset = MATE_BASE - 10000
+    relative = np.where(values >= MATE_THRESHOLD, values - mate_offset,
+                        np.where(values <= -MATE_THRESHOLD, values + mate_offset, values))
+    white_to_move = np.asarray(eval_store['white_to_move'][start:end])[game_index] == (ply % 2 == 0)
+    pawns = np.where(white_to_move, relative, -relative) / 100.0
+
+    valid = (ply > 0) & (values != MISSING_EVAL)
+    counts = np.bincount(game_index[valid], minlength=end - start)
+    kept = np.flatnonzero(counts > 0)
+    pawns = pawns[valid]
+    # The first evaluation of each game is inserted again in place of the root
+    first = np.concatenate(([0], np.cumsum(counts)[:-1]))[kept]
+    evals = np.insert(pawns, first, pawns[first])
+    offsets = np.zeros(len(kept) + 1, dtype=np.int64)
+    np.cumsum(counts[kept] + 1, out=offsets[1:])
+    return evals, offsets, kept
+
+# Function to recompute the JSON files of the games of an eval store, one per PGN file the games were read from.
+# Returns the number of games.
+def recompute_from_store(eval_store, output_json_dir, scoring_schemes="Standard"):
+    key_counter = 1
+    for source, start, end in source_runs(eval_store):
+        evals, offsets, kept = pawn_evals_from_store(eval_store, start, end)
+        if len(kept) == 0:
+            continue
+        headers_list = list(store_headers(eval_store, start, end))
+        aggregated_data = {}
+        key_counter = add_batch_stats(aggregated_data, key_counter,
+                                      [game_info_from_headers(headers_list[k]) for k in kept.tolist()], evals, offsets,
+                                      scoring_schemes)
+        output_json_path = os.path.join(output_json_dir, os.path.basename(source).replace('.pgn', '.json'))
+        with open(output_json_path, 'w') as f:
+            json.dump(aggregated_data, f, indent=4)
+        print(f"Aggregated data saved to {output_json_path}")
+    return key_counter - 1
+
+# Function to concatenate the pawns_list of many games into one array with CSR-style offsets:
+# the evaluations of game k are evals[offsets[k]:offsets[k + 1]]
+def flatten_pawns_lists(pawns_lists):
+    lengths = np.fromiter((len(pawns_list) for pawns_list in pawns_lists), dtype=np.int64, count=len(pawns_lists))
+    offsets = np.zeros(len(pawns_lists) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    evals = np.fromiter((value for pawns_list in pawns_lists for value in pawns_list), dtype=np.float64, count=offsets[-1])
+    return evals, offsets
+
+# Function to calculate ACPL, GPL, move numbers and (adjusted and normalized) GI of many games at once.
+# Computes the same values as the per-game calculate_acpl and gi_and_gpl it replaced (kept in benchmark.py) for
+# every game, including an int 0 ACPL for a side without moves. Every game needs at least
+# two evaluations. np.bincount adds the weights in order, so the sums are the same as the Python loops.
+# The GPL and GI are calculated for each of scoring_schemes (see scoring_schemes.py) from the same plies and
+# table indices; the first scheme gives the usual columns and every further scheme columns prefixed with its name.
+def calculate_batch_stats(evals, offsets, game_results, white_elos, black_elos, scoring_schemes="Standard"):
+    evals = np.asarray(evals, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, ends = offsets[:-1], offsets[1:]
+    lengths = ends - starts
+    game_count = len(lengths)
+    game_index = np.repeat(np.arange(game_count), lengths)
+    ply = np.arange(len(evals)) - np.repeat(starts, lengths)
+    white_turn = ply % 2 == 0
+
+    # ACPL: the loss of ply i is counted for White on odd plies and for Black on even plies
+    centipawn_loss = np.zeros(len(evals))
+    centipawn_loss[1:] = 100*(evals[1:] - evals[:-1])
+    white_tcpl = np.bincount(game_index, weights=np.where(white_turn | (ply == 0), 0.0, -centipawn_loss), minlength=game_count)
+    black_tcpl = np.bincount(game_index, weights=np.where(white_turn & (ply > 0), centipawn_loss, 0.0), minlength=game_count)
+    white_loss_count = lengths // 2
+    black_loss_count = (lengths - 1) // 2
+    white_acpl = np.divide(white_tcpl, white_loss_count, out=np.zeros(game_count), where=white_loss_count > 0)
+    black_acpl = np.divide(black_tcpl, black_loss_count, out=np.zeros(game_count), where=black_loss_count > 0)
+    # The ACPL of a side without moves is the int 0, as in calculate_acpl
+    white_acpl, black_acpl = white_acpl.astype(object), black_acpl.astype(object)
+    white_acpl[white_loss_count == 0] = 0
+    black_acpl[black_loss_count == 0] = 0
+    white_move_number = lengths // 2
+    black_move_number = (lengths + 1) // 2 - 1
+
+    # Table indices of the evaluations before and after each move
+    postmove_cp = (100 * evals).astype(np.int64)
+    premove_cp = np.empty_like(postmove_cp)
+    premove_cp[1:] = postmove_cp[:-1]
+    premove_cp[starts] = postmove_cp[starts + 1]
+    premove_index, postmove_index = table_index(premove_cp), table_index(postmove_cp)
+
+    game_results = np.asarray(game_results, dtype=object)
+    draw, white_won, black_won = game_results == '1/2-1/2', game_results == '1-0', game_results == '0-1'
+
+    # Expected scores against the reference rating, computed once per distinct rating with Python floats,
+    # since NumPy's power may differ from Python's in the last bit
+    has_elo = np.array([white_elo is not None and black_elo is not None
+                        for white_elo, black_elo in zip(white_elos, black_elos)], dtype=bool)
+    elos = np.array([elo if elo is not None else 0 for elo in list(white_elos) + list(black_elos)], dtype=np.int64)
+    unique_elos, elo_index = np.unique(elos, return_inverse=True)
+    unique_scores = np.array([expected_score(elo, 2800) for elo in unique_elos.tolist()])
+    white_score, black_score = unique_scores[elo_index[:game_count]], unique_scores[elo_index[game_count:]]
+
+    stats = {}
+    for position, scheme in enumerate(resolve_scoring_schemes(scoring_schemes)):
+        # Expected values before and after each move, looked up from the table of the scheme
+        mover_points, opponent_points = expected_value_tables(scheme['win'], scheme['draw'])
+        premove_exp_white = np.where(white_turn, mover_points[premove_index], opponent_points[premove_index])
+        premove_exp_black = np.where(white_turn, opponent_points[premove_index], mover_points[premove_index])
+        postmove_exp_white = np.where(white_turn, mover_points[postmove_index], opponent_points[postmove_index])
+        postmove_exp_black = np.where(white_turn, opponent_points[postmove_index], mover_points[postmove_index])
+
+        # GPL: White's loss is counted on Black's turn and Black's loss on White's turn
+        white_gpl = np.bincount(game_index, weights=np.where(white_turn, 0.0, postmove_exp_white - premove_exp_white), minlength=game_count)
+        black_gpl = np.bincount(game_index, weights=np.where(white_turn, premove_exp_black - postmove_exp_black, 0.0), minlength=game_count)
+
+        # GI based on game result
+        win_points, draw_points = scheme['win'], scheme['draw']
+        white_gi = np.select([draw, white_won, black_won], [draw_points - white_gpl, win_points - white_gpl, -white_gpl],
+                             postmove_exp_white[ends - 1] - white_gpl)
+        black_gi = np.select([draw, white_won, black_won], [draw_points - black_gpl, -black_gpl, win_points - black_gpl],
+                             postmove_exp_black[ends - 1] - black_gpl)
+
+        # Adjust the GI scores with respect to the opponent's rating (if applicable)
+        white_gi = np.where(has_elo, white_gi - (1 - 2 * black_score) * np.abs(white_gi), white_gi)
+        black_gi = np.where(has_elo, black_gi - (1 - 2 * white_score) * np.abs(black_gi), black_gi)
+
+        if position == 0:
+            stats.update({
+                "white_gi": calculate_normalized_gi(white_gi), "black_gi": calculate_normalized_gi(black_gi),
+                "white_gpl": white_gpl, "black_gpl": black_gpl,
+                "white_acpl": white_acpl, "black_acpl": black_acpl,
+                "white_gi_raw": white_gi, "black_gi_raw": black_gi,
+                "white_move_number": white_move_number, "black_move_number": black_move_number,
+            })
         else:
-            exp_black_point_loss = premove_exp_black - postmove_exp_black
-            black_gpl += exp_black_point_loss
-            black_move_number += 1
-    # Calculate GI based on game result
-    white_gi, black_gi = calculate_gi_by_result(white_gpl, black_gpl, game_result, postmove_exp_white, postmove_exp_black)
-    # Adjust the GI scores with respect to the opponent's rating (if applicable)
-    if WhiteElo is not None and BlackElo is not None:
-        white_gi = calculate_adjusted_gi(white_gi, BlackElo, 2800)
-        black_gi = calculate_adjusted_gi(black_gi, WhiteElo, 2800)
-    # Record raw GIs
-    white_gi_raw, black_gi_raw = white_gi, black_gi
-    # Normalize GI
-    white_gi = calculate_normalized_gi(white_gi)
-    black_gi = calculate_normalized_gi(black_gi)
-    return white_gi, black_gi, white_gpl, black_gpl, white_gi_raw, black_gi_raw, white_move_number, black_move_number-1
-
-# Function to calculate the expected value of a position
-def calculate_expected_value(win_prob, draw_prob, loss_prob, turn):
-    if turn == "White":
-        expected_value_white = win_prob * 1 + draw_prob * 0.5
-        expected_value_black = loss_prob * 1 + draw_prob * 0.5
-    else:
-        expected_value_white = loss_prob * 1 + draw_prob * 0.5
-        expected_value_black = win_prob * 1 + draw_prob * 0.5
-    return expected_value_white, expected_value_black
+            prefix = scheme_prefix(scheme)
+            stats.update({
+                prefix + "white_gi": calculate_normalized_gi(white_gi), prefix + "black_gi": calculate_normalized_gi(black_gi),
+                prefix + "white_gpl": white_gpl, prefix + "black_gpl": black_gpl,
+                prefix + "white_gi_raw": white_gi, prefix + "black_gi_raw": black_gi,
+            })
+    return stats
 
 # Calculate normalized GI score
 def calculate_normalized_gi(gi):
@@ -127,19 +328,23 @@ def calculate_normalized_gi(gi):
     a, b = 157.57, 18.55
     return a  + b* gi
     
-# Adjust the GI score with respect to the opponent's rating
-def calculate_adjusted_gi(gi, opponent_elo, reference_elo):
-    return gi - (1 - 2 * expected_score(opponent_elo, reference_elo)) * abs(gi)
-
 # Adjust the GI score with respect to the opponent's rating
 def expected_score(opponent_elo, reference_elo):
     return 1 / (1 + 10 ** ((reference_elo - opponent_elo) / 400))
     
-def main(input_pgn_dir, output_json_dir):
+def main(input_pgn_dir, output_json_dir, fast_scan=False, dedup_index_path=None, use_index=False, header_filter=None,
+         has_eval=False, eval_store_path=None, recompute=False, scoring_schemes='Standard'):
+    scoring_schemes = resolve_scoring_schemes(scoring_schemes)
     # Ensure the output directory exists
     if not os.path.exists(output_json_dir):
         os.makedirs(output_json_dir)
+    if recompute:
+        # input_pgn_dir is an eval store
+        print(f"#Games = {recompute_from_store(load_eval_store(input_pgn_dir), output_json_dir, scoring_schemes)}")
+        return
     key_counter = 1
+    dedup_index = load_dedup_index(dedup_index_path) if dedup_index_path else None
+    eval_store = create_eval_store(eval_store_path) if eval_store_path else None
     # walk through all pgn files in the dir
     for dirpath, dirnames, filenames in os.walk(input_pgn_dir):
         for filename in filenames:
@@ -148,74 +353,56 @@ def main(input_pgn_dir, output_json_dir):
                 pgn_file_path = os.path.join(dirpath, filename)
                 json_file_name = filename.replace('.pgn', '.json')
                 output_json_path = os.path.join(output_json_dir, json_file_name)
-                with open(pgn_file_path) as pgn:
-                    while True:
-                        game = chess.pgn.read_game(pgn)
-                        if game is None:
-                            break
-                        # Get the headers of the game
-                        game_result = game.headers.get('Result', None)
-                        if game_result == '1-0':
-                            whiteResult = 1
-                            blackResult = 0
-                        elif game_result == '0-1':
-                            whiteResult = 0
-                            blackResult = 1
-                        elif game_result == '1/2-1/2':
-                            whiteResult = 0.5
-                            blackResult = 0.5
-                        else:
-                            whiteResult = '...'
-                            blackResult = '...'
-                        # Further game details
-                        game_details = {
-                            "White": game.headers.get("White", None),
-                            "Black": game.headers.get("Black", None),
-                            "Event": game.headers.get("Event", None),
-                            "Site": game.headers.get("Site", None),
-                            "Round": game.headers.get("Round", None),
-                            "WhiteElo": game.headers.get("WhiteElo", None),
-                            "BlackElo": game.headers.get("BlackElo", None),
-                            "WhiteResult": whiteResult,
-                            "BlackResult": blackResult,
-                            "Date": game.headers.get("Date", None),
-                                }
-                        # Get the ELO ratings of the players as integers
-                        WhiteElo = int(game.headers.get("WhiteElo", None)) if game.headers.get("WhiteElo", None) else None
-                        BlackElo = int(game.headers.get("BlackElo", None)) if game.headers.get("BlackElo", None) else None
-                        pawns_list = extract_pawn_evals_from_pgn(game)
-                        white_acpl, black_acpl = calculate_acpl(pawns_list)
-
-                        #black_moves = (len(pawns_list) - 1) // 2
-                        #white_moves = len(pawns_list) - 1 - black_moves
-
-                        # Calculate GI and GPL for both players
-                        white_gi, black_gi, white_gpl, black_gpl, white_gi_raw, black_gi_raw, white_move_number, black_move_number = gi_and_gpl(pawns_list, game_result, WhiteElo, BlackElo)
-                        key = key_counter
-                        game_data = {
-                            "white_gi": round(white_gi, 4), "black_gi": round(black_gi, 4),
-                            "white_gpl": round(white_gpl, 4), "black_gpl": round(black_gpl, 4),
-                            "white_acpl": round(white_acpl, 4), "black_acpl": round(black_acpl, 4),
-                            "white_gi_raw": round(white_gi_raw, 4), "black_gi_raw": round(black_gi_raw, 4),
-                            "white_move_number": white_move_number, "black_move_number": black_move_number,
-                            **game_details,
-                        }
-                        aggregated_data[key] = game_data
-                        key_counter += 1                
+                game_infos, pawns_lists = [], []
+                for headers, pawns_list in read_file_pawn_evals(pgn_file_path, fast_scan, dedup_index, use_index,
+                                                                 header_filter, has_eval, eval_store):
+                    # Skip games without evaluations
+                    if len(pawns_list) < 2:
+                        continue
+                    game_infos.append(game_info_from_headers(headers))
+                    pawns_lists.append(pawns_list)
+
+                if game_infos:
+                    # Calculate GI, GPL and ACPL for all games of the file at once
+                    evals, offsets = flatten_pawns_lists(pawns_lists)
+                    key_counter = add_batch_stats(aggregated_data, key_counter, game_infos, evals, offsets,
+                                                  scoring_schemes)
                 if aggregated_data:
                     with open(output_json_path, 'w') as f:
                         json.dump(aggregated_data, f, indent=4)                        
                     print(f"Aggregated data saved to {output_json_path}")
     print(f"#Games = {key_counter - 1}")
+    if eval_store is not None:
+        close_eval_store(eval_store)
+    if dedup_index is not None:
+        save_dedup_index(dedup_index)
+        print_dedup_stats(dedup_index)
 
 if __name__ == "__main__":
     start_time = time.time()
-    if len(sys.argv) < 3:
-        print("Usage: python pgn_engine_vs_engine_eval_analyzer.py <input_pgn_dir> <output_json_dir>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Analyze PGN files and output one JSON file per PGN file.")
+    parser.add_argument('input_pgn_dir', help="folder of PGN files, or with --recompute an eval store")
+    parser.add_argument('output_json_dir')
+    parser.add_argument('--fast-scan', action='store_true',
+                        help="read only the headers and comments of each game, without replaying the moves")
+    parser.add_argument('--dedup-index',
+                        help="index file of the games already analyzed; games in it are skipped and new games added")
+    parser.add_argument('--game-index', action='store_true',
+                        help="read the games through the game index of each PGN file (built if missing); "
+                             "implied by the game filter options")
+    parser.add_argument('--save-evals', metavar='STORE',
+                        help="save the evaluations of the games to this eval store directory")
+    parser.add_argument('--recompute', action='store_true',
+                        help="recompute the JSON files from the eval store given as input_pgn_dir")
+    add_scoring_arguments(parser)
+    add_filter_arguments(parser, exclude_time_controls=(), has_eval=False, min_plies=False)
+    args = parser.parse_args()
+    if args.recompute and args.save_evals:
+        parser.error("--save-evals cannot be used with --recompute")
 
-    input_pgn_dir = sys.argv[1]
-    output_json_dir = sys.argv[2]
-    main(input_pgn_dir, output_json_dir)
+    header_filter = header_filter_from_args(args)
+    use_index = args.game_index or header_filter is not None or args.has_eval
+    main(args.input_pgn_dir, args.output_json_dir, args.fast_scan, args.dedup_index, use_index, header_filter,
+         args.has_eval, args.save_evals, args.recompute, scoring_schemes_from_args(parser, args))
     end_time = time.time()
     print("Script finished in {:.2f} minutes".format((end_time - start_time) / 60.0))
@@ -0,0 +1,141 @@
+"""This module reads games from a PGN file without building a GameNode tree and without replaying the moves on a board.
+For each game it returns the headers and, for the root and every mainline move, the side to move and the comment.
+This is all the analyzers need to read the [%eval ...] and [%clk ...] annotations, since the side to move is just
+the ply parity.
+Unlike chess.pgn.read_game, the moves are not checked for legality.
+"""
+
+import chess
+import chess.engine
+import chess.pgn
+from chess.pgn import TAG_REGEX, MOVETEXT_REGEX, EVAL_REGEX, CLOCK_REGEX
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+# Function to parse the [%eval ...] annotation of a comment, exactly as GameNode.eval() does
+def parse_eval(comment, turn):
+    match = EVAL_REGEX.search(comment)
+    if not match:
+        return None
+    if match.group("mate"):
+        mate = int(match.group("mate"))
+        score = chess.engine.Mate(mate)
+        if mate == 0:
+            # The player to move after mate is the player who has been mated
+            return chess.engine.PovScore(score, turn)
+    else:
+        score = chess.engine.Cp(round(float(match.group("cp")) * 100))
+    return chess.engine.PovScore(score if turn else -score, turn)
+
+# Function to parse the [%clk ...] annotation of a comment, exactly as GameNode.clock() does: the remaining time
+# of the player who made the move, in seconds
+def parse_clock(comment):
+    match = CLOCK_REGEX.search(comment)
+    if match is None:
+        return None
+    return int(match.group("hours")) * 3600 + int(match.group("minutes")) * 60 + float(match.group("seconds"))
+
+# Function to get the side to move of the starting position of a game
+def starting_turn(headers):
+    fen = headers.get("FEN")
+    if fen:
+        parts = fen.split()
+        if len(parts) > 1 and parts[1] == "b":
+            return chess.BLACK
+    return chess.WHITE
+
+# Function to read the next game of an open PGN file.
+# Returns (headers, mainline) where mainline is a list of (turn, comment) for the root and each mainline move,
+# or None at the end of the file.
+def scan_game(handle):
+    line = handle.readline().lstrip("\ufeff")
+
+    # Skip empty lines and comments before the game
+    while line.isspace() or line.startswith("%") or line.startswith(";"):
+        line = handle.readline()
+    if not line:
+        return None
+
+    # Read the headers. Headers() starts with the seven tag roster, like chess.pgn.Game()
+    headers = chess.pgn.Headers()
+    consecutive_empty_lines = 0
+    while line:
+        if line.startswith("%") or line.startswith(";"):
+            line = handle.readline()
+            continue
+        if consecutive_empty_lines < 1 and line.isspace():
+            consecutive_empty_lines += 1
+            line = handle.readline()
+            continue
+        if not line.startswith("["):
+            break
+        consecutive_empty_lines = 0
+        tag_match = TAG_REGEX.match(line)
+        if tag_match:
+            headers[tag_match.group(1)] = tag_match.group(2)
+        line = handle.readline()
+
+    # Read the movetext, collecting one comment per mainline node and skipping variations
+    comments = [""]
+    variation_depth = 0
+    fresh_line = True
+    while line:
+        if fresh_line:
+            if line.startswith("%") or line.startswith(";"):
+                line = handle.readline()
+                continue
+            # A completely blank line ends the game
+            if line.isspace():
+                break
+        fresh_line = True
+
+        for match in MOVETEXT_REGEX.finditer(line):
+            token = match.group(0)
+            if token.startswith("{"):
+                # Comments may span several lines
+                start_index = 2 if token.startswith("{ ") else 1
+                line = token[start_index:]
+                comment_lines = []
+                while line and "}" not in line:
+                    comment_lines.append(line)
+                    line = handle.readline()
+                if line:
+                    close_index = line.find("}")
+                    end_index = close_index - 1 if close_index > 0 and line[close_index - 1] == " " else close_index
+                    comment_lines.append(line[:end_index])
+                    line = line[close_index + 1:]
+                if not variation_depth:
+                    comments[-1] = " ".join(filter(None, [comments[-1], "".join(comment_lines)]))
+                fresh_line = False
+                break
+            elif token == "(":
+                # A variation can only start after a move
+                if variation_depth or len(comments) > 1:
+                    variation_depth += 1
+            elif token == ")":
+                if variation_depth:
+                    variation_depth -= 1
+            elif variation_depth:
+                continue
+            elif token.startswith(";"):
+                break
+            elif token in RESULTS:
+                if headers.get("Result", "*") == "*":
+                    headers["Result"] = token
+            elif match.group(1):
+                comments.append("")
+
+        if fresh_line:
+            line = handle.readline()
+
+    turn = starting_turn(headers)
+    mainline = [(turn if i % 2 == 0 else not turn, comment) for i, comment in enumerate(comments)]
+    return headers, mainline
+
+# Function to read all games of an open PGN file
+def scan_games(handle):
+    while True:
+        scanned_game = scan_game(handle)
+        if scanned_game is None:
+            break
+        yield scanned_game
@@ -0,0 +1,95 @@
+"""Resumable pipeline runner used by main.py.
+The stages run in-process and keep a JSON manifest with the fingerprint (size, mtime and SHA-256 hash)
+of every input file they have processed. A file stage processes its inputs one at a time and saves the
+manifest after each file, so after a crash it resumes with the first file that was not finished.
+A stage or file is skipped when the hashes of its inputs match the manifest and its outputs exist.
+The content is only hashed again when the size or the mtime of a file has changed.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+# Function to compute the SHA-256 hash of a file
+def file_hash(file_path, block_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+# Function to get the fingerprint of a file, reusing the hash of the previous fingerprint
+# when the size and the mtime have not changed
+def file_fingerprint(file_path, previous=None):
+    stat = os.stat(file_path)
+    if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime:
+        return previous
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': file_hash(file_path)}
+
+def load_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {}
+
+# Function to save the manifest through a temporary file, so a crash never leaves a truncated manifest
+def save_manifest(manifest, manifest_path):
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(temp_path, manifest_path)
+
+def print_stage_report(stage, processed, skipped, nbytes, seconds):
+    megabytes = nbytes / (1024 * 1024)
+    mb_per_sec = megabytes / seconds if seconds else 0
+    print(f"[{stage}] {processed} processed, {skipped} up to date, {megabytes:.1f} MB in {seconds:.2f} s "
+          f"({mb_per_sec:.1f} MB/s)")
+
+# Function to run a stage that processes its input files one at a time.
+# process_file(input_file) writes the outputs of one file, and output_exists(input_file) tells whether they exist.
+# The fingerprint is taken after process_file, so a stage may rewrite its input files in place.
+def run_file_stage(manifest, manifest_path, stage, input_files, process_file, output_exists=lambda input_file: True):
+    start_time = time.perf_counter()
+    stage_manifest = manifest.setdefault(stage, {})
+    processed, skipped, nbytes = 0, 0, 0
+
+    for input_file in input_files:
+        recorded = stage_manifest.get(input_file)
+        fingerprint = file_fingerprint(input_file, recorded)
+        if recorded and recorded['sha256'] == fingerprint['sha256'] and output_exists(input_file):
+            stage_manifest[input_file] = fingerprint
+            skipped += 1
+            continue
+
+        process_file(input_file)
+        stage_manifest[input_file] = file_fingerprint(input_file, fingerprint)
+        save_manifest(manifest, manifest_path)
+        processed += 1
+        nbytes += fingerprint['size']
+
+    # Forget the input files that no longer exist
+    for input_file in set(stage_manifest) - set(input_files):
+        del stage_manifest[input_file]
+    save_manifest(manifest, manifest_path)
+    print_stage_report(stage, processed, skipped, nbytes, time.perf_counter() - start_time)
+
+# Function to run a stage that processes all its input files at once, e.g. to aggregate them into one table.
+# The stage runs process() again when any input file was added, removed or changed, or when an output is missing.
+def run_aggregate_stage(manifest, manifest_path, stage, input_files, process, output_files):
+    start_time = time.perf_counter()
+    recorded = manifest.get(stage, {})
+    fingerprints = {input_file: file_fingerprint(input_file, recorded.get(input_file)) for input_file in input_files}
+    up_to_date = (set(recorded) == set(fingerprints)
+                  and all(recorded[input_file]['sha256'] == fingerprint['sha256']
+                          for input_file, fingerprint in fingerprints.items())
+                  and all(os.path.exists(output_file) for output_file in output_files))
+
+    nbytes = 0
+    if not up_to_date:
+        process()
+        nbytes = sum(fingerprint['size'] for fingerprint in fingerprints.values())
+    manifest[stage] = fingerprints
+    save_manifest(manifest, manifest_path)
+    print_stage_report(stage, 0 if up_to_date else 1, 1 if up_to_date else 0, nbytes,
+                       time.perf_counter() - start_time)
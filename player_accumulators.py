@@ -0,0 +1,208 @@
+"""Per-player accumulators for the statistics of csv_to_player_stats.py.
+Each player keeps running sums, game counts and, for gi, gpl, acpl and adjusted gi, the count, mean and
+sum of squared deviations (Welford), from which the variance and standard deviation follow. Exact medians need
+every value, so the values of each player are also kept in compact float arrays, unless a sketch compression
+is given: then each player keeps a mergeable quantile sketch per value (quantile_sketch.py), whose size does
+not grow with the number of games, and the medians and percentiles are estimates.
+Accumulators can be updated one game at a time or one chunk of the game table at a time, merged with the
+accumulators of other files, processes or months, and saved to / loaded from a JSON state file, so the player
+stats can be updated when a new month arrives instead of recomputing the whole history.
+"""
+
+import base64
+import json
+import os
+from array import array
+import numpy as np
+import pandas as pd
+from quantile_sketch import add_value, add_values, merge_sketch, new_sketch, quantile, sketch_from_state, sketch_to_state
+# Values per player used for the medians, variances and standard deviations, and the game columns they come from,
+# shared with the groupby of player_stats_engine
+from player_stats_engine import VALUE_COLUMNS
+
+# Columns of player_stats.csv, in the order written by csv_to_player_stats.py
+PLAYER_STATS_COLUMNS = [
+    'Player', 'adjusted_avg_gi', 'avg_gi', 'avg_gpl', 'avg_acpl', 'total_game_count', 'total_moves',
+    'gi_median', 'gpl_median', 'acpl_median', 'gi_std', 'gpl_std', 'acpl_std',
+    'white_gi_sum', 'black_gi_sum', 'white_gpl_sum', 'black_gpl_sum', 'white_acpl_sum', 'black_acpl_sum',
+    'adjusted_white_gi_sum', 'adjusted_black_gi_sum', 'White_games', 'Black_games',
+    'total_gi_sum', 'total_gpl_sum', 'total_acpl_sum', 'gi_var', 'gpl_var', 'acpl_var',
+    'adjusted_gi_median', 'adjusted_gi_var', 'adjusted_gi_std',
+]
+
+STATE_VERSION = 1
+
+def new_accumulator(compression=None):
+    accumulator = {'White_games': 0, 'Black_games': 0, 'white_move_sum': 0, 'black_move_sum': 0}
+    for white_column, black_column in VALUE_COLUMNS.values():
+        accumulator[white_column + '_sum'] = 0.0
+        accumulator[black_column + '_sum'] = 0.0
+    # [count, mean, sum of squared deviations from the mean] per value
+    accumulator['moments'] = {name: [0, 0.0, 0.0] for name in VALUE_COLUMNS}
+    if compression:
+        accumulator['sketches'] = {name: new_sketch(compression) for name in VALUE_COLUMNS}
+    else:
+        accumulator['values'] = {name: array('d') for name in VALUE_COLUMNS}
+    return accumulator
+
+def get_accumulator(accumulators, player, compression=None):
+    accumulator = accumulators.get(player)
+    if accumulator is None:
+        accumulator = accumulators[player] = new_accumulator(compression)
+    return accumulator
+
+# Function to combine two [count, mean, m2] moments (Chan et al.), which for a single value is Welford's update
+def merge_moments(moments, count, mean, m2):
+    total = moments[0] + count
+    if total == 0:
+        return
+    delta = mean - moments[1]
+    moments[1] += delta * count / total
+    moments[2] += m2 + delta * delta * moments[0] * count / total
+    moments[0] = total
+
+# Function to add one game (a row of the game table as a dict) to the accumulators of its two players
+def add_game(accumulators, game, compression=None):
+    for side, player_column, index in (('white', 'White', 0), ('black', 'Black', 1)):
+        accumulator = get_accumulator(accumulators, game[player_column], compression)
+        accumulator[player_column + '_games'] += 1
+        accumulator[side + '_move_sum'] += game[side + '_move_number']
+        for name, columns in VALUE_COLUMNS.items():
+            value = game[columns[index]]
+            accumulator[columns[index] + '_sum'] += value
+            merge_moments(accumulator['moments'][name], 1, value, 0.0)
+            if 'sketches' in accumulator:
+                add_value(accumulator['sketches'][name], value)
+            else:
+                accumulator['values'][name].append(value)
+
+# Function to add a chunk of the game table to the accumulators with one groupby per side
+def add_game_table(accumulators, df, compression=None):
+    value_columns = [column for columns in VALUE_COLUMNS.values() for column in columns]
+    df = df.astype({column: 'float64' for column in value_columns})
+    for side, player_column, index in (('white', 'White', 0), ('black', 'Black', 1)):
+        columns = [columns[index] for columns in VALUE_COLUMNS.values()]
+        grouped = df.groupby(player_column, observed=True, sort=False)
+        sums = grouped[columns + [side + '_move_number']].sum()
+        means = grouped[columns].mean()
+        # ddof=0 variance times the count is the sum of squared deviations
+        m2s = grouped[columns].var(ddof=0).mul(grouped.size(), axis=0)
+        indices = grouped.indices
+        column_values = {column: df[column].to_numpy(dtype='float64') for column in columns}
+
+        for player, count in grouped.size().items():
+            # Player names are the keys of the JSON state, so they are kept as strings
+            accumulator = get_accumulator(accumulators, str(player), compression)
+            accumulator[player_column + '_games'] += int(count)
+            accumulator[side + '_move_sum'] += int(sums.at[player, side + '_move_number'])
+            rows = indices[player]
+            for name, column in zip(VALUE_COLUMNS, columns):
+                accumulator[column + '_sum'] += float(sums.at[player, column])
+                merge_moments(accumulator['moments'][name], int(count),
+                              float(means.at[player, column]), float(m2s.at[player, column]))
+                if 'sketches' in accumulator:
+                    add_values(accumulator['sketches'][name], column_values[column][rows])
+                else:
+                    accumulator['values'][name].frombytes(column_values[column][rows].tobytes())
+
+# Function to merge the accumulators of another file, process or month into accumulators
+def merge_accumulators(accumulators, other_accumulators):
+    for player, other in other_accumulators.items():
+        compression = next(iter(other['sketches'].values()))['compression'] if 'sketches' in other else None
+        accumulator = get_accumulator(accumulators, player, compression)
+        if ('sketches' in accumulator) != ('sketches' in other):
+            raise ValueError("Cannot merge player accumulators with exact values and with sketches")
+        for key, value in other.items():
+            if key == 'moments':
+                for name, moments in value.items():
+                    merge_moments(accumulator['moments'][name], *moments)
+            elif key == 'sketches':
+                for name, sketch in value.items():
+                    merge_sketch(accumulator['sketches'][name], sketch)
+            elif key == 'values':
+                for name, values in value.items():
+                    accumulator['values'][name].extend(values)
+            else:
+                accumulator[key] += value
+
+# Function to save the accumulators to a JSON state file; the value arrays are stored as base64 float64 bytes.
+# sources lists the game tables already added, so the same month is not added twice. game_table_size is the size
+# of the game table fused_pipeline.py has written for these sources, if any.
+def save_state(accumulators, sources, state_path, game_table_size=None):
+    players = {}
+    for player, accumulator in accumulators.items():
+        state = {key: value for key, value in accumulator.items() if key not in ('values', 'sketches')}
+        if 'sketches' in accumulator:
+            state['sketches'] = {name: sketch_to_state(sketch) for name, sketch in accumulator['sketches'].items()}
+        else:
+            state['values'] = {name: base64.b64encode(values.tobytes()).decode('ascii')
+                               for name, values in accumulator['values'].items()}
+        players[player] = state
+    state = {'version': STATE_VERSION, 'sources': sources, 'players': players}
+    if game_table_size is not None:
+        state['game_table_size'] = game_table_size
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, state_path)
+
+# Function to load the accumulators, the sources and the game table size of a state file, or empty ones if it
+# does not exist
+def load_state(state_path):
+    if not state_path or not os.path.exists(state_path):
+        return {}, {}, None
+    with open(state_path) as f:
+        state = json.load(f)
+    if state.get('version') != STATE_VERSION:
+        raise ValueError(f"Unsupported player stats state version in {state_path}: {state.get('version')}")
+    accumulators = {}
+    for player, player_state in state['players'].items():
+        accumulator = dict(player_state)
+        if 'sketches' in player_state:
+            accumulator['sketches'] = {name: sketch_from_state(sketch_state)
+                                       for name, sketch_state in player_state['sketches'].items()}
+        else:
+            accumulator['values'] = {}
+            for name, encoded in player_state['values'].items():
+                values = accumulator['values'][name] = array('d')
+                values.frombytes(base64.b64decode(encoded))
+        accumulators[player] = accumulator
+    return accumulators, state['sources'], state.get('game_table_size')
+
+# Function to get the q-quantile of the gi, gpl, acpl or adjusted gi of a player
+def player_quantile(accumulator, name, q):
+    if 'sketches' in accumulator:
+        return quantile(accumulator['sketches'][name], q)
+    values = np.frombuffer(accumulator['values'][name])
+    return np.median(values) if q == 0.5 else np.quantile(values, q)
+
+# Function to build the player stats table of csv_to_player_stats.py from the accumulators.
+# percentiles (e.g. [10, 90]) adds the columns gi_p10, gi_p90, gpl_p10, ... at the end.
+def player_stats_frame(accumulators, percentiles=()):
+    rows = []
+    for player, accumulator in accumulators.items():
+        row = {'Player': player}
+        for key, value in accumulator.items():
+            if key not in ('moments', 'values', 'sketches'):
+                row[key] = value
+        row['total_game_count'] = accumulator['White_games'] + accumulator['Black_games']
+        row['total_moves'] = accumulator['white_move_sum'] + accumulator['black_move_sum']
+        for name in VALUE_COLUMNS:
+            count, mean, m2 = accumulator['moments'][name]
+            row[f'{name}_median'] = player_quantile(accumulator, name, 0.5)
+            # The variance of a single value is undefined, which csv_to_player_stats.py fills with 0
+            variance = m2 / (count - 1) if count > 1 else 0.0
+            row[f'{name}_var'] = variance
+            row[f'{name}_std'] = np.sqrt(variance)
+        for name in ('gi', 'gpl', 'acpl'):
+            row[f'total_{name}_sum'] = row[f'white_{name}_sum'] + row[f'black_{name}_sum']
+            row[f'avg_{name}'] = row[f'total_{name}_sum'] / row['total_game_count']
+        row['adjusted_avg_gi'] = (row['adjusted_white_gi_sum'] + row['adjusted_black_gi_sum']) / row['total_game_count']
+        for percentile in percentiles:
+            for name in VALUE_COLUMNS:
+                row[f'{name}_p{percentile:g}'] = player_quantile(accumulator, name, percentile / 100)
+        rows.append(row)
+
+    percentile_columns = [f'{name}_p{percentile:g}' for percentile in percentiles for name in VALUE_COLUMNS]
+    player_stats = pd.DataFrame(rows, columns=PLAYER_STATS_COLUMNS + percentile_columns)
+    return player_stats.sort_values(by='adjusted_avg_gi', ascending=False)
@@ -0,0 +1,86 @@
+"""Player statistics of a game table with a single groupby, shared by csv_to_player_stats.py and
+csv_to_player_stats_non-adjusted_gi.py.
+The game table is reshaped to one row per player and game, white rows first: the columns gi, gpl, acpl
+(and adjusted_gi) hold the values of both colours, and the per-colour columns (white_gi, black_gi, ...)
+hold the value in the rows of their colour and NaN in the others. One groupby('Player').agg() then gives
+every sum, game count, median, variance and standard deviation. The sums skip the NaN rows, so they add
+the same values in the same order as a groupby on the White or Black column, and the output is identical
+to the previous chain of per-column groupbys and outer merges.
+"""
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Values per player and the game columns they come from
+VALUE_COLUMNS = {
+    'gi': ('white_gi', 'black_gi'),
+    'gpl': ('white_gpl', 'black_gpl'),
+    'acpl': ('white_acpl', 'black_acpl'),
+    'adjusted_gi': ('adjusted_white_gi', 'adjusted_black_gi'),
+}
+
+SIDES = (('white', 'White', 0), ('black', 'Black', 1))
+
+# Function to reshape the game table to one row per player and game
+def long_format(df, value_names):
+    parts = []
+    for side, player_column, index in SIDES:
+        part = {'Player': df[player_column]}
+        # float32 values of compact game tables are widened, since the variance is computed in the column dtype
+        for name in value_names:
+            part[name] = df[VALUE_COLUMNS[name][index]].astype('float64')
+        for name in value_names:
+            column = VALUE_COLUMNS[name][index]
+            part[column] = df[column]
+        part[player_column + '_games'] = 1
+        part[side + '_move_number'] = df[side + '_move_number']
+        parts.append(pd.DataFrame(part))
+    # The columns of the other colour are missing from each part, so they are NaN after the concat
+    long_df = pd.concat(parts, ignore_index=True)
+    # Categorical player names (compact game tables) would become strings, since the two colours have different categories
+    if all(isinstance(df[player_column].dtype, pd.CategoricalDtype) for _, player_column, _ in SIDES):
+        long_df['Player'] = union_categoricals([df['White'], df['Black']], sort_categories=True)
+    return long_df
+
+# Function to calculate the player stats of a game table. value_names are the values with medians,
+# variances and standard deviations, e.g. ['gi', 'gpl', 'acpl', 'adjusted_gi']. The columns are in the order
+# of the previous merge chain, and the rows are sorted by player.
+def calculate_player_stats(df, value_names):
+    long_df = long_format(df, value_names)
+
+    aggregations = {}
+    for name in value_names:
+        for column in VALUE_COLUMNS[name]:
+            aggregations[column + '_sum'] = (column, 'sum')
+    for side, player_column, index in SIDES:
+        aggregations[player_column + '_games'] = (player_column + '_games', 'sum')
+        aggregations[side + '_move_sum'] = (side + '_move_number', 'sum')
+    for name in value_names:
+        aggregations[name + '_median'] = (name, 'median')
+        aggregations[name + '_var'] = (name, 'var')
+        aggregations[name + '_std'] = (name, 'std')
+    stats = long_df.groupby('Player', observed=True).agg(**aggregations).reset_index()
+
+    # The outer merges filled the variance of single games and the counts of a missing colour with 0,
+    # and kept the counts as integers only when every player played both colours
+    stats = stats.fillna(0)
+    count_columns = ['White_games', 'Black_games', 'white_move_sum', 'black_move_sum']
+    if (stats['White_games'] > 0).all() and (stats['Black_games'] > 0).all() \
+            and all(pd.api.types.is_integer_dtype(df[side + '_move_number']) for side, _, _ in SIDES):
+        stats[count_columns] = stats[count_columns].astype('int64')
+    stats['total_game_count'] = stats['White_games'] + stats['Black_games']
+    stats['total_moves'] = stats['white_move_sum'] + stats['black_move_sum']
+    for name in ('gi', 'gpl', 'acpl'):
+        stats[f'total_{name}_sum'] = stats[f'white_{name}_sum'] + stats[f'black_{name}_sum']
+
+    for name in ('gi', 'gpl', 'acpl'):
+        stats[f'avg_{name}'] = stats[f'total_{name}_sum'] / stats['total_game_count']
+    if 'adjusted_gi' in value_names:
+        stats['adjusted_avg_gi'] = (stats['adjusted_white_gi_sum'] + stats['adjusted_black_gi_sum']) / stats['total_game_count']
+
+    sum_columns = [column + '_sum' for name in value_names for column in VALUE_COLUMNS[name]]
+    total_columns = ['White_games', 'Black_games', 'total_game_count', 'total_moves',
+                     'total_gi_sum', 'total_gpl_sum', 'total_acpl_sum']
+    stat_columns = [f'{name}_{stat}' for name in value_names for stat in ('median', 'var', 'std')]
+    average_columns = ['avg_gi', 'avg_gpl', 'avg_acpl'] + (['adjusted_avg_gi'] if 'adjusted_gi' in value_names else [])
+    return stats[['Player'] + sum_columns + total_columns + stat_columns + average_columns]
@@ -0,0 +1,114 @@
+"""A mergeable quantile sketch (merging t-digest) for the per-player medians and percentiles.
+The sketch keeps about `compression` centroids (mean, weight) however many values are added, with the smallest
+centroids at the tails, so medians and percentiles are estimated within a rank error of roughly 1 / compression.
+Values are buffered and merged into the centroids in batches.
+Sketches of different files, processes or months can be merged, and as long as no centroids had to be merged
+(fewer than about compression / 2 values) the quantiles are exact and equal to np.quantile with linear interpolation.
+"""
+
+import math
+from array import array
+import numpy as np
+
+DEFAULT_COMPRESSION = 100
+
+def new_sketch(compression=DEFAULT_COMPRESSION):
+    return {'compression': compression, 'means': array('d'), 'weights': array('d'), 'buffer': array('d')}
+
+# Scale function of the t-digest: a centroid may span at most one unit of k
+def scale(q, compression):
+    return compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+# Function to replace the centroids by the given (unsorted) centroids, merging neighbours
+# as long as a centroid spans at most one unit of the scale function
+def merge_centroids(sketch, means, weights):
+    order = np.argsort(means, kind='stable')
+    means, weights = means[order].tolist(), weights[order].tolist()
+    total = sum(weights)
+    compression = sketch['compression']
+
+    new_means, new_weights = array('d'), array('d')
+    current_mean, current_weight = means[0], weights[0]
+    weight_before = 0.0
+    k_left = scale(0.0, compression)
+    for mean, weight in zip(means[1:], weights[1:]):
+        q_right = min((weight_before + current_weight + weight) / total, 1.0)
+        if scale(q_right, compression) - k_left <= 1:
+            current_weight += weight
+            current_mean += (mean - current_mean) * weight / current_weight
+        else:
+            new_means.append(current_mean)
+            new_weights.append(current_weight)
+            weight_before += current_weight
+            k_left = scale(min(weight_before / total, 1.0), compression)
+            current_mean, current_weight = mean, weight
+    new_means.append(current_mean)
+    new_weights.append(current_weight)
+    sketch['means'], sketch['weights'] = new_means, new_weights
+
+# Function to merge the buffered values into the centroids
+def compress(sketch):
+    if not sketch['buffer']:
+        return
+    means = np.concatenate([np.frombuffer(sketch['means']), np.frombuffer(sketch['buffer'])])
+    weights = np.concatenate([np.frombuffer(sketch['weights']), np.ones(len(sketch['buffer']))])
+    merge_centroids(sketch, means, weights)
+    sketch['buffer'] = array('d')
+
+def add_value(sketch, value):
+    sketch['buffer'].append(value)
+    if len(sketch['buffer']) >= 5 * sketch['compression']:
+        compress(sketch)
+
+# Function to add a NumPy array of values to the sketch
+def add_values(sketch, values):
+    sketch['buffer'].frombytes(np.asarray(values, dtype='float64').tobytes())
+    if len(sketch['buffer']) >= 5 * sketch['compression']:
+        compress(sketch)
+
+# Function to merge the centroids and buffered values of another sketch into sketch
+def merge_sketch(sketch, other):
+    compress(other)
+    if not other['means']:
+        return
+    compress(sketch)
+    means = np.concatenate([np.frombuffer(sketch['means']), np.frombuffer(other['means'])])
+    weights = np.concatenate([np.frombuffer(sketch['weights']), np.frombuffer(other['weights'])])
+    merge_centroids(sketch, means, weights)
+
+# Function to estimate the q-quantile (0 <= q <= 1). Each centroid is centred on its share of the ranks,
+# and the quantile is interpolated linearly between the centres, as np.quantile does between values.
+def quantile(sketch, q):
+    compress(sketch)
+    means, weights = sketch['means'], sketch['weights']
+    if not means:
+        return float('nan')
+    if len(means) == 1:
+        return means[0]
+    total = sum(weights)
+    # Rank of the quantile, counting from the centre of the first value (rank 0) to the centre of the last
+    target = q * (total - 1)
+    centre = (weights[0] - 1) / 2
+    if target <= centre:
+        return means[0]
+    for index in range(1, len(means)):
+        next_centre = centre + (weights[index - 1] + weights[index]) / 2
+        if target <= next_centre:
+            fraction = (target - centre) / (next_centre - centre)
+            return means[index - 1] + fraction * (means[index] - means[index - 1])
+        centre = next_centre
+    return means[-1]
+
+# Function to get the number of bytes held by the centroids and the buffer
+def sketch_size(sketch):
+    return (len(sketch['means']) + len(sketch['weights']) + len(sketch['buffer'])) * 8
+
+def sketch_to_state(sketch):
+    compress(sketch)
+    return {'compression': sketch['compression'], 'means': sketch['means'].tolist(), 'weights': sketch['weights'].tolist()}
+
+def sketch_from_state(state):
+    sketch = new_sketch(state['compression'])
+    sketch['means'] = array('d', state['means'])
+    sketch['weights'] = array('d', state['weights'])
+    return sketch
@@ -0,0 +1,76 @@
+"""Scoring schemes the analyzers calculate GI, GPL and the blunder, mistake and inaccuracy counts with.
+A scheme is the points for a win and for a draw, and the expected point losses from which a move is a blunder
+and a mistake (smaller losses are inaccuracies). Standard (1-0.5-0) and NorwayChess (3-1.25-0) are built in, and
+other schemes are given as NAME:WIN,DRAW[,BLUNDER,MISTAKE], e.g. --scoring-system Standard NorwayChess Football:3,1.
+Without thresholds, a scheme gets those of Standard scaled by its points for a win.
+All the schemes of a run are calculated in one pass over the evaluations of each game. The first scheme is written
+to the usual columns (white_gi, white_gpl, counts, ...) and every further scheme to a group of the same columns
+prefixed with its name in lower case (e.g. norwaychess_white_gi).
+"""
+
+import argparse
+import re
+from expected_value_table import SCORING_SYSTEMS
+
+# Expected point losses from which a move is a blunder and a mistake in the built-in scoring systems
+BUILTIN_THRESHOLDS = {
+    "Standard": (0.4, 0.2),
+    "NorwayChess": (1.25, 0.625),
+}
+SCHEME_REGEX = re.compile(r'([A-Za-z][A-Za-z0-9]*):(.+)')
+
+def make_scoring_scheme(name, win_points, draw_points, blunder_threshold=None, mistake_threshold=None):
+    standard_blunder, standard_mistake = BUILTIN_THRESHOLDS["Standard"]
+    return {
+        'name': name, 'win': win_points, 'draw': draw_points,
+        'blunder': standard_blunder * win_points if blunder_threshold is None else blunder_threshold,
+        'mistake': standard_mistake * win_points if mistake_threshold is None else mistake_threshold,
+    }
+
+SCORING_SCHEMES = {
+    name: make_scoring_scheme(name, win_points, draw_points, *BUILTIN_THRESHOLDS[name])
+    for name, (win_points, draw_points) in SCORING_SYSTEMS.items()
+}
+
+# Function to parse a scheme given on the command line: the name of a built-in scheme or NAME:WIN,DRAW[,BLUNDER,MISTAKE]
+def parse_scoring_scheme(text):
+    if text in SCORING_SCHEMES:
+        return SCORING_SCHEMES[text]
+    match = SCHEME_REGEX.fullmatch(text)
+    try:
+        values = [float(value) for value in match.group(2).split(',')] if match else []
+    except ValueError:
+        values = []
+    if len(values) not in (2, 4):
+        raise argparse.ArgumentTypeError(f"{text!r} is not one of {', '.join(SCORING_SCHEMES)} "
+                                         "or NAME:WIN,DRAW[,BLUNDER,MISTAKE]")
+    return make_scoring_scheme(match.group(1), *values)
+
+# Function to get the list of schemes from a scheme, a name or a list of them, e.g. 'Standard'
+def resolve_scoring_schemes(scoring_schemes):
+    if isinstance(scoring_schemes, (str, dict)):
+        scoring_schemes = [scoring_schemes]
+    schemes = [SCORING_SCHEMES[scheme] if isinstance(scheme, str) else scheme for scheme in scoring_schemes]
+    prefixes = [scheme_prefix(scheme) for scheme in schemes]
+    if not schemes or len(set(prefixes)) != len(prefixes):
+        raise ValueError(f"Expected scoring schemes with distinct names, got {[scheme['name'] for scheme in schemes]}")
+    return schemes
+
+# Prefix of the column group of a scheme that is not the first one
+def scheme_prefix(scheme):
+    return scheme['name'].lower() + '_'
+
+# Function to add the --scoring-system option to an argparse parser
+def add_scoring_arguments(parser):
+    parser.add_argument('--scoring-system', nargs='+', type=parse_scoring_scheme, default=[SCORING_SCHEMES["Standard"]],
+                        metavar='SCHEME',
+                        help="scoring schemes calculated in one pass: " + ", ".join(SCORING_SCHEMES)
+                             + " or NAME:WIN,DRAW[,BLUNDER,MISTAKE]; the first one gives the usual columns "
+                               "(default: Standard)")
+
+# Function to get the schemes of the parsed arguments of add_scoring_arguments, failing like argparse on repeated names
+def scoring_schemes_from_args(parser, args):
+    try:
+        return resolve_scoring_schemes(args.scoring_system)
+    except ValueError as error:
+        parser.error(str(error))
@@ -1,63 +1,173 @@
-# Function to split a large PGN file into smaller files based on size and content
+"""This script splits a large PGN file into smaller files based on size, number of games or date.
+The input file is memory-mapped and cut only at game boundaries, i.e. at lines starting with [Event.
+Shards are cut by size (at the last game that fits in --max-file-size-mb), by number of games (--games-per-file)
+or by the date of the games (--by-date year, month or day): the UTCDate header when there is one and the Date
+header otherwise, as in game_index.py. The games are copied as bytes, so the encoding of the file does not matter.
+With --jobs N the shards are written by N threads, and with --zstd they are compressed (.pgn.zst); zstandard
+releases the GIL, so compressed shards are written in parallel.
+With --game-index the games are taken from the index of game_index.py (built on the first run) instead of being
+searched for, and the header options of game_filter.py (e.g. --min-elo, --time-controls) keep only some of the games.
+"""
 
+import argparse
+import mmap
 import os
-import chardet
-
-# Function to detect the character encoding of a file
-def detect_encoding(file_path):
-    with open(file_path, 'rb') as file:
-        raw_data = file.read(150000)  # Read the first 150,000 bytes to guess the encoding
-        result = chardet.detect(raw_data)
-        return result['encoding']
-
-def find_last_complete_game(buffer):
-    last_valid_result_index = max(buffer.rfind(b" 1-0"), buffer.rfind(b" 0-1"), buffer.rfind(b" 1/2-1/2"))
-    if last_valid_result_index == -1:
-        return -1
-    end_of_game_index = buffer.find(b"\n", last_valid_result_index)
-    return end_of_game_index if end_of_game_index != -1 else last_valid_result_index
-
-def split_pgn_file(input_file_path, output_directory, max_file_size_mb):
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, pairwise
+import numpy as np
+import zstandard as zstd
+from game_filter import add_filter_arguments, find_header_end, header_filter_from_args
+from game_index import GAME_START, find_game_starts, game_batches, game_index_for, merge_ranges, select_games
+
+DATE_REGEX = re.compile(rb'^\[(UTCDate|Date)\s+"((?:[^"\\]|\\.)*)"\]', re.MULTILINE)
+DATE_VALUE_REGEX = re.compile(rb'\d{4}\.\d{2}\.\d{2}')
+# Number of characters of the date kept in the shard name for each --by-date period
+DATE_PERIODS = {'year': 4, 'month': 7, 'day': 10}
+
+# Function to yield (start, end) byte ranges of at most max_size bytes, each ending at a game boundary.
+# A single game larger than max_size gets a range of its own.
+def size_ranges(data, max_size):
+    start = 0
+    while start < len(data):
+        if len(data) - start <= max_size:
+            end = len(data)
+        else:
+            # The last game start within the next max_size bytes, or else the first one after them
+            end = data.rfind(GAME_START, start + 1, start + max_size) + 1
+            if end <= start:
+                end = data.find(GAME_START, start + max_size - 1) + 1 or len(data)
+        yield start, end
+        start = end
+
+# Function to yield (start, end) byte ranges of games_per_shard games each
+def count_ranges(data, games_per_shard):
+    starts = find_game_starts(data)
+    start = next(starts)
+    for index, game_start in enumerate(starts, start=1):
+        if index % games_per_shard == 0:
+            yield start, game_start
+            start = game_start
+    yield start, len(data)
+
+# Function to get the shard key of a date: its year, month or day (e.g. '2023.01' for months), or 'unknown'
+def period_key(date, length):
+    return date.decode('ascii')[:length] if DATE_VALUE_REGEX.fullmatch(date) else 'unknown'
+
+# Function to group the games by the period of their date (e.g. '2023.01' for months): the UTCDate header when
+# there is one and the Date header otherwise, as the Date column of the game index.
+# Returns {period: [(start, end), ...]}, with consecutive games of a period merged into one range.
+def date_ranges(data, period):
+    length = DATE_PERIODS[period]
+    shards = {}
+    for start, end in pairwise(chain(find_game_starts(data), [len(data)])):
+        # The headers end at the first blank line of the game (LF or CRLF line endings)
+        header_end, movetext_start = find_header_end(data, start, end)
+        dates = dict(match.groups() for match in DATE_REGEX.finditer(data, start, header_end))
+        key = period_key(dates.get(b'UTCDate') or dates.get(b'Date', b''), length)
+        ranges = shards.setdefault(key, [])
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return shards
+
+# Function to cut the games of the index selected by header_filter and has_eval into shards.
+# Returns [(key, ranges)], where key is the period of the shard with by_date and its number otherwise.
+def index_shards(index, max_size, games_per_shard=None, by_date=None, header_filter=None, has_eval=False):
+    rows = select_games(index, header_filter, has_eval)
+    if by_date:
+        length = DATE_PERIODS[by_date]
+        period_keys = [period_key(value, length) for value in index['Date_values'].tolist()]
+        shard_rows = {}
+        for row, code in zip(rows.tolist(), index['Date'][rows].tolist()):
+            shard_rows.setdefault(period_keys[code], []).append(row)
+        return [(key, merge_ranges(index, np.array(key_rows))) for key, key_rows in shard_rows.items()]
+    if games_per_shard:
+        batches = [merge_ranges(index, rows[i:i + games_per_shard]) for i in range(0, len(rows), games_per_shard)]
+    else:
+        batches = game_batches(index, rows, max_size)
+    return list(enumerate(batches, start=1))
+
+# Function to write the byte ranges of the data to one shard, compressed with zstd if compression_level is set.
+# Returns the number of bytes read from the input.
+def write_shard(data, ranges, output_path, compression_level=None):
+    temp_path = output_path + '.tmp'
+    # The views are released before the memory map is closed
+    with memoryview(data) as view, open(temp_path, 'wb') as f:
+        if compression_level is not None:
+            with zstd.ZstdCompressor(level=compression_level).stream_writer(f) as writer:
+                for start, end in ranges:
+                    writer.write(view[start:end])
+        else:
+            for start, end in ranges:
+                f.write(view[start:end])
+    os.replace(temp_path, output_path)
+    return sum(end - start for start, end in ranges)
+
+def split_pgn_file(input_file_path, output_directory, max_file_size_mb=100, games_per_file=None, by_date=None,
+                   jobs=1, compression_level=None, use_index=False, header_filter=None, has_eval=False):
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
+    if os.path.getsize(input_file_path) == 0:
+        print(f"{input_file_path} is empty")
+        return
+
+    start_time = time.perf_counter()
+    extension = '.pgn.zst' if compression_level is not None else '.pgn'
+    max_size = int(max_file_size_mb * 1024 * 1024)
+    index = game_index_for(input_file_path) if use_index else None
+    with open(input_file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if index is not None:
+            prefix = 'games_' if by_date else 'games'
+            shards = ((f'{prefix}{key}{extension}', ranges)
+                      for key, ranges in index_shards(index, max_size, games_per_file, by_date, header_filter, has_eval))
+        elif by_date:
+            shards = ((f'games_{key}{extension}', ranges) for key, ranges in date_ranges(data, by_date).items())
+        else:
+            if games_per_file:
+                ranges = count_ranges(data, games_per_file)
+            else:
+                ranges = size_ranges(data, max_size)
+            shards = ((f'games{file_counter}{extension}', [shard_range])
+                      for file_counter, shard_range in enumerate(ranges, start=1))
 
-    max_file_size = max_file_size_mb * 1024 * 1024  # Convert MB to Bytes
-    file_counter = 1
-    buffer = b""
-    encoding = detect_encoding(input_file_path)
-
-    with open(input_file_path, 'rb') as file:  # Open in binary mode
-        while True:
-            chunk = file.read(1024 * 1024)  # Read 1MB chunk at a time
-            if not chunk and not buffer:  # End of file
-                break
-
-            buffer += chunk
-
-            if len(buffer) >= max_file_size:
-                split_index = find_last_complete_game(buffer)
-
-                if split_index != -1:
-                    # Write the complete games to a new file
-                    with open(os.path.join(output_directory, f'games{file_counter}.pgn'), 'wb') as current_file:
-                        current_file.write(buffer[:split_index + 1])
-                    buffer = buffer[split_index + 1:]
-                    # Remove leading whitespaces (including newline) from the new buffer
-                    buffer = buffer.lstrip(b' \t\r\n')
-                else:
-                    # In case no complete game is found, increase buffer size
-                    continue
-
-                file_counter += 1
-                print("file_counter: ", file_counter)
-
-    # Write remaining buffer to file, if any
-    if buffer:
-        with open(os.path.join(output_directory, f'games{file_counter}.pgn'), 'wb') as current_file:
-            current_file.write(buffer)
+        # Shards are submitted as they are cut, at most 2 * jobs at a time
+        total_bytes, shard_count = 0, 0
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            pending = []
+            for filename, shard_ranges in shards:
+                pending.append(executor.submit(write_shard, data, shard_ranges,
+                                               os.path.join(output_directory, filename), compression_level))
+                if len(pending) >= 2 * jobs:
+                    total_bytes += pending.pop(0).result()
+                    shard_count += 1
+            for future in pending:
+                total_bytes += future.result()
+                shard_count += 1
+
+    seconds = time.perf_counter() - start_time
+    megabytes = total_bytes / (1024 * 1024)
+    print(f"Split {megabytes:.1f} MB into {shard_count} files in {seconds:.2f} s ({megabytes / seconds:.1f} MB/s)")
 
 if __name__ == "__main__":
-    input_file_path = ''
-    output_directory = ''
-    max_file_size_mb = 100
-    split_pgn_file(input_file_path, output_directory, max_file_size_mb)
+    parser = argparse.ArgumentParser(description="Split a large PGN file into smaller files at game boundaries.")
+    parser.add_argument('input_file_path')
+    parser.add_argument('output_directory')
+    parser.add_argument('--max-file-size-mb', type=float, default=100,
+                        help="maximum size of each output file (default: 100 MB)")
+    parser.add_argument('--games-per-file', type=int, help="split into files of this many games instead")
+    parser.add_argument('--by-date', choices=list(DATE_PERIODS), help="split into one file per year, month or day")
+    parser.add_argument('--jobs', type=int, default=1, help="number of files written in parallel")
+    parser.add_argument('--zstd', type=int, nargs='?', const=3, metavar='LEVEL',
+                        help="compress the output files with zstd (default level: 3)")
+    parser.add_argument('--game-index', action='store_true',
+                        help="take the games from the game index (built if missing); implied by the game filter options")
+    add_filter_arguments(parser, exclude_time_controls=(), has_eval=False, min_plies=False)
+    args = parser.parse_args()
+
+    header_filter = header_filter_from_args(args)
+    use_index = args.game_index or header_filter is not None or args.has_eval
+    split_pgn_file(args.input_file_path, args.output_directory, args.max_file_size_mb, args.games_per_file,
+                   args.by_date, args.jobs, args.zstd, use_index, header_filter, args.has_eval)
@@ -0,0 +1,5 @@
+# The scripts of the repository are modules at its root, so the tests import them from there
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,17 @@
+import pandas as pd
+import csv_to_player_stats
+from test_player_stats_engine import game_table
+
+def test_game_table_is_hashed_only_with_a_state_file(tmp_path, monkeypatch):
+    game_table_path = tmp_path / 'games.csv'
+    game_table(True).to_csv(game_table_path, index=False)
+    hashed = []
+    monkeypatch.setattr(csv_to_player_stats, 'file_hash', lambda path: hashed.append(path) or 'hash')
+
+    csv_to_player_stats.main_incremental(str(game_table_path), str(tmp_path / 'stats'), None, percentiles=[10])
+    assert hashed == []
+    assert len(pd.read_csv(tmp_path / 'stats' / 'player_stats.csv')) == 7
+
+    csv_to_player_stats.main_incremental(str(game_table_path), str(tmp_path / 'state_stats'),
+                                         str(tmp_path / 'state.json'))
+    assert hashed == [str(game_table_path)]
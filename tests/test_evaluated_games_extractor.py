@@ -0,0 +1,30 @@
+import glob
+import zstandard as zstd
+import evaluated_games_extractor
+from evaluated_games_extractor import filter_and_save_files
+
+# Function to write a .zst file of game_count games whose Site header names the file
+def write_zst(file_path, name, game_count):
+    games = [f'[Event "Rated Blitz game"]\n[Site "{name}"]\n[Result "1-0"]\n\n1. e4 {{ [%eval 0.3] }} 1-0'
+             for _ in range(game_count)]
+    with open(file_path, 'wb') as zst_file:
+        zst_file.write(zstd.ZstdCompressor().compress('\n\n'.join(games).encode() + b'\n'))
+
+def test_output_files_do_not_mix_inputs(tmp_path, monkeypatch):
+    # Small queues and chunks, so that the games of the files reach the writer interleaved
+    monkeypatch.setattr(evaluated_games_extractor, 'QUEUE_SIZE', 1)
+    names = ['a', 'b', 'c']
+    for name in names:
+        write_zst(tmp_path / f'{name}.pgn.zst', name, 3000)
+    output_directory = tmp_path / 'out'
+    output_directory.mkdir()
+    filter_and_save_files([str(tmp_path / f'{name}.pgn.zst') for name in names], str(output_directory),
+                          max_file_size=40000, jobs=3, game_filter=lambda game: True)
+
+    games_per_input = dict.fromkeys(names, 0)
+    for output_path in glob.glob(str(output_directory / '*.pgn')):
+        with open(output_path) as output_file:
+            sites = [line for line in output_file.read().splitlines() if line.startswith('[Site')]
+        assert len(set(sites)) == 1
+        games_per_input[sites[0].split('"')[1]] += len(sites)
+    assert games_per_input == dict.fromkeys(names, 3000)
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from chess.engine import Cp, Mate, MateGiven
+from benchmark import calculate_expected_value
+from expected_value_table import CP_LIMIT, lookup_expected_value, scalar_table_index, table_index
+
+TURNS = ("White", "Black")
+# Evaluations beyond CP_LIMIT, up to the mate scores of pgn_evaluation_fast_analyzer (mate_score=10000)
+OUT_OF_RANGE_CPS = [CP_LIMIT + 1, 2500, 5000, 9999, 10000, 20000, 100000]
+
+# Function to calculate the expected points of White and Black from the WDL model, as the analyzers did before
+# the table
+def wdl_expected_value(score, turn, scoring_system):
+    win_draw_loss = score.wdl()
+    win_prob, draw_prob, loss_prob = win_draw_loss.wins / 1000, win_draw_loss.draws / 1000, win_draw_loss.losses / 1000
+    return calculate_expected_value(win_prob, draw_prob, loss_prob, turn, scoring_system)
+
+@pytest.mark.parametrize('scoring_system', ['Standard', 'NorwayChess'])
+def test_lookup_equals_wdl_in_range(scoring_system):
+    for cp in range(-CP_LIMIT, CP_LIMIT + 1):
+        assert scalar_table_index(cp) == cp + CP_LIMIT
+        for turn in TURNS:
+            assert lookup_expected_value(cp, turn, scoring_system) == wdl_expected_value(Cp(cp), turn, scoring_system)
+
+@pytest.mark.parametrize('scoring_system', ['Standard', 'NorwayChess'])
+def test_lookup_clamps_out_of_range(scoring_system):
+    for cp in OUT_OF_RANGE_CPS + [-cp for cp in OUT_OF_RANGE_CPS]:
+        assert scalar_table_index(cp) == table_index(cp) == (0 if cp < 0 else 2 * CP_LIMIT)
+        for turn in TURNS:
+            assert lookup_expected_value(cp, turn, scoring_system) == wdl_expected_value(Cp(cp), turn, scoring_system)
+
+@pytest.mark.parametrize('scoring_system', ['Standard', 'NorwayChess'])
+def test_lookup_of_mates(scoring_system):
+    for mate in [Mate(1), Mate(5), Mate(-1), Mate(-5), MateGiven]:
+        cp = mate.score(mate_score=10000)
+        for turn in TURNS:
+            assert lookup_expected_value(cp, turn, scoring_system) == wdl_expected_value(mate, turn, scoring_system)
+
+def test_vector_and_scalar_indices_agree():
+    cps = np.arange(-3 * CP_LIMIT, 3 * CP_LIMIT + 1, 7)
+    assert table_index(cps).tolist() == [scalar_table_index(cp) for cp in cps.tolist()]
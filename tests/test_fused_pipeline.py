@@ -0,0 +1,50 @@
+import os
+import pandas as pd
+import pytest
+import zstandard as zstd
+import fused_pipeline
+
+FIXTURE_PGN = os.path.join(os.path.dirname(__file__), 'data', 'evaluated_games.pgn')
+
+def keep_all_games(game):
+    return True
+
+# Function to write the fixture games to a .zst file in directory, with the name of the file in their Site headers
+# so that every .zst file has its own content hash
+def write_zst(directory, name):
+    os.makedirs(directory, exist_ok=True)
+    with open(FIXTURE_PGN, 'rb') as pgn:
+        data = pgn.read().replace(b'https://lichess.org/', f'https://lichess.org/{name}/'.encode())
+    with open(os.path.join(directory, name + '.pgn.zst'), 'wb') as zst_file:
+        zst_file.write(zstd.ZstdCompressor().compress(data))
+
+def run(input_directory, output_directory, state_path, scoring_schemes='Standard'):
+    fused_pipeline.main(str(input_directory), str(output_directory), keep_all_games, scoring_schemes, chunk_games=4,
+                        state_path=str(state_path))
+
+def test_interrupted_run_is_not_added_twice(tmp_path, monkeypatch):
+    write_zst(tmp_path / 'in', 'a')
+    run(tmp_path / 'in', tmp_path / 'out', tmp_path / 'state.json')
+    write_zst(tmp_path / 'in', 'b')
+
+    # The run stops after appending the games of b.pgn.zst, before the state is saved
+    def fail(*args):
+        raise KeyboardInterrupt
+    with monkeypatch.context() as patch:
+        patch.setattr(fused_pipeline, 'save_state', fail)
+        with pytest.raises(KeyboardInterrupt):
+            run(tmp_path / 'in', tmp_path / 'out', tmp_path / 'state.json')
+    run(tmp_path / 'in', tmp_path / 'out', tmp_path / 'state.json')
+
+    run(tmp_path / 'in', tmp_path / 'clean', tmp_path / 'clean_state.json')
+    sites = [sorted(pd.read_csv(tmp_path / output / 'aggregated_game_data.csv')['Site'])
+             for output in ('out', 'clean')]
+    assert len(set(sites[0])) == len(sites[0]) == 18
+    assert sites[0] == sites[1]
+
+def test_games_with_new_columns_are_refused(tmp_path):
+    write_zst(tmp_path / 'in', 'a')
+    run(tmp_path / 'in', tmp_path / 'out', tmp_path / 'state.json')
+    write_zst(tmp_path / 'in', 'b')
+    with pytest.raises(ValueError, match='norwaychess_'):
+        run(tmp_path / 'in', tmp_path / 'out', tmp_path / 'state.json', ['Standard', 'NorwayChess'])
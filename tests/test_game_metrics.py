@@ -0,0 +1,23 @@
+import chess
+from game_metrics import build_metric_set, run_metrics
+
+# Evaluations of a game in which White keeps the balance and Black then throws away a queen: the side to move
+# and the evaluation in pawns from its perspective, of the root and every mainline node
+BLACK_BLUNDER_EVALS = [(chess.WHITE, None), (chess.BLACK, -0.3), (chess.WHITE, 0.2), (chess.BLACK, -0.3),
+                       (chess.WHITE, 9.0), (chess.BLACK, -9.0)]
+
+def test_blunder_counted_for_the_side_that_moved():
+    columns = run_metrics(build_metric_set(['Standard', 'NorwayChess']), {'Result': '1-0'}, BLACK_BLUNDER_EVALS)
+    assert columns['counts'] == {'white_blunder': 0, 'black_blunder': 1, 'white_mistake': 0, 'black_mistake': 0,
+                                 'white_inaccuracy': 3, 'black_inaccuracy': 1}
+    # The loss of the queen is only a mistake in NorwayChess, whose blunder threshold is 1.25 points
+    assert columns['norwaychess_counts'] == {'white_blunder': 0, 'black_blunder': 0, 'white_mistake': 0,
+                                             'black_mistake': 1, 'white_inaccuracy': 3, 'black_inaccuracy': 1}
+
+def test_unfinished_game_without_evaluated_moves():
+    metric_set = build_metric_set(['Standard', 'NorwayChess'])
+    for evals in ([(chess.WHITE, None)], [(chess.WHITE, None), (chess.BLACK, None), (chess.WHITE, None)]):
+        columns = run_metrics(metric_set, {'Result': '*'}, evals)
+        assert columns['white_gi'] == columns['black_gi'] == 0
+        assert columns['norwaychess_white_gi'] == columns['norwaychess_black_gi'] == 0
+        assert columns['white_avg_gpl'] == columns['black_avg_gpl'] == 0
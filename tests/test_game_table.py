@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+from csv_to_player_stats import GAME_COLUMNS
+from game_table import read_game_table
+from player_stats_engine import calculate_player_stats
+
+VALUE_NAMES = ['gi', 'gpl', 'acpl', 'adjusted_gi']
+# Tolerance of the player stats of a compact (float32) read against the default read, see README.md
+COMPACT_RTOL = 1e-4
+COMPACT_ATOL = 1e-3
+
+# Function to write a game table of synthetic games, with gi values around 0 whose sums partly cancel
+def write_game_table(file_path, game_count=2000, player_count=20):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'White': ['Player' + str(i) for i in rng.integers(player_count, size=game_count)],
+        'Black': ['Player' + str(i) for i in rng.integers(player_count, size=game_count)],
+        'white_move_number': rng.integers(10, 80, size=game_count),
+        'black_move_number': rng.integers(10, 80, size=game_count),
+    })
+    for side in ('white', 'black'):
+        df[f'{side}_gi'] = rng.normal(0, 1.4, size=game_count).round(4)
+        df[f'{side}_gpl'] = rng.exponential(0.5, size=game_count).round(4)
+        df[f'{side}_acpl'] = rng.lognormal(3, 1, size=game_count).round(4)
+        df[f'adjusted_{side}_gi'] = (df[f'{side}_gi'] - rng.random(size=game_count)).round(4)
+    df.to_csv(file_path, index=False)
+
+def player_stats(file_path, compact):
+    stats = calculate_player_stats(read_game_table(file_path, GAME_COLUMNS, compact=compact), VALUE_NAMES)
+    stats['Player'] = stats['Player'].astype(str)
+    return stats.sort_values('Player').reset_index(drop=True)
+
+def test_compact_read_matches_default_within_float32_tolerance(tmp_path):
+    file_path = str(tmp_path / 'games.csv')
+    write_game_table(file_path)
+    default = player_stats(file_path, compact=False)
+    compact = player_stats(file_path, compact=True)
+    assert list(compact.columns) == list(default.columns)
+    assert compact['Player'].tolist() == default['Player'].tolist()
+    numeric = default.columns.drop('Player')
+    np.testing.assert_allclose(compact[numeric].to_numpy(float), default[numeric].to_numpy(float),
+                               rtol=COMPACT_RTOL, atol=COMPACT_ATOL)
@@ -0,0 +1,44 @@
+import os
+import chess.pgn
+import pytest
+from benchmark import calculate_gi_by_replay
+from pgn_evaluation_analyzer import analyze_games, calculate_gi
+
+# Games with evaluations (with mates, and gaps and a position set up with Black to move), decisive and
+# unfinished games without evaluations and a game without moves
+FIXTURE_PGN = os.path.join(os.path.dirname(__file__), 'data', 'evaluated_games.pgn')
+
+def read_games():
+    games = []
+    with open(FIXTURE_PGN) as pgn:
+        while True:
+            game = chess.pgn.read_game(pgn)
+            if game is None:
+                return games
+            games.append(game)
+
+# Function to check that two game data dicts have the same fields, in the same order, with equal values of the
+# same types (so that 0 and 0.0 are told apart)
+def assert_same_game_data(game_data, expected):
+    assert list(game_data) == list(expected)
+    for field, value in expected.items():
+        assert game_data[field] == value, field
+        assert type(game_data[field]) is type(value), field
+
+@pytest.mark.parametrize('scoring_system', ['Standard', 'NorwayChess'])
+def test_game_data_equals_board_replay(scoring_system):
+    games = read_games()
+    expected = [calculate_gi_by_replay(game, scoring_system) for game in games]
+    with open(FIXTURE_PGN) as pgn:
+        scanned = list(analyze_games(pgn, scoring_system, fast_scan=True))
+    assert len(scanned) == len(games) == 9
+    for game, game_data, expected_game_data in zip(games, scanned, expected):
+        assert_same_game_data(calculate_gi(game, scoring_system), expected_game_data)
+        assert_same_game_data(game_data, expected_game_data)
+
+def test_fixture_covers_games_without_evaluations():
+    game_data = [calculate_gi_by_replay(game, 'Standard') for game in read_games()]
+    unevaluated = [data for data in game_data if data['white_move_number'] + data['black_move_number'] == 0]
+    assert sorted(data['WhiteResult'] for data in unevaluated if data['WhiteResult'] != '...') == [0, 1]
+    assert len([data for data in unevaluated if data['WhiteResult'] == '...']) == 2
+    assert any(data['WhiteResult'] == '...' and data['white_move_number'] > 0 for data in game_data)
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import player_stats_by_merges
+from player_stats_engine import calculate_player_stats
+
+# Function to build a small game table. With one_colour_players, 'OnlyWhite' plays only White and 'OnlyBlack'
+# only Black, and 'Once' plays a single game
+def game_table(one_colour_players):
+    rng = np.random.default_rng(1)
+    players = ['Alice', 'Bob', 'Carol', 'Dave']
+    white = [players[i % 4] for i in range(24)]
+    black = [players[(i + 1 + (i // 4) % 3) % 4] for i in range(24)]
+    if one_colour_players:
+        white += ['OnlyWhite', 'OnlyWhite', 'Alice', 'Once']
+        black += ['Bob', 'Carol', 'OnlyBlack', 'Dave']
+    df = pd.DataFrame({'White': white, 'Black': black})
+    game_count = len(df)
+    for side in ('white', 'black'):
+        df[f'{side}_gi'] = rng.normal(0, 1, size=game_count).round(4)
+        df[f'{side}_gpl'] = rng.exponential(0.5, size=game_count).round(4)
+        df[f'{side}_acpl'] = rng.lognormal(3, 1, size=game_count).round(4)
+        df[f'adjusted_{side}_gi'] = (df[f'{side}_gi'] - rng.random(size=game_count)).round(4)
+        df[f'{side}_move_number'] = rng.integers(10, 80, size=game_count)
+    return df
+
+@pytest.mark.parametrize('one_colour_players', [False, True])
+@pytest.mark.parametrize('value_names', [['gi', 'gpl', 'acpl', 'adjusted_gi'], ['gi', 'gpl', 'acpl']])
+def test_player_stats_equal_merge_cascade(one_colour_players, value_names):
+    df = game_table(one_colour_players)
+    pd.testing.assert_frame_equal(calculate_player_stats(df, value_names), player_stats_by_merges(df, value_names))